@@ -0,0 +1,282 @@
+import gzip
+import json
+import random
+import threading
+import itertools
+from datetime import date, datetime, timedelta, timezone
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+AGES = ['13-17', '18-24', '25-34', '35-44', '45-54', '55-64', '65+']
+GENDERS = ['female', 'male', 'unknown']
+REGIONS = [
+    'Acre', 'Alagoas', 'Amapá', 'Amazonas', 'Bahia', 'Ceará', 'Distrito Federal', 'Espírito Santo',
+    'Goiás', 'Maranhão', 'Mato Grosso', 'Mato Grosso do Sul', 'Minas Gerais', 'Pará', 'Paraíba',
+    'Paraná', 'Pernambuco', 'Piauí', 'Rio de Janeiro', 'Rio Grande do Norte', 'Rio Grande do Sul',
+    'Rondônia', 'Roraima', 'Santa Catarina', 'São Paulo', 'Sergipe', 'Tocantins',
+]
+ACTION_TYPES = [
+    'lead', 'link_click', 'page_engagement', 'post_engagement', 'video_view', 'comment',
+    'offsite_conversion.fb_pixel_lead', 'onsite_conversion.lead_grouped',
+    'onsite_conversion.messaging_first_reply', 'onsite_conversion.messaging_conversation_started_7d',
+    'purchase',
+]
+
+USAGE_HEADERS = {
+    'x-business-use-case-usage': json.dumps({'1': [{'type': 'ads_insights', 'call_count': 5, 'total_cputime': 5,
+                                                     'total_time': 5, 'estimated_time_to_regain_access': 0}]}),
+    'x-ad-account-usage': json.dumps({'acc_id_util_pct': 5, 'reset_time_duration': 0}),
+}
+
+
+class SyntheticAccount:
+    """Conta de anúncios sintética: ads × dias × combinações de quebra, gerada sob demanda por índice."""
+
+    def __init__(self, account_id: str = 'act_1000', n_ads: int = 100, n_regions: int = 27,
+                 n_forms: int = 20, leads_per_form_day: int = 5, seed: int = 42):
+        self.account_id = account_id
+        self.n_ads = n_ads
+        self.regions = REGIONS[:max(1, min(n_regions, len(REGIONS)))]
+        self.n_forms = n_forms
+        self.leads_per_form_day = leads_per_form_day
+        self.seed = seed
+
+    def ad(self, idx: int) -> dict:
+        adset_idx, campaign_idx = idx // 5, idx // 25
+        return {
+            'id': str(120000000000 + idx), 'name': f'Anúncio {idx}',
+            'adset_id': str(230000000000 + adset_idx), 'adset': {'id': str(230000000000 + adset_idx), 'name': f'Conjunto {adset_idx}'},
+            'campaign_id': str(340000000000 + campaign_idx), 'campaign': {'id': str(340000000000 + campaign_idx), 'name': f'Campanha {campaign_idx}'},
+        }
+
+    def combos(self, breakdowns: list) -> list:
+        if breakdowns == ['age', 'gender']:
+            return [{'age': a, 'gender': g} for a, g in itertools.product(AGES, GENDERS)]
+        if breakdowns == ['region']:
+            return [{'region': r} for r in self.regions]
+        return [{}]
+
+    def insight_row(self, day: date, ad_idx: int, combo: dict) -> dict:
+        rnd = random.Random(f'{self.seed}|{day}|{ad_idx}|{sorted(combo.items())}')
+        ad = self.ad(ad_idx)
+        impressions = rnd.randint(50, 5000)
+        clicks = rnd.randint(0, impressions // 20)
+        actions = [{'action_type': t, 'value': str(rnd.randint(1, 30))}
+                   for t in rnd.sample(ACTION_TYPES, rnd.randint(2, 7))]
+        row = {
+            'ad_id': ad['id'], 'adset_id': ad['adset_id'], 'campaign_id': ad['campaign_id'],
+            'impressions': str(impressions), 'clicks': str(clicks), 'spend': f'{rnd.uniform(1, 200):.2f}',
+            'actions': actions,
+            'action_values': [{'action_type': 'purchase', 'value': f'{rnd.uniform(10, 900):.2f}'}],
+            'date_start': day.isoformat(), 'date_stop': day.isoformat(),
+        }
+        row.update(combo)
+        return row
+
+    def insights_page(self, params: dict, offset: int, limit: int) -> tuple:
+        time_range = params['time_range']
+        since, until = date.fromisoformat(time_range['since']), date.fromisoformat(time_range['until'])
+        days = (until - since).days + 1
+        combos = self.combos(params.get('breakdowns') or [])
+        total = days * self.n_ads * len(combos)
+
+        rows = []
+        for i in range(offset, min(offset + limit, total)):
+            day_idx, rest = divmod(i, self.n_ads * len(combos))
+            ad_idx, combo_idx = divmod(rest, len(combos))
+            rows.append(self.insight_row(since + timedelta(days=day_idx), ad_idx, combos[combo_idx]))
+        return [row for row in (_select_insights(row, params) for row in rows) if row is not None], total
+
+    def lead(self, form_idx: int, day: date, n: int) -> dict:
+        ad = self.ad((form_idx * 7 + n) % self.n_ads)
+        return {
+            'id': f'{form_idx}{day:%Y%m%d}{n:04d}', 'created_time': f'{day}T12:{n % 60:02d}:00+0000',
+            'ad_id': ad['id'], 'adset_id': ad['adset_id'], 'campaign_id': ad['campaign_id'],
+            'form_id': str(450000000000 + form_idx),
+            'field_data': [
+                {'name': 'full_name', 'values': [f'Lead {n}']},
+                {'name': 'email', 'values': [f'lead{n}@example.com']},
+                {'name': 'phone_number', 'values': [f'+55119{n:08d}']},
+            ],
+            'ad_platform_data': {'platform': 'fb'},
+        }
+
+
+def _leads_period(params: dict) -> tuple:
+    """Dias pedidos ao /leads: filtro time_created (GREATER_THAN/LESS_THAN em segundos Unix) ou time_range."""
+    since = until = date.today()
+    time_range = params.get('time_range') or {}
+    if time_range:
+        since, until = date.fromisoformat(time_range['since']), date.fromisoformat(time_range['until'])
+    for rule in params.get('filtering') or []:
+        if rule.get('field') != 'time_created':
+            continue
+        if rule['operator'] == 'GREATER_THAN':
+            since = datetime.fromtimestamp(int(rule['value']) + 1, tz=timezone.utc).date()
+        elif rule['operator'] == 'LESS_THAN':
+            until = datetime.fromtimestamp(int(rule['value']) - 1, tz=timezone.utc).date()
+    return since, until
+
+
+def _select_insights(row: dict, params: dict):
+    """Aplica a seleção de campos e o filtro por action_type de uma chamada de Insights.
+
+    Como a Graph API, o filtro descarta as ações fora da lista e as linhas sem nenhuma delas
+    (devolve None). Datas e colunas das quebras sempre vêm.
+    """
+    fields = params.get('fields')
+    if fields:
+        fields = fields.split(',') if isinstance(fields, str) else fields
+        keep = set(fields) | {'date_start', 'date_stop'} | set(params.get('breakdowns') or [])
+        row = {key: value for key, value in row.items() if key in keep}
+    for rule in params.get('filtering') or []:
+        if rule.get('field') != 'action_type' or rule.get('operator') != 'IN':
+            continue
+        wanted = set(rule['value'])
+        for field in ('actions', 'action_values'):
+            if field in row:
+                row[field] = [a for a in row[field] if a['action_type'] in wanted]
+        if not row.get('actions'):
+            return None
+    return row
+
+
+def _paged(rows: list, offset: int, limit: int, total: int) -> dict:
+    body = {'data': rows}
+    if offset + limit < total:
+        body['paging'] = {'cursors': {'after': str(offset + limit)}, 'next': 'fake'}
+    return body
+
+
+class FakeGraphApi:
+    """Servidor HTTP local que imita os endpoints da Graph API usados pelo extract.py.
+
+    Atende /act_<id>/insights (síncrono e report runs assíncronos), /act_<id>/ads, /adsets,
+    /campaigns, /<page_id>/leadgen_forms e /<form_id>/leads, com paginação por cursor 'after'.
+    """
+
+    def __init__(self, account: SyntheticAccount, host: str = '127.0.0.1', port: int = 0):
+        self.account = account
+        self.requests = 0
+        self.bytes_sent = 0
+        self._report_runs = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _params(self) -> dict:
+                query = parse_qs(urlparse(self.path).query)
+                if self.command == 'POST':
+                    length = int(self.headers.get('Content-Length', 0))
+                    query.update(parse_qs(self.rfile.read(length).decode('utf-8')))
+                params = {}
+                for key, values in query.items():
+                    try:
+                        params[key] = json.loads(values[0])
+                    except ValueError:
+                        params[key] = values[0]
+                return params
+
+            def _send(self, body: dict, status: int = 200):
+                payload = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                if 'gzip' in self.headers.get('Accept-Encoding', ''):
+                    payload = gzip.compress(payload, compresslevel=6)
+                    self.send_header('Content-Encoding', 'gzip')
+                self.send_header('Content-Length', str(len(payload)))
+                for name, value in USAGE_HEADERS.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+                with fake._lock:
+                    fake.requests += 1
+                    fake.bytes_sent += len(payload)
+
+            def do_GET(self):
+                self._route()
+
+            def do_POST(self):
+                self._route()
+
+            def _route(self):
+                parts = [p for p in urlparse(self.path).path.split('/') if p]
+                if parts and parts[0].startswith('v'):
+                    parts = parts[1:]
+                params = self._params()
+                offset, limit = int(params.get('after', 0)), int(params.get('limit', 25))
+                account = fake.account
+
+                if len(parts) == 2 and parts[1] == 'insights' and parts[0] in fake._report_runs:
+                    run_params = fake._report_runs[parts[0]]
+                    rows, total = account.insights_page(run_params, offset, limit)
+                    return self._send(_paged(rows, offset, limit, total))
+
+                if len(parts) == 2 and parts[1] == 'insights':
+                    if self.command == 'POST':
+                        with fake._lock:
+                            run_id = str(900000000000 + len(fake._report_runs))
+                            fake._report_runs[run_id] = params
+                        return self._send({'report_run_id': run_id})
+                    rows, total = account.insights_page(params, offset, limit)
+                    return self._send(_paged(rows, offset, limit, total))
+
+                if len(parts) == 1 and parts[0] in fake._report_runs:
+                    return self._send({'id': parts[0], 'async_status': 'Job Completed', 'async_percent_completion': 100})
+
+                if len(parts) == 2 and parts[1] == 'ads':
+                    total = account.n_ads
+                    rows = [account.ad(i) for i in range(offset, min(offset + limit, total))]
+                    return self._send(_paged(rows, offset, limit, total))
+
+                if len(parts) == 2 and parts[1] in ('adsets', 'campaigns'):
+                    level = parts[1][:-1]
+                    # Um anúncio representativo por entidade: conjuntos a cada 5 anúncios, campanhas a cada 25
+                    step = 5 if level == 'adset' else 25
+                    total = (account.n_ads + step - 1) // step
+                    rows = []
+                    for i in range(offset, min(offset + limit, total)):
+                        entity = account.ad(i * step)[level]
+                        if level == 'adset':
+                            entity = dict(entity, campaign_id=account.ad(i * step)['campaign_id'])
+                        rows.append(entity)
+                    return self._send(_paged(rows, offset, limit, total))
+
+                if len(parts) == 2 and parts[1] == 'leadgen_forms':
+                    total = account.n_forms
+                    rows = [{'id': str(450000000000 + i)} for i in range(offset, min(offset + limit, total))]
+                    return self._send(_paged(rows, offset, limit, total))
+
+                if len(parts) == 2 and parts[1] == 'leads':
+                    form_idx = int(parts[0]) - 450000000000
+                    since, until = _leads_period(params)
+                    per_day = account.leads_per_form_day
+                    total = ((until - since).days + 1) * per_day
+                    rows = [account.lead(form_idx, since + timedelta(days=i // per_day), i % per_day)
+                            for i in range(offset, min(offset + limit, total))]
+                    return self._send(_paged(rows, offset, limit, total))
+
+                self._send({'error': {'message': f'Endpoint não simulado: {self.path}', 'code': 100}}, status=400)
+
+        return Handler
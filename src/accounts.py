@@ -0,0 +1,118 @@
+import os
+import threading
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dotenv import load_dotenv
+
+from . import cache, metrics
+from .ratelimit import scheduler
+from .extract import AD_ACCOUNT_IDS, format_account_id
+
+load_dotenv()
+
+# Processos que extraem/transformam contas em paralelo (padrão: núcleos da máquina)
+ACCOUNTS_MAX_PROCESSES = int(os.getenv("ACCOUNTS_MAX_PROCESSES", str(os.cpu_count() or 1)))
+# Chamadas simultâneas à Graph API por conta, somando todos os processos que a usam
+ACCOUNT_MAX_CONCURRENCY = int(os.getenv("ACCOUNT_MAX_CONCURRENCY", "4"))
+
+_lock = threading.Lock()
+_pool = None
+_manager = None
+_slots = {}
+
+
+def get_account_ids() -> list:
+    """Contas do portfólio (AD_ACCOUNT_IDS ou AD_ACCOUNT_ID), como configuradas e sem repetição.
+
+    Mantém o formato do .env (com ou sem 'act_') para não mudar a chave dos watermarks já gravados.
+    """
+    unique = {}
+    for account_id in AD_ACCOUNT_IDS:
+        unique.setdefault(format_account_id(account_id), account_id)
+    return list(unique.values())
+
+
+def _get_pool() -> tuple:
+    """Pool de processos compartilhado pelas tarefas do fluxo e o Manager dos semáforos por conta.
+
+    Usa 'spawn': o processo pai tem threads (DAG, métricas, loaders) e fork poderia herdar locks presos.
+    """
+    global _pool, _manager
+    with _lock:
+        if _pool is None:
+            context = multiprocessing.get_context('spawn')
+            _manager = context.Manager()
+            _pool = ProcessPoolExecutor(max_workers=max(1, ACCOUNTS_MAX_PROCESSES), mp_context=context)
+        return _pool, _manager
+
+
+def _account_slots(manager, account_id: str):
+    with _lock:
+        if account_id not in _slots:
+            _slots[account_id] = manager.BoundedSemaphore(max(1, ACCOUNT_MAX_CONCURRENCY))
+        return _slots[account_id]
+
+
+def _run_account(fn, account_id: str, kwargs: dict, replay: bool, slots) -> tuple:
+    """Executado no worker: roda fn para uma conta e devolve (resultado, métricas do worker)."""
+    metrics.reset()
+    if replay:
+        cache.set_replay(True)
+    scheduler.shared_slots = slots
+    try:
+        return fn(account_id=account_id, **kwargs), metrics.snapshot()
+    finally:
+        scheduler.shared_slots = None
+
+
+def run_per_account(fn, jobs: dict) -> tuple:
+    """Executa fn(account_id=..., **kwargs) para cada conta em jobs ({account_id: kwargs}).
+
+    Com uma conta só, roda no próprio processo. Com várias, distribui as contas no pool de
+    processos (a transformação usa todos os núcleos) e limita as chamadas simultâneas de cada
+    conta a ACCOUNT_MAX_CONCURRENCY entre todos os processos. fn precisa ser uma função de
+    módulo (picklable).
+
+    Devolve ({account_id: resultado}, {account_id: exceção}); uma conta com erro não impede as outras.
+    """
+    results, errors = {}, {}
+    if len(jobs) <= 1:
+        for account_id, kwargs in jobs.items():
+            try:
+                results[account_id] = fn(account_id=account_id, **kwargs)
+            except Exception as e:
+                traceback.print_exception(e)
+                print(f"[CONTAS] {account_id}: falhou — {e}")
+                errors[account_id] = e
+        return results, errors
+
+    pool, manager = _get_pool()
+    futures = {
+        pool.submit(_run_account, fn, account_id, kwargs, cache.REPLAY, _account_slots(manager, account_id)): account_id
+        for account_id, kwargs in jobs.items()
+    }
+    for future in as_completed(futures):
+        account_id = futures[future]
+        try:
+            result, worker_metrics = future.result()
+        except Exception as e:
+            traceback.print_exception(e)
+            print(f"[CONTAS] {account_id}: falhou — {e}")
+            errors[account_id] = e
+            continue
+        metrics.merge(worker_metrics)
+        results[account_id] = result
+
+    return results, errors
+
+
+def shutdown():
+    """Encerra o pool de processos e o Manager, se foram criados."""
+    global _pool, _manager
+    with _lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _manager.shutdown()
+        _pool, _manager = None, None
+        _slots.clear()
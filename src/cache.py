@@ -0,0 +1,188 @@
+import os
+import gzip
+import json
+import time
+import hashlib
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Cache em disco das respostas brutas da API (JSONL comprimido, um arquivo por chamada/janela)
+RAW_CACHE_ENABLED = os.getenv("RAW_CACHE", "0") == "1"
+RAW_CACHE_DIR = os.getenv("RAW_CACHE_DIR", ".etl_cache")
+RAW_CACHE_TTL_HOURS = float(os.getenv("RAW_CACHE_TTL_HOURS", "24"))
+RAW_CACHE_MAX_MB = float(os.getenv("RAW_CACHE_MAX_MB", "2048"))
+
+# Replay: lê apenas do cache (ignora TTL) e nunca chama a API
+REPLAY = os.getenv("ETL_REPLAY", "0") == "1"
+
+EVICT_INTERVAL_SECONDS = 60
+_last_evict = 0.0
+_evict_lock = threading.Lock()
+
+
+def set_replay(enabled: bool = True):
+    """Liga/desliga o modo replay em tempo de execução (ex.: flag --replay do main)."""
+    global REPLAY
+    REPLAY = enabled
+
+
+def is_active() -> bool:
+    return RAW_CACHE_ENABLED or REPLAY
+
+
+def cache_key(parts: dict) -> str:
+    """Chave estável a partir de conta, endpoint, parâmetros (nível, quebras, janela) e campos."""
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _path(key: str) -> str:
+    return os.path.join(RAW_CACHE_DIR, key[:2], f'{key}.jsonl.gz')
+
+
+def _is_fresh(path: str) -> bool:
+    if not os.path.exists(path):
+        return False
+    if REPLAY:
+        return True
+    return time.time() - os.path.getmtime(path) <= RAW_CACHE_TTL_HOURS * 3600
+
+
+def _iter_file(path: str):
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def _miss(parts: dict):
+    raise RuntimeError(f"Replay sem entrada no cache para {parts.get('endpoint')} {json.dumps(parts, default=str)[:200]}")
+
+
+def _remove(path: str):
+    """Remove uma entrada; outro processo pode já tê-la removido (ou substituído)."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def evict(force: bool = False):
+    """Remove entradas vencidas (TTL) e, se o cache passar de RAW_CACHE_MAX_MB, as mais antigas.
+
+    Uma limpeza por vez no processo; workers de outros processos podem limpar ao mesmo tempo,
+    então arquivos que somem durante a varredura são ignorados.
+    """
+    global _last_evict
+    if not os.path.isdir(RAW_CACHE_DIR):
+        return
+    with _evict_lock:
+        if not force and time.time() - _last_evict < EVICT_INTERVAL_SECONDS:
+            return
+        _last_evict = time.time()
+
+        entries = []
+        for root, _, files in os.walk(RAW_CACHE_DIR):
+            for name in files:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        now = time.time()
+        ttl_seconds = RAW_CACHE_TTL_HOURS * 3600
+        kept = []
+        for mtime, size, path in entries:
+            if now - mtime > ttl_seconds:
+                _remove(path)
+            else:
+                kept.append((mtime, size, path))
+
+        total_bytes = sum(size for _, size, _ in kept)
+        max_bytes = RAW_CACHE_MAX_MB * 1024 * 1024
+        for mtime, size, path in sorted(kept):
+            if total_bytes <= max_bytes:
+                break
+            _remove(path)
+            total_bytes -= size
+
+
+def _write_records(key: str, records):
+    """Grava os registros em arquivo temporário e publica com rename (entrada parcial nunca é lida).
+
+    É um gerador: repassa cada registro enquanto grava, para uso em streaming.
+    """
+    path = _path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+
+    completed = False
+    try:
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False, default=str))
+                f.write('\n')
+                yield record
+        completed = True
+    finally:
+        if completed:
+            os.replace(tmp_path, path)
+            evict()
+        elif os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def cached_records(parts: dict, fetch) -> list:
+    """Devolve os registros do cache ou chama fetch() (lista de dicts) e grava o resultado."""
+    if not is_active():
+        return fetch()
+
+    key = cache_key(parts)
+    path = _path(key)
+    if _is_fresh(path):
+        return list(_iter_file(path))
+    if REPLAY:
+        _miss(parts)
+
+    return list(_write_records(key, fetch()))
+
+
+def cached_record_stream(parts: dict, fetch_iter):
+    """Versão em streaming de cached_records: fetch_iter() gera dicts, que são gravados conforme passam."""
+    if not is_active():
+        yield from fetch_iter()
+        return
+
+    key = cache_key(parts)
+    path = _path(key)
+    if _is_fresh(path):
+        yield from _iter_file(path)
+        return
+    if REPLAY:
+        _miss(parts)
+
+    yield from _write_records(key, fetch_iter())
+
+
+def lookup_records(parts: dict) -> list:
+    """Só consulta o cache: devolve os registros ou None (sem chamar a API)."""
+    if not is_active():
+        return None
+    path = _path(cache_key(parts))
+    if _is_fresh(path):
+        return list(_iter_file(path))
+    if REPLAY:
+        _miss(parts)
+    return None
+
+
+def store_records(parts: dict, records: list):
+    """Grava registros obtidos fora de cached_records (ex.: resultado de um report run assíncrono)."""
+    if RAW_CACHE_ENABLED and not REPLAY:
+        for _ in _write_records(cache_key(parts), records):
+            pass
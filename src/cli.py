@@ -0,0 +1,63 @@
+import sys
+import argparse
+
+# Só argparse no topo: `--help` e erros de uso não importam pandas, SQLAlchemy nem o SDK do Meta.
+# Os módulos do fluxo são importados pelo subcomando que precisa deles.
+
+JOB_CHOICES = ['dim', 'performance', 'leads', 'raw_leads', 'all']
+BACKFILL_CHOICES = ['performance', 'leads', 'all']
+
+
+def _cmd_run(args) -> int:
+    from . import main as flow
+
+    jobs = flow.JOBS if 'all' in args.jobs else tuple(job for job in flow.JOB_TABLES if job in args.jobs)
+    return flow.run(jobs=jobs, since=args.since, until=args.until, replay=args.replay, dry_run=args.dry_run)
+
+
+def _cmd_backfill(args) -> int:
+    from . import main as flow
+
+    jobs = tuple(flow.BACKFILL_PIPELINES) if 'all' in args.jobs else tuple(job for job in flow.BACKFILL_PIPELINES if job in args.jobs)
+    return flow.run_backfill(since=args.since, until=args.until, jobs=jobs, resume=args.resume,
+                             replay=args.replay, dry_run=args.dry_run)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='python -m src', description='ETL Meta Ads → banco / Parquet.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='Extrai, transforma e carrega as tabelas escolhidas.')
+    run_parser.add_argument('jobs', nargs='+', choices=JOB_CHOICES,
+                            help='dim (ads_dimension), performance (ads_campaign_performance), '
+                                 'leads (ads_lead_insights), raw_leads (ads_raw_leads) ou all.')
+    run_parser.add_argument('--since', help='Data inicial (YYYY-MM-DD); desliga o modo incremental.')
+    run_parser.add_argument('--until', help='Data final (YYYY-MM-DD).')
+    run_parser.add_argument('--dry-run', action='store_true',
+                            help='Mostra contas e janelas que seriam processadas, sem chamar a API nem gravar.')
+    run_parser.add_argument('--replay', action='store_true',
+                            help='Roda transformações e cargas apenas a partir do cache de respostas (sem rede).')
+    run_parser.set_defaults(handler=_cmd_run)
+
+    backfill_parser = subparsers.add_parser(
+        'backfill', help='Recarrega um período longo em unidades (conta × tabela × janela) com checkpoint.')
+    backfill_parser.add_argument('jobs', nargs='+', choices=BACKFILL_CHOICES,
+                                 help='performance (ads_campaign_performance), leads (ads_lead_insights) ou all.')
+    backfill_parser.add_argument('--since', required=True, help='Data inicial (YYYY-MM-DD).')
+    backfill_parser.add_argument('--until', help='Data final (YYYY-MM-DD); padrão: hoje.')
+    backfill_parser.add_argument('--resume', action='store_true',
+                                 help='Pula as unidades já concluídas e refaz só as que falharam ou ficaram pela metade.')
+    backfill_parser.add_argument('--dry-run', action='store_true', help='Mostra as unidades que seriam processadas.')
+    backfill_parser.add_argument('--replay', action='store_true',
+                                 help='Roda transformações e cargas apenas a partir do cache de respostas (sem rede).')
+    backfill_parser.set_defaults(handler=_cmd_backfill)
+    return parser
+
+
+def main(argv: list = None) -> int:
+    args = build_parser().parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,211 @@
+import os
+import datetime
+import threading
+import pandas as pd
+from dotenv import load_dotenv
+from sqlalchemy import text
+
+from .schema import ALLOWED_ACTION_COLUMNS
+
+load_dotenv()
+
+# O loader cria/ajusta as tabelas de destino no PostgreSQL (0 = tabelas gerenciadas por fora)
+DB_MANAGE_DDL = os.getenv("DB_MANAGE_DDL", "1") == "1"
+
+_ID = 'BIGINT'
+_COUNT = 'BIGINT'
+_MONEY = 'NUMERIC(18,4)'
+_RATIO = 'DOUBLE PRECISION'
+
+# Definição das tabelas gerenciadas: colunas, chave primária (= chave do UPSERT), coluna de
+# particionamento mensal (None = sem partição) e índices para consultas de BI.
+TABLES = {
+    'ads_dimension': {
+        'columns': {
+            'account_id': f'{_ID} NOT NULL', 'ad_id': f'{_ID} NOT NULL', 'ad_name': 'TEXT',
+            'adset_id': _ID, 'adset_name': 'TEXT', 'campaign_id': _ID, 'campaign_name': 'TEXT',
+        },
+        'primary_key': ['account_id', 'ad_id'],
+        'partition_by': None,
+        'indexes': [['account_id', 'campaign_id'], ['account_id', 'adset_id']],
+    },
+    'ads_campaign_performance': {
+        'columns': {
+            'account_id': f'{_ID} NOT NULL', 'date_start': 'DATE NOT NULL', 'ad_id': f'{_ID} NOT NULL',
+            'adset_id': _ID, 'campaign_id': _ID,
+            'total_impressions': _COUNT, 'total_clicks': _COUNT, 'total_spend': _MONEY,
+            'total_leads': _COUNT, 'total_successes': _COUNT,
+            'cpc': _RATIO, 'ctr': _RATIO, 'cpl': _RATIO,
+        },
+        'primary_key': ['account_id', 'date_start', 'ad_id'],
+        'partition_by': 'date_start',
+        'indexes': [['account_id', 'campaign_id', 'date_start'], ['account_id', 'adset_id', 'date_start']],
+    },
+    'ads_lead_insights': {
+        'columns': {
+            'account_id': f'{_ID} NOT NULL', 'date_start': 'DATE NOT NULL', 'ad_id': f'{_ID} NOT NULL',
+            'adset_id': _ID, 'campaign_id': _ID,
+            'breakdown_type': 'TEXT NOT NULL', 'age': 'TEXT NOT NULL', 'gender': 'TEXT NOT NULL', 'region': 'TEXT NOT NULL',
+            'total_spend': _MONEY, 'total_leads': _COUNT,
+            **{col: _COUNT for col in ALLOWED_ACTION_COLUMNS if col != 'lead'},
+        },
+        'primary_key': ['account_id', 'date_start', 'ad_id', 'breakdown_type', 'age', 'gender', 'region'],
+        'partition_by': 'date_start',
+        'indexes': [['account_id', 'breakdown_type', 'date_start'], ['account_id', 'campaign_id', 'date_start']],
+    },
+    'ads_raw_leads': {
+        'columns': {
+            'account_id': f'{_ID} NOT NULL', 'lead_id': f'{_ID} NOT NULL', 'created_time': 'TIMESTAMPTZ',
+            'ad_id': _ID, 'adset_id': _ID, 'campaign_id': _ID, 'form_id': _ID,
+            'field_data': 'JSONB', 'ad_platform_data': 'JSONB',
+        },
+        'primary_key': ['lead_id'],
+        # Sem partição: a PK por lead_id não inclui a data; o índice cobre a leitura incremental por created_time
+        'partition_by': None,
+        'indexes': [['account_id', 'created_time'], ['account_id', 'form_id', 'created_time']],
+    },
+}
+
+# Agregados para BI mantidos por rollup.py (um por granularidade; sem partição, são pequenos)
+_CAMPAIGN_ROLLUP = {
+    'columns': {
+        'account_id': f'{_ID} NOT NULL', 'campaign_id': f'{_ID} NOT NULL', 'period_start': 'DATE NOT NULL',
+        'total_impressions': _COUNT, 'total_clicks': _COUNT, 'total_spend': _MONEY,
+        'total_leads': _COUNT, 'total_successes': _COUNT,
+        'cpc': _RATIO, 'ctr': _RATIO, 'cpl': _RATIO,
+    },
+    'primary_key': ['account_id', 'campaign_id', 'period_start'],
+    'partition_by': None,
+    'indexes': [['account_id', 'period_start']],
+}
+TABLES.update({
+    'ads_campaign_daily': _CAMPAIGN_ROLLUP,
+    'ads_campaign_weekly': _CAMPAIGN_ROLLUP,
+    'ads_campaign_monthly': _CAMPAIGN_ROLLUP,
+    'ads_lead_breakdown_monthly': {
+        'columns': {
+            'account_id': f'{_ID} NOT NULL', 'campaign_id': f'{_ID} NOT NULL', 'period_start': 'DATE NOT NULL',
+            'breakdown_type': 'TEXT NOT NULL', 'age': 'TEXT NOT NULL', 'gender': 'TEXT NOT NULL', 'region': 'TEXT NOT NULL',
+            'total_spend': _MONEY, 'total_leads': _COUNT, 'cpl': _RATIO,
+        },
+        'primary_key': ['account_id', 'campaign_id', 'period_start', 'breakdown_type', 'age', 'gender', 'region'],
+        'partition_by': None,
+        'indexes': [['account_id', 'breakdown_type', 'period_start']],
+    },
+})
+
+_lock = threading.Lock()
+_ensured = set()
+_partitions = set()
+
+
+def reset_cache():
+    """Esquece as tabelas/partições já garantidas neste processo (ex.: após um DROP externo)."""
+    with _lock:
+        _ensured.clear()
+        _partitions.clear()
+
+
+def _pg_type(series: pd.Series) -> str:
+    """Tipo PostgreSQL para uma coluna nova que não está na definição (ex.: ação nova do Meta)."""
+    if pd.api.types.is_bool_dtype(series):
+        return 'BOOLEAN'
+    if pd.api.types.is_integer_dtype(series):
+        return 'BIGINT'
+    if pd.api.types.is_float_dtype(series):
+        return 'DOUBLE PRECISION'
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return 'DATE'
+    return 'TEXT'
+
+
+def _month_start(value: datetime.date) -> datetime.date:
+    return value.replace(day=1)
+
+
+def _next_month(value: datetime.date) -> datetime.date:
+    return (value.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+
+
+def partition_name(table_name: str, month: datetime.date) -> str:
+    return f"{table_name}_p{month:%Y_%m}"
+
+
+def _create_table(connection, table_name: str, spec: dict):
+    cols_sql = ', '.join(f'"{col}" {col_type}' for col, col_type in spec['columns'].items())
+    pk_sql = ', '.join(f'"{col}"' for col in spec['primary_key'])
+    partition_sql = f' PARTITION BY RANGE ("{spec["partition_by"]}")' if spec['partition_by'] else ''
+    connection.execute(text(f'CREATE TABLE IF NOT EXISTS {table_name} ({cols_sql}, PRIMARY KEY ({pk_sql})){partition_sql}'))
+
+
+def _create_indexes(connection, table_name: str, spec: dict, columns: set):
+    """Índices de BI (no pai particionado, propagados para cada partição); pula os de colunas ausentes."""
+    for index_cols in spec['indexes']:
+        if not set(index_cols) <= columns:
+            print(f"[DDL: {table_name}] Índice em {index_cols} ignorado: colunas ausentes na tabela existente.")
+            continue
+        index_name = f"ix_{table_name}_{'_'.join(index_cols)}"
+        index_sql = ', '.join(f'"{col}"' for col in index_cols)
+        connection.execute(text(f'CREATE INDEX IF NOT EXISTS {index_name} ON {table_name} ({index_sql})'))
+
+
+def _existing_columns(connection, table_name: str) -> set:
+    return set(connection.execute(text(
+        "SELECT column_name FROM information_schema.columns WHERE table_name = :t AND table_schema = current_schema()"
+    ), {'t': table_name}).scalars())
+
+
+def _is_partitioned(connection, table_name: str) -> bool:
+    return connection.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.relname = :t AND c.relnamespace = current_schema()::regnamespace)"
+    ), {'t': table_name}).scalar()
+
+
+def ensure_partitions(connection, table_name: str, dates: pd.Series):
+    """Cria as partições mensais que cobrem as datas do lote (idempotente)."""
+    dates = pd.to_datetime(dates, errors='coerce').dropna()
+    if dates.empty:
+        return
+    month = _month_start(dates.min().date())
+    last = _month_start(dates.max().date())
+    while month <= last:
+        name = partition_name(table_name, month)
+        if name not in _partitions:
+            connection.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table_name} "
+                f"FOR VALUES FROM ('{month}') TO ('{_next_month(month)}')"
+            ))
+            _partitions.add(name)
+            print(f"[DDL: {table_name}] Partição {name} garantida.")
+        month = _next_month(month)
+
+
+def ensure_table(engine, table_name: str, df: pd.DataFrame):
+    """Garante a tabela gerenciada (com PK e índices), colunas novas do lote e as partições do período.
+
+    Tabelas fora de TABLES não são tocadas. Uma tabela já existente sem particionamento é
+    mantida como está (a migração é manual); só recebe colunas novas.
+    """
+    spec = TABLES.get(table_name)
+    if spec is None:
+        return
+
+    with _lock, engine.begin() as connection:
+        first_time = table_name not in _ensured
+        if first_time:
+            _create_table(connection, table_name, spec)
+
+        columns = _existing_columns(connection, table_name)
+        for col in [col for col in df.columns if col not in columns]:
+            connection.execute(text(f'ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS "{col}" {_pg_type(df[col])}'))
+            columns.add(col)
+            print(f"[DDL: {table_name}] Coluna '{col}' adicionada.")
+
+        if first_time:
+            _create_indexes(connection, table_name, spec, columns)
+            _ensured.add(table_name)
+
+        partition_col = spec['partition_by']
+        if partition_col and partition_col in df.columns and _is_partitioned(connection, table_name):
+            ensure_partitions(connection, table_name, df[partition_col])
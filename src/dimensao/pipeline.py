@@ -1,18 +1,7 @@
-from ..transform import run_etl_pipeline_dim
-from ..load import load_data_to_db 
+import sys
 
-DIM_TABLE = 'ads_dimension'
-TOTAL_DAYS_DIM = 1 
+from ..cli import main
 
-print(f'=== INICIANDO ETL: {DIM_TABLE} (Dimensão) ===')
-
-
-try:
-    df_dim = run_etl_pipeline_dim(total_days=TOTAL_DAYS_DIM) 
-    load_data_to_db(df_dim, table_name=DIM_TABLE)
-    print(f'=== ETL {DIM_TABLE} CONCLUÍDO COM SUCESSO ===')
-    
-except Exception as e:
-    print(f'ERRO CRÍTICO NO FLUXO ETL {DIM_TABLE}: {e}')
-    
-    exit(1)
\ No newline at end of file
+# Atalho para `python -m src run dim` (importar este módulo não executa nada)
+if __name__ == '__main__':
+    sys.exit(main(['run', 'dim', *sys.argv[1:]]))
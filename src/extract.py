@@ -1,13 +1,20 @@
 import os
+import time
 import datetime
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 
 
-from facebook_business.api import FacebookAdsApi
 from facebook_business.adobjects.leadgenform import LeadgenForm
 from facebook_business.adobjects.adaccount import AdAccount
+from facebook_business.adobjects.page import Page
 from facebook_business.adobjects.adsinsights import AdsInsights
+from facebook_business.adobjects.adreportrun import AdReportRun
+
+from . import cache, metrics, schema
+from . import names as names_cache
+from .ratelimit import init_api
 
 load_dotenv()
 
@@ -16,40 +23,90 @@ APP_ID = os.getenv("APP_ID")
 APP_SECRET = os.getenv("APP_SECRET")
 ACCESS_TOKEN = os.getenv("ACCESS_TOKEN")
 AD_ACCOUNT_ID = os.getenv("AD_ACCOUNT_ID")
+# Portfólio: lista separada por vírgulas; sem ela, só o AD_ACCOUNT_ID
+AD_ACCOUNT_IDS = [a.strip() for a in os.getenv("AD_ACCOUNT_IDS", AD_ACCOUNT_ID or "").split(",") if a.strip()]
 
+# Download de leads: formulários em paralelo e, opcionalmente, primeira página via Graph batch
+LEADS_MAX_WORKERS = int(os.getenv("LEADS_MAX_WORKERS", "8"))
+LEADS_USE_BATCH = os.getenv("LEADS_USE_BATCH", "0") == "1"
+LEADS_BATCH_SIZE = 50  # limite de requisições por batch da Graph API
+# Páginas cujos formulários de cadastro alimentam ads_raw_leads (lista separada por vírgulas)
+LEADS_PAGE_IDS = [p.strip() for p in os.getenv("LEADS_PAGE_IDS", os.getenv("PAGE_ID", "")).split(",") if p.strip()]
+# Conta dos leads orgânicos (sem anúncio) e dos anúncios ainda fora do cache de nomes
+LEADS_FALLBACK_ACCOUNT_ID = os.getenv("LEADS_FALLBACK_ACCOUNT_ID", AD_ACCOUNT_ID or (AD_ACCOUNT_IDS[0] if AD_ACCOUNT_IDS else ""))
 
+# Sharding de datas: períodos longos são divididos em janelas (1 = dia, 7 = semana)
+INSIGHTS_SHARD_DAYS = int(os.getenv("INSIGHTS_SHARD_DAYS", "1"))
+INSIGHTS_MAX_WORKERS = int(os.getenv("INSIGHTS_MAX_WORKERS", "4"))
 
+# Modo streaming: linhas por bloco entregue ao transform/load
+STREAM_CHUNK_ROWS = int(os.getenv("STREAM_CHUNK_ROWS", "5000"))
 
+# Modo assíncrono de Insights (report runs): recomendado para backfills longos
+INSIGHTS_ASYNC = os.getenv("INSIGHTS_ASYNC", "0") == "1"
+INSIGHTS_ASYNC_MAX_JOBS = int(os.getenv("INSIGHTS_ASYNC_MAX_JOBS", "4"))
+INSIGHTS_ASYNC_WINDOW_DAYS = int(os.getenv("INSIGHTS_ASYNC_WINDOW_DAYS", "7"))
+INSIGHTS_ASYNC_POLL_SECONDS = float(os.getenv("INSIGHTS_ASYNC_POLL_SECONDS", "5"))
+INSIGHTS_ASYNC_TIMEOUT_SECONDS = float(os.getenv("INSIGHTS_ASYNC_TIMEOUT_SECONDS", "3600"))
+INSIGHTS_ASYNC_MAX_RETRIES = int(os.getenv("INSIGHTS_ASYNC_MAX_RETRIES", "2"))
 
-def _init_api_and_get_timerange(total_days: int) -> tuple:
-    """Inicializa a API do Meta e calcula o time_range para extrações."""
-    if not all([APP_ID, APP_SECRET, ACCESS_TOKEN, AD_ACCOUNT_ID]):
-        print('ERRO: Credenciais do Meta Ads (LEADS_) não encontradas no .env.')
-        return None, None
-    
-    FacebookAdsApi.init(APP_ID, APP_SECRET, ACCESS_TOKEN)
-    api = FacebookAdsApi.get_default_api()
 
-    
-    now = datetime.datetime.now()
 
-    
-    date_end = now
-    
-    HOURS_TO_PULL = 3  
-    
-    date_start = now - datetime.timedelta(hours=HOURS_TO_PULL)
-    
-    
-    time_range = {
+
+
+def _resolve_time_range(total_days: int, since: str = None, until: str = None) -> dict:
+    """Calcula o time_range {'since', 'until'} (formato YYYY-MM-DD).
+
+    Sem since/until explícitos, o período cobre os últimos total_days dias completos mais o dia corrente.
+    """
+    date_end = datetime.datetime.strptime(until, '%Y-%m-%d').date() if until else datetime.date.today()
+    if since:
+        date_start = datetime.datetime.strptime(since, '%Y-%m-%d').date()
+    else:
+        date_start = date_end - datetime.timedelta(days=max(0, total_days))
+
+    return {
         'since': date_start.strftime('%Y-%m-%d'),
         'until': date_end.strftime('%Y-%m-%d')
     }
 
-    
-    account_id_clean = AD_ACCOUNT_ID.replace("act_", "")
-    formatted_account_id = f"act_{account_id_clean}"
-    account = AdAccount(formatted_account_id, api=api)
+
+def get_time_windows(total_days: int, since: str = None, until: str = None, window_days: int = None) -> list:
+    """Divide o período de extração em janelas de window_days dias (padrão: INSIGHTS_SHARD_DAYS)."""
+    return _split_time_range(_resolve_time_range(total_days, since, until), window_days or INSIGHTS_SHARD_DAYS)
+
+
+def format_account_id(account_id: str = None) -> str:
+    """Normaliza o ID da conta para 'act_<número>' (padrão: AD_ACCOUNT_ID)."""
+    account_id_clean = str(account_id or AD_ACCOUNT_ID).replace("act_", "")
+    return f"act_{account_id_clean}"
+
+
+def _tag_account(df: pd.DataFrame, account: AdAccount) -> pd.DataFrame:
+    """Adiciona a coluna account_id (número da conta) na frente do DataFrame extraído."""
+    if not df.empty and 'account_id' not in df.columns:
+        df.insert(0, 'account_id', int(account.get_id().replace("act_", "")))
+    return df
+
+
+def _init_api_and_get_timerange(total_days: int, since: str = None, until: str = None, account_id: str = None) -> tuple:
+    """Inicializa a API do Meta e calcula o time_range para extrações.
+
+    account_id escolhe a conta (padrão: AD_ACCOUNT_ID). No modo replay (cache.REPLAY) basta o
+    ID da conta: nenhuma chamada chega à API.
+    """
+    account_id = account_id or AD_ACCOUNT_ID
+    if cache.REPLAY and account_id:
+        api = None
+    elif not all([APP_ID, APP_SECRET, ACCESS_TOKEN, account_id]):
+        print('ERRO: Credenciais do Meta Ads (LEADS_) não encontradas no .env.')
+        return None, None
+    else:
+        api = init_api(APP_ID, APP_SECRET, ACCESS_TOKEN)
+
+    time_range = _resolve_time_range(total_days, since, until)
+
+    account = AdAccount(format_account_id(account_id), api=api)
     
     return account, time_range
 
@@ -57,119 +114,300 @@ def _init_api_and_get_timerange(total_days: int) -> tuple:
 
 
 
-def get_raw_leads_data(total_days: int = 182) -> pd.DataFrame:
-    """Extrai dados brutos de leads via API do Facebook."""
-    account, time_range = _init_api_and_get_timerange(total_days)
-    if account is None: return pd.DataFrame()
+LEAD_FIELDS = [
+    'id', 'created_time', 'ad_id', 'campaign_id', 'adset_id',
+    'form_id', 'field_data', 'ad_platform_data'
+]
 
-    print(f"\n[EXTRAÇÃO: Leads Brutos] Iniciando extração de {total_days} dias...")
-    all_leads = []
-    
-    try:
-        
-        forms_cursor = account.get_lead_gen_forms(
-            fields=['id'],
-            params={'limit': 100}
-        )
-        forms_data = [form.export_all_data() for form in forms_cursor]
-
-        for form_obj in forms_data:
-            form_id = form_obj.get('id')
-
-            lead_fields = [
-                'id', 'created_time', 'ad_id', 'campaign_id', 'adset_id',
-                'form_id', 'field_data', 'ad_platform_data'
-            ]
 
-            
-            leads_cursor = LeadgenForm(form_id, api=account.api).get_leads(
-                fields=lead_fields,
-                params={'time_range': time_range, 'limit': 100}
+def _leads_to_frame(records: list) -> pd.DataFrame:
+    """Converte uma página de leads exportados em DataFrame, renomeando 'id' para 'lead_id'."""
+    df = pd.DataFrame(records)
+    if not df.empty:
+        df['lead_id'] = df.pop('id') if 'id' in df.columns else None
+    return df
+
+
+def _leads_params(time_range: dict) -> dict:
+    """Filtro do edge /leads por created_time (time_created em segundos Unix; 'until' inclusivo, em UTC)."""
+    since = datetime.datetime.strptime(time_range['since'], '%Y-%m-%d').replace(tzinfo=datetime.timezone.utc)
+    until = datetime.datetime.strptime(time_range['until'], '%Y-%m-%d').replace(tzinfo=datetime.timezone.utc)
+    return {
+        'filtering': [
+            {'field': 'time_created', 'operator': 'GREATER_THAN', 'value': int(since.timestamp()) - 1},
+            {'field': 'time_created', 'operator': 'LESS_THAN', 'value': int((until + datetime.timedelta(days=1)).timestamp())},
+        ],
+        'limit': 100,
+    }
+
+
+def _fetch_form_leads(api, form_id: str, time_range: dict, after: str = None) -> pd.DataFrame:
+    """Baixa os leads de um formulário criados no período (a partir do cursor 'after', se informado)."""
+    params = _leads_params(time_range)
+    if after:
+        params['after'] = after
+
+    def fetch():
+        leads_cursor = LeadgenForm(form_id, api=api).get_leads(fields=LEAD_FIELDS, params=params)
+        return [lead.export_all_data() for lead in leads_cursor]
+
+    parts = {'endpoint': 'leads', 'form_id': form_id, 'fields': LEAD_FIELDS, 'params': params}
+    return _leads_to_frame(cache.cached_records(parts, fetch))
+
+
+def _fetch_first_pages_batch(api, form_ids: list, time_range: dict) -> dict:
+    """Busca a primeira página de leads de vários formulários em Graph batch requests.
+
+    Devolve {form_id: (DataFrame da primeira página, cursor 'after' ou None)}. Formulários cuja
+    chamada falhou ficam de fora e são baixados pelo caminho normal.
+    """
+    first_pages = {}
+
+    def on_success(form_id):
+        def callback(response):
+            body = response.json()
+            paging = body.get('paging', {})
+            after = paging.get('cursors', {}).get('after') if paging.get('next') else None
+            first_pages[form_id] = (_leads_to_frame(body.get('data', [])), after)
+        return callback
+
+    def on_failure(form_id):
+        def callback(response):
+            print(f"[EXTRAÇÃO: Leads Brutos] Falha no batch do formulário {form_id}: {response.error()}")
+        return callback
+
+    for i in range(0, len(form_ids), LEADS_BATCH_SIZE):
+        batch = api.new_batch()
+        for form_id in form_ids[i:i + LEADS_BATCH_SIZE]:
+            LeadgenForm(form_id, api=api).get_leads(
+                fields=LEAD_FIELDS,
+                params=_leads_params(time_range),
+                batch=batch,
+                success=on_success(form_id),
+                failure=on_failure(form_id),
             )
+        while batch is not None:
+            batch = batch.execute()
+
+    return first_pages
+
+
+def _fetch_lead_form_ids(api, page_ids: list) -> list:
+    """IDs dos formulários de cadastro das Páginas (formulários pertencem à Página, não à conta)."""
+    form_ids = []
+    for page_id in page_ids:
+
+        def fetch_forms(page_id=page_id):
+            forms_cursor = Page(page_id, api=api).get_lead_gen_forms(fields=['id'], params={'limit': 100})
+            return [form.export_all_data() for form in forms_cursor]
+
+        forms = cache.cached_records({'page': page_id, 'endpoint': 'leadgen_forms'}, fetch_forms)
+        form_ids += [form['id'] for form in forms]
+    return form_ids
+
+
+def _ad_accounts() -> dict:
+    """ad_id → conta (número, como em _tag_account) a partir do cache de nomes de cada conta do portfólio."""
+    ad_accounts = {}
+    for account_id in AD_ACCOUNT_IDS:
+        number = int(format_account_id(account_id).replace('act_', ''))
+        ad_accounts.update({ad_id: number for ad_id in names_cache.load_names(account_id)['ad']})
+    return ad_accounts
+
+
+def _tag_leads_accounts(df: pd.DataFrame, ad_accounts: dict, fallback_account: int) -> pd.DataFrame:
+    """Adiciona account_id pela conta do anúncio de cada lead; orgânicos e anúncios desconhecidos ficam com fallback_account."""
+    if 'ad_id' in df.columns:
+        account_ids = df['ad_id'].map(lambda ad_id: ad_accounts.get(str(ad_id)) if pd.notna(ad_id) else None)
+        account_ids = account_ids.fillna(fallback_account).astype('int64')
+    else:
+        account_ids = fallback_account
+    df.insert(0, 'account_id', account_ids)
+    return df
+
+
+def iter_raw_leads_data(total_days: int = 182, since: str = None, until: str = None, chunk_rows: int = None,
+                        max_workers: int = None, use_batch: bool = None, page_id: str = None):
+    """Streaming dos leads brutos criados no período, em blocos de até chunk_rows leads.
+
+    Os leads são lidos uma vez por Página (page_id ou, sem ele, todas as de LEADS_PAGE_IDS) e cada
+    um recebe a conta do seu anúncio segundo o cache de nomes; leads orgânicos e de anúncios ainda
+    desconhecidos ficam com LEADS_FALLBACK_ACCOUNT_ID. Os formulários são baixados em paralelo
+    (até LEADS_MAX_WORKERS threads) e entregues à medida que terminam. Com use_batch (ou
+    LEADS_USE_BATCH=1), a primeira
+    página de cada formulário vem de Graph batch requests e só os formulários com mais páginas
+    seguem para o pool; com o cache de respostas ativo, o batch é desligado para que cada
+    formulário seja lido/gravado no cache. Erros são propagados (não viram zero linhas).
+    """
+    account, time_range = _init_api_and_get_timerange(total_days, since=since, until=until,
+                                                      account_id=LEADS_FALLBACK_ACCOUNT_ID)
+    if account is None: return
+    page_ids = [page_id] if page_id else LEADS_PAGE_IDS
+    if not page_ids:
+        print('[EXTRAÇÃO: Leads Brutos] LEADS_PAGE_IDS não configurado; nenhum formulário para baixar.')
+        return
+
+    chunk_rows = chunk_rows or STREAM_CHUNK_ROWS
+    if max_workers is None:
+        max_workers = LEADS_MAX_WORKERS
+    if use_batch is None:
+        use_batch = LEADS_USE_BATCH
+    if cache.is_active():
+        use_batch = False
+
+    chunk_str = f", em blocos de {chunk_rows}" if chunk_rows != float('inf') else ''
+    print(f"\n[EXTRAÇÃO: Leads Brutos] Leads criados de {time_range['since']} a {time_range['until']}{chunk_str}...")
+
+    api = account.get_api()
+    form_ids = _fetch_lead_form_ids(api, page_ids)
+    ad_accounts = _ad_accounts()
+    fallback_account = int(account.get_id().replace('act_', ''))
+    pending = {form_id: None for form_id in form_ids}
+    buffer, buffered, total_rows = [], 0, 0
+    started = time.perf_counter()
+
+    def collect(df):
+        nonlocal buffered
+        if not df.empty:
+            buffer.append(df)
+            buffered += len(df)
+
+    def flush():
+        nonlocal buffer, buffered, total_rows
+        df = _tag_leads_accounts(pd.concat(buffer, ignore_index=True), ad_accounts, fallback_account)
+        metrics.record_stage('extract.raw_leads', time.perf_counter() - started, rows_out=len(df))
+        total_rows += len(df)
+        buffer, buffered = [], 0
+        return df
+
+    if use_batch and form_ids:
+        for form_id, (df_page, after) in _fetch_first_pages_batch(api, form_ids, time_range).items():
+            collect(df_page)
+            if after:
+                pending[form_id] = after
+            else:
+                del pending[form_id]
+
+    if pending:
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            futures = [
+                executor.submit(_fetch_form_leads, api, form_id, time_range, after)
+                for form_id, after in pending.items()
+            ]
+            for future in as_completed(futures):
+                collect(future.result())
+                if buffered >= chunk_rows:
+                    # O tempo medido exclui o período em que o bloco está com o consumidor (transform/load)
+                    yield flush()
+                    started = time.perf_counter()
+
+    if buffer:
+        yield flush()
+
+    print(f"[EXTRAÇÃO: Leads Brutos] Extraídos {total_rows} leads de {len(form_ids)} formulários.")
+
+
+def get_raw_leads_data(total_days: int = 182, since: str = None, until: str = None,
+                       max_workers: int = None, use_batch: bool = None, page_id: str = None) -> pd.DataFrame:
+    """Extrai dados brutos de leads via API do Facebook (todos os blocos de iter_raw_leads_data em um DataFrame)."""
+    frames = list(iter_raw_leads_data(total_days, since=since, until=until, chunk_rows=float('inf'),
+                                      max_workers=max_workers, use_batch=use_batch, page_id=page_id))
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+
+
+
+
+# Status dos anúncios que entram na dimensão
+DIM_AD_STATUSES = ['ACTIVE', 'PAUSED', 'PENDING_REVIEW']
+
+DIM_ENDPOINTS = {
+    'ad': ('ads', ['id', 'name', 'adset_id', 'campaign_id', 'updated_time']),
+    'adset': ('adsets', ['id', 'name', 'campaign_id', 'updated_time']),
+    'campaign': ('campaigns', ['id', 'name', 'updated_time']),
+}
 
-            for lead in leads_cursor:
-                lead_data = lead.export_all_data()
-                lead_data['lead_id'] = lead_data.pop('id', None)
-                all_leads.append(lead_data)
 
-        print(f"[EXTRAÇÃO: Leads Brutos] Extraídos {len(all_leads)} leads de {len(forms_data)} formulários.")
-        return pd.DataFrame(all_leads)
+def _fetch_dim_entities(account: AdAccount, level: str, updated_since: datetime.date = None) -> list:
+    """Lista anúncios, conjuntos ou campanhas (só os alterados desde updated_since, se informado)."""
+    endpoint, fields = DIM_ENDPOINTS[level]
+    filtering = []
+    if level == 'ad':
+        filtering.append({'field': 'ad.effective_status', 'operator': 'IN', 'value': DIM_AD_STATUSES})
+    if updated_since is not None:
+        since_ts = int(datetime.datetime.combine(updated_since, datetime.time()).timestamp())
+        filtering.append({'field': 'updated_time', 'operator': 'GREATER_THAN', 'value': since_ts})
+    params = {'filtering': filtering, 'limit': 1000}
 
-    except Exception as e:
-        print(f'[EXTRAÇÃO: Leads Brutos] Erro fatal na extração: {e}')
-        return pd.DataFrame()
+    def fetch():
+        getter = {'ad': account.get_ads, 'adset': account.get_ad_sets, 'campaign': account.get_campaigns}[level]
+        return [entity.export_all_data() for entity in getter(fields=fields, params=params)]
 
+    parts = {'account': account.get_id(), 'endpoint': endpoint, 'fields': fields, 'params': params}
+    return cache.cached_records(parts, fetch)
 
 
+def _merge_dim_names(names: dict, level: str, records: list) -> set:
+    """Atualiza o cache de nomes com as entidades recebidas e devolve os IDs alterados."""
+    changed = set()
+    for record in records:
+        entity_id = str(record['id'])
+        entry = {'name': record.get('name')}
+        for parent in ('adset_id', 'campaign_id'):
+            if record.get(parent):
+                entry[parent] = str(record[parent])
+        names[level][entity_id] = entry
+        changed.add(entity_id)
+    return changed
 
 
-def get_name_dim_raw(total_days: int = 1) -> pd.DataFrame:
-    """Extrai IDs e Nomes para a tabela de Dimensão (ads_dimension) usando o endpoint /ads."""
+@metrics.timed('extract.dimension')
+def get_name_dim_raw(total_days: int = 1, account_id: str = None, updated_since: datetime.date = None) -> pd.DataFrame:
+    """Extrai IDs e Nomes para a tabela de Dimensão (ads_dimension).
+
+    Anúncios, conjuntos e campanhas vêm de /ads, /adsets e /campaigns (o nome de cada conjunto e
+    campanha é baixado uma vez, não uma vez por anúncio) e alimentam o cache local de nomes
+    (names.py). Com updated_since, só as entidades alteradas desde essa data são pedidas à API e
+    a saída traz apenas os anúncios afetados (o próprio anúncio, seu conjunto ou sua campanha
+    mudou); sem cache de nomes da conta, a sincronização é completa.
+    """
        
-    account, _ = _init_api_and_get_timerange(total_days)
+    account, _ = _init_api_and_get_timerange(total_days, account_id=account_id)
     if account is None: return pd.DataFrame()
-    
-    print(f"\n[EXTRAÇÃO: Dimensão (Nomes)] Iniciando extração de IDs e Nomes...")
-
-    try:
-        
-        ad_fields = [
-            'id', 'name', 
-            'adset_id', 
-            'adset{name}',  
-            'campaign_id', 
-            'campaign{name}',
-        ]
-        
-        params = {
-            'filtering': [
-                {'field': 'ad.effective_status', 'operator': 'IN', 'value': ['ACTIVE', 'PAUSED', 'PENDING_REVIEW']},
-            ],
-            'limit': 1000
-        }
-        
-        ads_cursor = account.get_ads(
-            fields=ad_fields,
-            params=params
-        )
-        
-        data = [ad.export_all_data() for ad in ads_cursor]
-        df = pd.DataFrame(data)
-        
-        if not df.empty:
-            
-            df = df.rename(columns={'id': 'ad_id', 'name': 'ad_name'}, errors='ignore')
-            
-
-            if 'adset' in df.columns:
-                
-                df['adset_name'] = df['adset'].apply(lambda x: x.get('name') if isinstance(x, dict) else None)
-                
-                df['adset_id'] = df['adset'].apply(lambda x: x.get('id') if isinstance(x, dict) and x.get('id') else x.get('id') if x else None)
-                df = df.drop(columns=['adset'], errors='ignore')
-
-            if 'campaign' in df.columns:
-                
-                df['campaign_name'] = df['campaign'].apply(lambda x: x.get('name') if isinstance(x, dict) else None)
-                
-                df['campaign_id'] = df['campaign'].apply(lambda x: x.get('id') if isinstance(x, dict) and x.get('id') else x.get('id') if x else None)
-                df = df.drop(columns=['campaign'], errors='ignore')
-            
-            
-            required_cols = ['ad_id', 'ad_name', 'adset_id', 'adset_name', 'campaign_id', 'campaign_name']
-            for col in required_cols:
-                if col not in df.columns:
-                    df[col] = None 
-            
-        print(f"[EXTRAÇÃO: Dimensão (Nomes)] Extraídos {len(df)} anúncios.")
-        return df
-    
-    except Exception as e:
-        print(f'[EXTRAÇÃO: Dimensão (Nomes)] Erro fatal na extração: {e}')
-        return pd.DataFrame()
 
+    if updated_since is not None and not names_cache.has_names(account.get_id()):
+        print("[EXTRAÇÃO: Dimensão (Nomes)] Cache de nomes vazio: sincronização completa.")
+        updated_since = None
+
+    mode_str = f"alterados desde {updated_since}" if updated_since else "completa"
+    print(f"\n[EXTRAÇÃO: Dimensão (Nomes)] Iniciando extração de IDs e Nomes ({mode_str})...")
+
+    names = names_cache.load_names(account.get_id()) if updated_since else {level: {} for level in names_cache.LEVELS}
 
+    changed = {level: _merge_dim_names(names, level, _fetch_dim_entities(account, level, updated_since))
+               for level in ('campaign', 'adset', 'ad')}
 
+    affected = [
+        ad_id for ad_id, ad in names['ad'].items()
+        if ad_id in changed['ad'] or ad.get('adset_id') in changed['adset'] or ad.get('campaign_id') in changed['campaign']
+    ]
+
+    rows = []
+    for ad_id in affected:
+        ad = names['ad'][ad_id]
+        rows.append({
+            'ad_id': ad_id, 'ad_name': ad.get('name'),
+            'adset_id': ad.get('adset_id'), 'adset_name': names['adset'].get(ad.get('adset_id'), {}).get('name'),
+            'campaign_id': ad.get('campaign_id'), 'campaign_name': names['campaign'].get(ad.get('campaign_id'), {}).get('name'),
+        })
+    df = pd.DataFrame(rows, columns=['ad_id', 'ad_name', 'adset_id', 'adset_name', 'campaign_id', 'campaign_name'])
+
+    names_cache.save_names(account.get_id(), names)
+
+    print(f"[EXTRAÇÃO: Dimensão (Nomes)] Extraídos {len(df)} anúncios "
+          f"({len(changed['ad'])} anúncios, {len(changed['adset'])} conjuntos e {len(changed['campaign'])} campanhas alterados).")
+    return _tag_account(df, account)
 
 
 
@@ -187,59 +425,283 @@ INSIGHTS_FIELDS = [
     AdsInsights.Field.action_values,
 ]
 
-def _get_insights_data(total_days: int, level: str, breakdown: list = None) -> pd.DataFrame:
-    """Função genérica para extrair Ads Insights."""
-    account, time_range = _init_api_and_get_timerange(total_days)
+# O que cada pipeline pede à API de Insights: campos e action_types (declarados em schema; o
+# transform troca '.' por '_' no nome da coluna).
+CAMPAIGN_INSIGHTS = {
+    'fields': [
+        AdsInsights.Field.ad_id, AdsInsights.Field.adset_id, AdsInsights.Field.campaign_id,
+        AdsInsights.Field.impressions, AdsInsights.Field.clicks, AdsInsights.Field.spend,
+        AdsInsights.Field.actions,
+    ],
+    'action_types': schema.CAMPAIGN_ACTION_TYPES,
+}
+
+LEAD_INSIGHTS = {
+    'fields': [
+        AdsInsights.Field.ad_id, AdsInsights.Field.adset_id, AdsInsights.Field.campaign_id,
+        AdsInsights.Field.spend, AdsInsights.Field.actions,
+    ],
+    'action_types': schema.LEAD_ACTION_TYPES,
+}
+
+# Filtra action_type também no servidor (1 = liga). O Meta omite as linhas sem nenhuma das ações
+# pedidas, então gasto/impressões de anúncios sem essas ações deixam de vir: desligado por padrão.
+INSIGHTS_FILTER_ACTION_TYPES = os.getenv("INSIGHTS_FILTER_ACTION_TYPES", "0") == "1"
+
+ACTION_LIST_FIELDS = (AdsInsights.Field.actions, AdsInsights.Field.action_values)
+
+# Sem declaração: todos os campos e todas as ações
+FULL_INSIGHTS = {'fields': INSIGHTS_FIELDS, 'action_types': None}
+
+
+def _build_insights_params(level: str, breakdown: list, time_range: dict, action_types: list = None) -> dict:
+    """Parâmetros comuns das chamadas de Insights (diário, nível, quebras e ações pedidas)."""
+    params = {
+        'level': level,
+        'time_range': time_range,
+        'time_increment': 1, 
+        'filtering': [],
+        'limit': 1000,
+    }
+    if breakdown:
+        params['breakdowns'] = breakdown
+    if action_types:
+        params['action_breakdowns'] = ['action_type']
+        if INSIGHTS_FILTER_ACTION_TYPES:
+            params['filtering'].append({'field': 'action_type', 'operator': 'IN', 'value': list(action_types)})
+    return params
+
+
+def _slim_record(record: dict, action_types: list = None) -> dict:
+    """Mantém em 'actions'/'action_values' só os action_types pedidos (None = todos)."""
+    if action_types:
+        wanted = set(action_types)
+        for field in ACTION_LIST_FIELDS:
+            if isinstance(record.get(field), list):
+                record[field] = [a for a in record[field] if a.get('action_type') in wanted]
+    return record
+
+
+def _ensure_date_columns(df: pd.DataFrame, time_range: dict) -> pd.DataFrame:
+    """Garante date_start/date_stop quando a API não os devolve (usa os limites do time_range)."""
+    if 'date_start' not in df.columns:
+        df['date_start'] = time_range['since'].split(' ')[0]
+        df['date_stop'] = time_range['until'].split(' ')[0]
+    return df
+
+
+def _split_time_range(time_range: dict, window_days: int) -> list:
+    """Divide um time_range {'since', 'until'} em janelas consecutivas de até window_days dias."""
+    since = datetime.datetime.strptime(time_range['since'], '%Y-%m-%d').date()
+    until = datetime.datetime.strptime(time_range['until'], '%Y-%m-%d').date()
+    window_days = max(1, window_days)
+
+    windows = []
+    window_start = since
+    while window_start <= until:
+        window_end = min(window_start + datetime.timedelta(days=window_days - 1), until)
+        windows.append({
+            'since': window_start.strftime('%Y-%m-%d'),
+            'until': window_end.strftime('%Y-%m-%d')
+        })
+        window_start = window_end + datetime.timedelta(days=1)
+    return windows
+
+
+def _insights_cache_parts(account: AdAccount, params: dict, time_range: dict, spec: dict) -> dict:
+    """Identifica uma janela de Insights no cache: conta, nível, quebras, campos, ações e datas."""
+    return {
+        'account': account.get_id(),
+        'endpoint': 'insights',
+        'fields': spec['fields'],
+        'action_types': spec['action_types'],
+        'params': dict(params, time_range=time_range),
+    }
+
+
+def _fetch_insights_window(account: AdAccount, params: dict, time_range: dict, spec: dict) -> list:
+    """Extrai (síncrono) todas as páginas de Insights de uma única janela de datas."""
+    def fetch():
+        insights = account.get_insights(fields=spec['fields'], params=dict(params, time_range=time_range))
+        return [_slim_record(insight.export_all_data(), spec['action_types']) for insight in insights]
+
+    return cache.cached_records(_insights_cache_parts(account, params, time_range, spec), fetch)
+
+
+def _run_insights_sharded(account: AdAccount, params: dict, windows: list, max_workers: int, log_prefix: str,
+                          spec: dict) -> list:
+    """Extrai as janelas em um pool de threads limitado e concatena as linhas na ordem das janelas."""
+    workers = max(1, min(max_workers, len(windows)))
+    print(f"{log_prefix} {len(windows)} janela(s) em {workers} worker(s).")
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(lambda window: _fetch_insights_window(account, params, window, spec), windows)
+        return [row for window_rows in results for row in window_rows]
+
+
+def _submit_insights_job(account: AdAccount, params: dict, time_range: dict, spec: dict) -> AdReportRun:
+    """Submete um report run assíncrono de Insights para uma janela de datas."""
+    job_params = dict(params, time_range=time_range)
+    return account.get_insights(fields=spec['fields'], params=job_params, is_async=True)
+
+
+def _run_insights_async_jobs(account: AdAccount, params: dict, windows: list, max_jobs: int, log_prefix: str,
+                             spec: dict) -> list:
+    """Executa report runs assíncronos mantendo até max_jobs em andamento e devolve as linhas na ordem das janelas."""
+    results = [cache.lookup_records(_insights_cache_parts(account, params, window, spec)) for window in windows]
+    pending = [idx for idx, rows in enumerate(results) if rows is None]
+    retries = {idx: 0 for idx in pending}
+    in_flight = {}
+
+    while pending or in_flight:
+
+        while pending and len(in_flight) < max(1, max_jobs):
+            idx = pending.pop(0)
+            job = _submit_insights_job(account, params, windows[idx], spec)
+            in_flight[idx] = (job, time.monotonic())
+            print(f"{log_prefix} Job {job.get_id()} submetido para {windows[idx]['since']} → {windows[idx]['until']}.")
+
+        time.sleep(INSIGHTS_ASYNC_POLL_SECONDS)
+
+        for idx, (job, submitted_at) in list(in_flight.items()):
+            job = job.api_get(fields=[AdReportRun.Field.async_status, AdReportRun.Field.async_percent_completion])
+            status = job[AdReportRun.Field.async_status]
+
+            if status == 'Job Completed':
+                rows = job.get_result(params={'limit': 1000})
+                results[idx] = [_slim_record(row.export_all_data(), spec['action_types']) for row in rows]
+                cache.store_records(_insights_cache_parts(account, params, windows[idx], spec), results[idx])
+                del in_flight[idx]
+                print(f"{log_prefix} Job {job.get_id()} concluído ({len(results[idx])} linhas).")
+                continue
+
+            timed_out = time.monotonic() - submitted_at > INSIGHTS_ASYNC_TIMEOUT_SECONDS
+            if status in ('Job Failed', 'Job Skipped') or timed_out:
+                del in_flight[idx]
+                if retries[idx] >= INSIGHTS_ASYNC_MAX_RETRIES:
+                    raise RuntimeError(f"Job {job.get_id()} terminou com status '{status}' após {retries[idx]} novas tentativas.")
+                retries[idx] += 1
+                pending.append(idx)
+                print(f"{log_prefix} Job {job.get_id()} com status '{status}'. Reenviando (tentativa {retries[idx]}).")
+
+    return [row for window_rows in results for row in window_rows]
+
+
+def _insights_stage_name(level: str, breakdown: list = None) -> str:
+    return f"extract.insights.{level}.{'_'.join(breakdown) if breakdown else 'none'}"
+
+
+def _get_insights_data(total_days: int, level: str, breakdown: list = None, use_async: bool = None,
+                       since: str = None, until: str = None, account_id: str = None, spec: dict = None) -> pd.DataFrame:
+    """Função genérica para extrair Ads Insights.
+
+    spec declara os campos e action_types pedidos (ex.: CAMPAIGN_INSIGHTS); sem ela, FULL_INSIGHTS.
+    O período é dividido em janelas de INSIGHTS_SHARD_DAYS dias, extraídas em paralelo por até
+    INSIGHTS_MAX_WORKERS threads. Com use_async (ou INSIGHTS_ASYNC=1), cada janela de
+    INSIGHTS_ASYNC_WINDOW_DAYS dias vira um report run assíncrono, com até INSIGHTS_ASYNC_MAX_JOBS jobs em paralelo.
+    Erros são propagados: uma janela perdida não pode virar zero linhas (o orquestrador registra a falha).
+    """
+    account, time_range = _init_api_and_get_timerange(total_days, since=since, until=until, account_id=account_id)
     if account is None: return pd.DataFrame()
-    
+
+    if use_async is None:
+        use_async = INSIGHTS_ASYNC
+
     breakdown_str = ' + '.join(breakdown) if breakdown else 'Nenhum'
-    print(f"\n[EXTRAÇÃO: Insights - {level} | Quebra: {breakdown_str}] Iniciando extração de {total_days} dias...")
-
-    try:
-        params = {
-            'level': level,
-            'time_range': time_range,
-            'time_increment': 1, 
-            'filtering': [],
-            'limit': 1000,
-        }
-        if breakdown:
-            params['breakdowns'] = breakdown
-        
-        insights = account.get_insights(
-            fields=INSIGHTS_FIELDS,
-            params=params
-        )
-
-        data = [insight.export_all_data() for insight in insights]
-        df = pd.DataFrame(data)
-        
-        print(f"[EXTRAÇÃO: Insights - {level} | Quebra: {breakdown_str}] Extraídas {len(df)} linhas.")
-        
-        if 'date_start' not in df.columns:
-            start_date_str = time_range['since'].split(' ')[0] 
-            end_date_str = time_range['until'].split(' ')[0] 
-            df['date_start'] = start_date_str
-            df['date_stop'] = end_date_str
-        
-        return df
+    log_prefix = f"[EXTRAÇÃO: Insights - {level} | Quebra: {breakdown_str}]"
+    mode_str = 'assíncrono' if use_async else 'síncrono'
+    print(f"\n{log_prefix} Iniciando extração de {time_range['since']} a {time_range['until']} (modo {mode_str})...")
+
+    spec = spec or FULL_INSIGHTS
+
+    params = _build_insights_params(level, breakdown, time_range, spec['action_types'])
+
+    with metrics.stage(_insights_stage_name(level, breakdown)) as stage:
+        if use_async:
+            windows = _split_time_range(time_range, INSIGHTS_ASYNC_WINDOW_DAYS)
+            data = _run_insights_async_jobs(account, params, windows, INSIGHTS_ASYNC_MAX_JOBS, log_prefix, spec)
+        else:
+            windows = _split_time_range(time_range, INSIGHTS_SHARD_DAYS)
+            data = _run_insights_sharded(account, params, windows, INSIGHTS_MAX_WORKERS, log_prefix, spec)
+
+        df = _tag_account(_ensure_date_columns(pd.DataFrame(data), time_range), account)
+        stage.rows_out = len(df)
+
+    print(f"{log_prefix} Extraídas {len(df)} linhas.")
 
-    except Exception as e:
-        print(f'[EXTRAÇÃO: Insights - {level} | Quebra: {breakdown_str}] Erro fatal na extração: {e}')
-        return pd.DataFrame()
+    return df
 
 
 
-def get_campaign_data_raw(total_days: int = 182) -> pd.DataFrame:
+
+def _iter_insights_data(total_days: int, level: str, breakdown: list = None, since: str = None,
+                        until: str = None, chunk_rows: int = None, account_id: str = None, spec: dict = None):
+    """Versão em streaming de _get_insights_data: gera DataFrames de até chunk_rows linhas.
+
+    As janelas de INSIGHTS_SHARD_DAYS dias são lidas em sequência e o cursor é consumido página
+    a página, então só um bloco fica em memória por vez. Erros são propagados (não viram zero linhas).
+    """
+    account, time_range = _init_api_and_get_timerange(total_days, since=since, until=until, account_id=account_id)
+    if account is None: return
+
+    chunk_rows = chunk_rows or STREAM_CHUNK_ROWS
+    breakdown_str = ' + '.join(breakdown) if breakdown else 'Nenhum'
+    log_prefix = f"[EXTRAÇÃO: Insights - {level} | Quebra: {breakdown_str}]"
+    print(f"\n{log_prefix} Streaming de {time_range['since']} a {time_range['until']} em blocos de {chunk_rows} linhas...")
+
+    spec = spec or FULL_INSIGHTS
+    params = _build_insights_params(level, breakdown, time_range, spec['action_types'])
+    stage_name = _insights_stage_name(level, breakdown)
+    total_rows = 0
+
+    for window in _split_time_range(time_range, INSIGHTS_SHARD_DAYS):
+
+        def fetch_iter(window=window):
+            insights = account.get_insights(fields=spec['fields'], params=dict(params, time_range=window))
+            for insight in insights:
+                yield _slim_record(insight.export_all_data(), spec['action_types'])
+
+        # O tempo medido exclui o período em que o bloco está com o consumidor (transform/load)
+        rows = []
+        started = time.perf_counter()
+        for record in cache.cached_record_stream(_insights_cache_parts(account, params, window, spec), fetch_iter):
+            rows.append(record)
+            if len(rows) >= chunk_rows:
+                total_rows += len(rows)
+                df = _tag_account(_ensure_date_columns(pd.DataFrame(rows), window), account)
+                metrics.record_stage(stage_name, time.perf_counter() - started, rows_out=len(df))
+                yield df
+                rows = []
+                started = time.perf_counter()
+        if rows:
+            total_rows += len(rows)
+            df = _tag_account(_ensure_date_columns(pd.DataFrame(rows), window), account)
+            metrics.record_stage(stage_name, time.perf_counter() - started, rows_out=len(df))
+            yield df
+
+    print(f"{log_prefix} Streaming concluído: {total_rows} linhas.")
+
+
+def get_campaign_data_raw(total_days: int = 182, since: str = None, until: str = None, account_id: str = None) -> pd.DataFrame:
     """Extrai Performance de Campanhas (Nível Ad) - Tabela Fato Agregada."""
-    return _get_insights_data(total_days, level='ad', breakdown=[])
+    return _get_insights_data(total_days, level='ad', breakdown=[], since=since, until=until, account_id=account_id,
+                              spec=CAMPAIGN_INSIGHTS)
 
 
-def get_lead_demographic_raw(total_days: int = 182) -> pd.DataFrame:
+def get_lead_demographic_raw(total_days: int = 182, since: str = None, until: str = None, account_id: str = None) -> pd.DataFrame:
     """Extrai Leads com quebra por Demografia (Idade e Gênero)."""
-    return _get_insights_data(total_days, level='ad', breakdown=['age', 'gender'])
+    return _get_insights_data(total_days, level='ad', breakdown=['age', 'gender'], since=since, until=until, account_id=account_id,
+                              spec=LEAD_INSIGHTS)
 
 
-def get_lead_geographic_raw(total_days: int = 182) -> pd.DataFrame:
+def get_lead_geographic_raw(total_days: int = 182, since: str = None, until: str = None, account_id: str = None) -> pd.DataFrame:
     """Extrai Leads com quebra por Região (State/Province)."""
-    return _get_insights_data(total_days, level='ad', breakdown=['region'])
+    return _get_insights_data(total_days, level='ad', breakdown=['region'], since=since, until=until, account_id=account_id,
+                              spec=LEAD_INSIGHTS)
+
+
+def iter_campaign_data_raw(total_days: int = 182, since: str = None, until: str = None, chunk_rows: int = None,
+                           account_id: str = None):
+    """Streaming de Performance de Campanhas (Nível Ad) em blocos de chunk_rows linhas."""
+    return _iter_insights_data(total_days, level='ad', breakdown=[], since=since, until=until, chunk_rows=chunk_rows,
+                               account_id=account_id, spec=CAMPAIGN_INSIGHTS)
@@ -1,11 +1,17 @@
 
 
 import os
+import io
+import json
+import queue
+import threading
 import pandas as pd
 from dotenv import load_dotenv
 from sqlalchemy import create_engine, text
 import datetime
 
+from . import metrics, ddl
+
 load_dotenv()
 DB_DIALECT = os.getenv("DB_DIALECT")
 DB_DRIVER = os.getenv("DB_DRIVER")
@@ -17,117 +23,283 @@ DB_NAME = os.getenv("DB_NAME")
 
 DATABASE_URL = f"{DB_DIALECT}+{DB_DRIVER}://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
-try:
-    engine = create_engine(DATABASE_URL)
-except Exception as e:
-    print(f"ERRO FATAL ao criar a conexão com o PostgreSQL: {e}")
-    engine = None 
-    
+# Linhas por bloco enviado via COPY (limita a memória do buffer CSV)
+COPY_CHUNK_ROWS = int(os.getenv("COPY_CHUNK_ROWS", "50000"))
+
+# Modo streaming: blocos transformados aguardando carga (limita a memória de pico)
+STREAM_MAX_PENDING_CHUNKS = int(os.getenv("STREAM_MAX_PENDING_CHUNKS", "2"))
+
+# Criado na primeira carga por get_engine() (importar o módulo não conecta); pode ser
+# substituído antes disso (ex.: benchmark apontando para outro banco)
+engine = None
+_engine_lock = threading.Lock()
+_engine_failed = False
+
+
+def get_engine():
+    """Engine SQLAlchemy do processo, criado uma única vez; None se a conexão não pôde ser configurada."""
+    global engine, _engine_failed
+    with _engine_lock:
+        if engine is None and not _engine_failed:
+            try:
+                engine = create_engine(DATABASE_URL)
+            except Exception as e:
+                print(f"ERRO FATAL ao criar a conexão com o PostgreSQL: {e}")
+                _engine_failed = True
+        return engine
+
+
+def _get_key_cols(table_name: str) -> list:
+    """Chaves de conflito (UNIQUE) usadas no UPSERT de cada tabela."""
+    if table_name == 'ads_dimension':
+        return ['account_id', 'ad_id']
+    elif table_name == 'ads_campaign_performance':
+        return ['account_id', 'date_start', 'ad_id']
+    elif table_name == 'ads_lead_insights':
+        return ['account_id', 'date_start', 'ad_id', 'breakdown_type', 'age', 'gender', 'region']
+    elif table_name == 'ads_raw_leads':
+        # lead_id é único no Meta; account_id fica fora da chave para poder ser corrigido numa recarga
+        return ['lead_id']
+    else:
+        raise ValueError(f"Tabela desconhecida: {table_name}. Defina as chaves primárias.")
+
+
+# Colunas gravadas como JSONB (serializadas em JSON no transform)
+_JSONB_COLS = {'ads_raw_leads': ['field_data', 'ad_platform_data']}
+
+
+def _build_upsert_query(df: pd.DataFrame, table_name: str, temp_table: str, count_changes: bool = False) -> str:
+    """Monta o INSERT ... SELECT ... ON CONFLICT a partir da tabela de staging.
+
+    Linhas já existentes só são reescritas se algum valor mudou (IS DISTINCT FROM), evitando
+    WAL, bloat e churn de índice em reprocessamentos. Com count_changes (PostgreSQL), a query
+    devolve uma linha (chaves já existentes no destino, linhas escritas); as CTEs enxergam o
+    mesmo snapshot, então a contagem de existentes é anterior ao INSERT. (xmax = 0 não serve:
+    RETURNING não lê colunas de sistema em tabelas particionadas.)
+    """
+    key_cols = _get_key_cols(table_name)
+    key_cols_sql = ', '.join(key_cols)
+    update_cols = [col for col in df.columns if col not in key_cols]
+
+    cols_for_insert = ', '.join([f'"{c}"' for c in df.columns])
+
+    # Colunas JSON chegam como texto (to_sql) ou já JSONB (staging do COPY); o cast no banco cobre os dois
+    json_cols = _JSONB_COLS.get(table_name, [])
+    select_clause = ', '.join([f'"{col}"::JSONB' if col in json_cols else f'"{col}"' for col in df.columns])
+    set_clause = ', '.join([f'"{col}" = EXCLUDED."{col}"' for col in update_cols])
+
+    if not update_cols:
+        conflict_action = 'DO NOTHING'
+    else:
+        current = ', '.join([f'{table_name}."{col}"' for col in update_cols])
+        incoming = ', '.join([f'EXCLUDED."{col}"' for col in update_cols])
+        conflict_action = f"""DO UPDATE SET
+            {set_clause}
+        WHERE ({current}) IS DISTINCT FROM ({incoming})"""
+
+    upsert = f"""
+        INSERT INTO {table_name} ({cols_for_insert})
+        SELECT {select_clause} FROM {temp_table}
+        ON CONFLICT ({key_cols_sql})
+        {conflict_action}"""
+
+    if not count_changes:
+        return upsert + ';'
+
+    key_match = ' AND '.join([f'target."{col}" = staged."{col}"' for col in key_cols])
+    return f"""
+        WITH existing AS (
+            SELECT count(*) AS n FROM {temp_table} staged
+            WHERE EXISTS (SELECT 1 FROM {table_name} target WHERE {key_match})
+        ),
+        upserted AS ({upsert}
+        RETURNING 1)
+        SELECT (SELECT n FROM existing), (SELECT count(*) FROM upserted);
+    """
+
+
+def _change_counts(result, total_rows: int) -> dict:
+    """Converte o resultado da query com count_changes em {'inserted', 'updated', 'unchanged'}."""
+    existing, written = result.one()
+    inserted = total_rows - existing
+    updated = written - inserted
+    return {'inserted': inserted, 'updated': updated, 'unchanged': existing - updated}
+
+
+def _serialize_nested(df: pd.DataFrame) -> pd.DataFrame:
+    """Serializa em JSON as colunas com listas/dicts (ex.: field_data) para o COPY."""
+    df = df.copy()
+    for col in df.columns[df.dtypes == object]:
+        if df[col].map(lambda v: isinstance(v, (list, dict))).any():
+            df[col] = df[col].map(lambda v: json.dumps(v, ensure_ascii=False) if isinstance(v, (list, dict)) else v)
+    return df
+
+
+def _copy_dataframe(cursor, df: pd.DataFrame, temp_table: str):
+    """Envia o DataFrame para a tabela de staging via COPY FROM STDIN (CSV), em blocos."""
+    cols_sql = ', '.join([f'"{c}"' for c in df.columns])
+    copy_sql = f"COPY {temp_table} ({cols_sql}) FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+
+    for start in range(0, len(df), COPY_CHUNK_ROWS):
+        buffer = io.StringIO()
+        _serialize_nested(df.iloc[start:start + COPY_CHUNK_ROWS]).to_csv(buffer, index=False, header=False, na_rep='\\N')
+        buffer.seek(0)
+        cursor.copy_expert(copy_sql, buffer)
+
+
+def _load_with_copy(df: pd.DataFrame, table_name: str, temp_table: str):
+    """Caminho rápido (PostgreSQL): staging TEMP + COPY + UPSERT na mesma transação.
+
+    Devolve as contagens de _change_counts, ou None quando o driver não suporta COPY
+    (ex.: não é psycopg2), para usar o fallback.
+    """
+    upsert_query = _build_upsert_query(df, table_name, temp_table, count_changes=True)
+    cols_sql = ', '.join([f'"{c}"' for c in df.columns])
+
+    with get_engine().begin() as connection:
+        cursor = connection.connection.dbapi_connection.cursor()
+        if not hasattr(cursor, 'copy_expert'):
+            return None
+
+        # A staging herda os tipos da tabela de destino e some no fim da transação
+        with metrics.db_statement(table_name, 'create_staging'):
+            connection.execute(text(
+                f"CREATE TEMP TABLE {temp_table} ON COMMIT DROP AS "
+                f"SELECT {cols_sql} FROM {table_name} WITH NO DATA"
+            ))
+        with metrics.db_statement(table_name, 'copy'):
+            _copy_dataframe(cursor, df, temp_table)
+        print(f"[CARGA: {table_name}] {len(df)} linhas enviadas via COPY para '{temp_table}'.")
+
+        with metrics.db_statement(table_name, 'upsert'):
+            return _change_counts(connection.execute(text(upsert_query)), len(df))
+
+
+def _load_with_to_sql(df: pd.DataFrame, table_name: str, temp_table: str):
+    """Caminho genérico (outros dialetos): to_sql em tabela temporária + UPSERT + DROP.
+
+    Devolve as contagens de _change_counts no PostgreSQL; nos demais dialetos, None.
+    """
+    engine = get_engine()
+    count_changes = engine.dialect.name == 'postgresql'
+    upsert_query = _build_upsert_query(df, table_name, temp_table, count_changes=count_changes)
+
+    try:
+        with metrics.db_statement(table_name, 'to_sql'):
+            df.to_sql(name=temp_table, con=engine, if_exists='replace', index=False, chunksize=5000)
+        print(f"[CARGA: {table_name}] Dados inseridos na tabela temporária '{temp_table}'.")
+
+        with metrics.db_statement(table_name, 'upsert'), engine.begin() as connection:
+            result = connection.execute(text(upsert_query))
+            counts = _change_counts(result, len(df)) if count_changes else None
+
+        with metrics.db_statement(table_name, 'drop_staging'), engine.begin() as connection:
+            connection.execute(text(f"DROP TABLE {temp_table}"))
+
+        return counts
+
+    except Exception:
+        try:
+            with engine.begin() as connection:
+                connection.execute(text(f"DROP TABLE IF EXISTS {temp_table}"))
+        except:
+            pass
+        raise
+
 
-def load_data_to_db(df: pd.DataFrame, table_name: str):
-    """Realiza o UPSERT (Merge) no PostgreSQL."""
+def load_data_to_db(df: pd.DataFrame, table_name: str) -> bool:
+    """Realiza o UPSERT (Merge) no PostgreSQL.
+
+    Em PostgreSQL os dados seguem via COPY para uma staging TEMP, com o UPSERT na mesma
+    transação; nos demais dialetos usa to_sql em uma tabela temporária. No PostgreSQL a tabela
+    de destino, suas partições mensais e índices são criados pelo loader (ddl.py). Linhas idênticas às
+    do banco não são reescritas; as contagens de inseridas/atualizadas/inalteradas vão para o
+    log e para as métricas. Devolve False se a carga falhou ou o banco está indisponível.
+    """
+    engine = get_engine()
     if df.empty or engine is None:
         print(f"[CARGA: {table_name}] DataFrame vazio ou conexão indisponível. Nenhuma ação no banco.")
-        return
+        return engine is not None
 
     print(f"[CARGA: {table_name}] Iniciando UPSERT de {len(df)} linhas...")
 
     try:
-        
-        for col in ['date_start', 'date_stop', 'created_time']:
-            
+
+        for col in ['date_start', 'date_stop']:
+
             if col in df.columns:
                 df[col] = pd.to_datetime(df[col], errors='coerce').dt.date
-        
+
         temp_table = f'temp_{table_name}'
-        
-        
-        df.to_sql(name=temp_table, con=engine, if_exists='replace', index=False, chunksize=5000)
-        print(f"[CARGA: {table_name}] Dados inseridos na tabela temporária '{temp_table}'.")
 
-        
-        if table_name == 'ads_dimension':
-            key_cols = ['ad_id']
-        elif table_name == 'ads_campaign_performance':
-            key_cols = ['date_start', 'ad_id']
-        elif table_name == 'ads_lead_insights':
-            
-            key_cols = ['date_start', 'ad_id', 'age', 'gender', 'region']
-        
-        
-        elif table_name == 'ads_raw_leads':
-            key_cols = ['lead_id']
-
-            
-        else:
-            raise ValueError(f"Tabela desconhecida: {table_name}. Defina as chaves primárias.")
-
-        key_cols_sql = ', '.join(key_cols)
-        update_cols = [col for col in df.columns if col not in key_cols]
-        
-        
-        
-        cols_for_insert = ', '.join([f'"{c}"' for c in df.columns])
-
-        if table_name == 'ads_raw_leads':
-            
-            
-            
-            
-            cols_for_select_safe = ', '.join([f'"{c}"' for c in df.columns if c != 'field_data'])
-            
-            
-            field_data_cast = 'CASE WHEN "field_data" IS NULL THEN NULL ELSE "field_data"::JSONB END AS "field_data"'
-            select_clause = f'{cols_for_select_safe}, {field_data_cast}'
-            
-            
-            set_clause_list = []
-            for col in update_cols:
-                if col == 'field_data':
-                    
-                    set_clause_list.append(f'"{col}" = EXCLUDED."{col}"::JSONB')
-                else:
-                    set_clause_list.append(f'"{col}" = EXCLUDED."{col}"')
-            set_clause = ', '.join(set_clause_list)
-
-            
-            upsert_query = f"""
-                INSERT INTO {table_name} ({cols_for_insert})
-                SELECT {select_clause} FROM {temp_table}
-                ON CONFLICT ({key_cols_sql}) 
-                DO UPDATE SET 
-                    {set_clause};
-            """
-            
-        else:
-            
-            
-            cols_for_select = ', '.join([f'"{col}"' for col in df.columns])
-            
-            
-            set_clause = ', '.join([f'"{col}" = EXCLUDED."{col}"' for col in update_cols])
-            
-            upsert_query = f"""
-                INSERT INTO {table_name} ({cols_for_insert})
-                SELECT {cols_for_select} FROM {temp_table}
-                ON CONFLICT ({key_cols_sql}) 
-                DO UPDATE SET 
-                    {set_clause};
-            """
-
-        with engine.begin() as connection:
-            connection.execute(text(upsert_query))
-        
-        with engine.begin() as connection:
-            connection.execute(text(f"DROP TABLE {temp_table}"))
+        if engine.dialect.name == 'postgresql' and ddl.DB_MANAGE_DDL:
+            with metrics.db_statement(table_name, 'ddl'):
+                ddl.ensure_table(engine, table_name, df)
 
-        print(f"[CARGA: {table_name}] Concluída com sucesso.")
+        with metrics.stage(f'load.{table_name}', rows_in=len(df)) as stage:
+            counts = None
+            if engine.dialect.name == 'postgresql':
+                counts = _load_with_copy(df, table_name, temp_table)
+            if counts is None:
+                counts = _load_with_to_sql(df, table_name, temp_table)
+            stage.rows_out = len(df) if counts is None else counts['inserted'] + counts['updated']
+
+        if counts is None:
+            print(f"[CARGA: {table_name}] Concluída com sucesso.")
+        else:
+            metrics.record_load(table_name, **counts)
+            print(f"[CARGA: {table_name}] Concluída com sucesso: {counts['inserted']} inseridas, "
+                  f"{counts['updated']} atualizadas, {counts['unchanged']} inalteradas.")
+        return True
 
     except Exception as e:
         print(f'[CARGA: {table_name}] ERRO FATAL ao salvar no banco: {e}')
-        
-        try:
-            with engine.begin() as connection:
-                connection.execute(text(f"DROP TABLE IF EXISTS {temp_table}"))
-        except:
-            pass
\ No newline at end of file
+        return False
+
+
+def load_stream_to_db(frames, table_name: str, max_pending: int = None) -> int:
+    """Carrega em streaming os blocos gerados por um pipeline (ex.: stream_etl_pipeline_campaigns).
+
+    A carga roda em uma thread separada enquanto a thread principal extrai e transforma o
+    próximo bloco; a fila tem no máximo max_pending blocos, então a memória de pico depende
+    do tamanho do bloco e não do período. Devolve o total de linhas enviadas para carga.
+    """
+    max_pending = max_pending or STREAM_MAX_PENDING_CHUNKS
+    chunks = queue.Queue(maxsize=max(1, max_pending))
+    errors = []
+    _done = object()
+
+    def loader():
+        while True:
+            df = chunks.get()
+            if df is _done:
+                return
+            if errors:
+                continue
+            try:
+                if not load_data_to_db(df, table_name=table_name):
+                    errors.append(RuntimeError(f"Falha na carga de um bloco de {len(df)} linhas em {table_name}."))
+            except Exception as e:
+                errors.append(e)
+
+    worker = threading.Thread(target=loader, name=f'loader-{table_name}', daemon=True)
+    worker.start()
+
+    total_rows = 0
+    n_chunks = 0
+    try:
+        for df in frames:
+            if errors:
+                break
+            chunks.put(df)
+            total_rows += len(df)
+            n_chunks += 1
+    finally:
+        chunks.put(_done)
+        worker.join()
+
+    if errors:
+        raise errors[0]
+
+    print(f"[CARGA: {table_name}] Streaming concluído: {total_rows} linhas em {n_chunks} blocos.")
+    return total_rows
@@ -1,36 +1,393 @@
-from transform import run_etl_pipeline_campaigns, run_etl_pipeline_leads, run_etl_pipeline_dim
-from load import load_data_to_db 
+import os
+import sys
+import argparse
+import datetime
 
-if __name__ == '__main__':
-    
-    
-    DIM_TABLE = 'ads_dimension'
-    CAMPAIGN_TABLE = 'ads_campaign_performance'
-    LEAD_TABLE = 'ads_lead_insights'
-    
-    TOTAL_DAYS_HISTORIC = 1
-    TOTAL_DAYS_DIM = 1       
-    
+import pandas as pd
+
+from .transform import run_etl_pipeline_campaigns, run_etl_pipeline_leads, run_etl_pipeline_dim
+from .transform import stream_etl_pipeline_campaigns, stream_etl_pipeline_leads, stream_etl_pipeline_raw_leads
+from .load import load_data_to_db, load_stream_to_db
+from .accounts import get_account_ids, run_per_account, shutdown as shutdown_accounts
+from .extract import get_time_windows, LEADS_PAGE_IDS
+from .state import get_incremental_range, get_updated_since, get_watermark, commit_watermark, get_units, set_unit_status
+from .orchestrator import run_tasks, print_report, has_failures
+from . import cache, metrics, rollup, load, parquet_sink
+
+
+DIM_TABLE = 'ads_dimension'
+CAMPAIGN_TABLE = 'ads_campaign_performance'
+LEAD_TABLE = 'ads_lead_insights'
+RAW_LEADS_TABLE = 'ads_raw_leads'
+
+TOTAL_DAYS_HISTORIC = 1
+TOTAL_DAYS_DIM = 1       
+STREAMING = os.getenv("ETL_STREAMING", "0") == "1"
+INCREMENTAL = os.getenv("ETL_INCREMENTAL", "1") == "1"  # TOTAL_DAYS_HISTORIC vira só a carga inicial
+BACKFILL_UNIT_DAYS = int(os.getenv("BACKFILL_UNIT_DAYS", "7"))  # dias por unidade de backfill (checkpoint)
+
+
+def _load_or_fail(df, table_name: str) -> int:
+    """Grava o DataFrame nos destinos configurados em ETL_SINK (banco e/ou dataset Parquet)."""
+    if parquet_sink.writes_db() and not load_data_to_db(df, table_name=table_name):
+        raise RuntimeError(f"Falha na carga de {table_name}.")
+    if parquet_sink.writes_parquet():
+        parquet_sink.write_parquet(df, table_name)
+    return len(df)
+
+
+def _refresh_rollups(table_name: str, ranges: dict):
+    if parquet_sink.writes_db():
+        rollup.refresh_rollups(load.get_engine(), table_name, ranges)
+
+
+def _extract_accounts(fn, jobs: dict) -> dict:
+    """Roda o pipeline fn para cada conta (em processos quando há várias) e junta os resultados."""
+    results, errors = run_per_account(fn, jobs)
+    frames = [df for df in results.values() if not df.empty]
+    return {
+        'df': pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(),
+        'accounts': [account_id for account_id, df in results.items() if not df.empty],
+        'errors': errors,
+    }
+
+
+def _raise_account_errors(table_name: str, errors: dict, label: str = 'contas'):
+    if errors:
+        failed = ', '.join(sorted(errors))
+        raise RuntimeError(f"{table_name}: falha nas {label} {failed}.") from next(iter(errors.values()))
+
+
+def _load_dim(extracted: dict, incremental: bool) -> int:
+    """Carrega a dimensão; no modo incremental, o watermark marca a última sincronização por conta."""
+    rows = _load_or_fail(extracted['df'], DIM_TABLE)
+    if incremental:
+        today = datetime.date.today().isoformat()
+        for account_id in extracted['accounts']:
+            commit_watermark(DIM_TABLE, account_id, {'since': today, 'until': today})
+    _raise_account_errors(DIM_TABLE, extracted['errors'])
+    return rows
+
+
+def _load_fact(extracted: dict, table_name: str, ranges: dict, incremental: bool) -> int:
+    """Carrega o resultado de todas as contas, atualiza os agregados dos períodos carregados e
+    avança o watermark só das contas que trouxeram linhas (uma falha nos agregados segura o
+    watermark, e a próxima execução refaz o período)."""
+    rows = _load_or_fail(extracted['df'], table_name)
+    _refresh_rollups(table_name, rollup.touched_ranges(extracted['df']))
+    if incremental:
+        for account_id in extracted['accounts']:
+            commit_watermark(table_name, account_id, ranges[account_id])
+    _raise_account_errors(table_name, extracted['errors'])
+    return rows
+
+
+def _stream_fact(stream_fn, table_name: str, ranges: dict, incremental: bool, key_arg: str = 'account_id') -> int:
+    """Streaming conta a conta (ou Página a Página, com key_arg='page_id'), no próprio processo
+    (a memória continua limitada ao bloco)."""
+    total_rows, errors = 0, {}
+    # Partições Parquet já gravadas nesta tarefa: Páginas diferentes podem trazer leads da mesma conta e dia
+    written = set()
+    for account_id, time_range in ranges.items():
+        touched = {}
+        try:
+            frames = rollup.track_ranges(stream_fn(total_days=TOTAL_DAYS_HISTORIC, **{key_arg: account_id}, **time_range), touched)
+            if parquet_sink.writes_parquet():
+                frames = parquet_sink.write_through(frames, table_name, written)
+            if parquet_sink.writes_db():
+                rows = load_stream_to_db(frames, table_name=table_name)
+            else:
+                rows = sum(len(df) for df in frames)
+            _refresh_rollups(table_name, touched)
+        except Exception as e:
+            errors[account_id] = e
+            continue
+        if incremental and rows > 0:
+            commit_watermark(table_name, account_id, time_range)
+        total_rows += rows
+    _raise_account_errors(table_name, errors, 'contas' if key_arg == 'account_id' else 'Páginas')
+    return total_rows
+
+
+JOB_TABLES = {'dim': DIM_TABLE, 'performance': CAMPAIGN_TABLE, 'leads': LEAD_TABLE, 'raw_leads': RAW_LEADS_TABLE}
+# Leads brutos só entram no fluxo padrão quando há Páginas configuradas (LEADS_PAGE_IDS)
+JOBS = tuple(job for job in JOB_TABLES if job != 'raw_leads' or LEADS_PAGE_IDS)
+
+
+def build_plan(incremental: bool, fixed_range: dict, account_ids: list = None, jobs: tuple = JOBS) -> dict:
+    """Parâmetros de cada job por conta: {'dim': {conta: kwargs}, 'performance'/'leads': {conta: janela}}.
+
+    Leads brutos são lidos por Página, não por conta: {'raw_leads': {página: janela}}.
+    No modo incremental as janelas saem dos watermarks; senão, de fixed_range.
+    """
+    account_ids = account_ids or get_account_ids()
+    plan = {}
+    if 'dim' in jobs:
+        plan['dim'] = {
+            account_id: {'total_days': TOTAL_DAYS_DIM,
+                         'updated_since': get_updated_since(DIM_TABLE, account_id) if incremental else None}
+            for account_id in account_ids
+        }
+    for job in ('performance', 'leads'):
+        if job in jobs:
+            plan[job] = {
+                account_id: get_incremental_range(JOB_TABLES[job], account_id, TOTAL_DAYS_HISTORIC) if incremental else dict(fixed_range)
+                for account_id in account_ids
+            }
+    if 'raw_leads' in jobs:
+        # Leads não mudam depois de criados: basta refazer o último dia (leads que chegaram após a execução anterior).
+        # Os formulários pertencem à Página: uma extração (e um watermark) por Página, qualquer que seja o número de contas
+        plan['raw_leads'] = {
+            page_id: get_incremental_range(RAW_LEADS_TABLE, page_id, TOTAL_DAYS_HISTORIC, lookback_days=1) if incremental else dict(fixed_range)
+            for page_id in LEADS_PAGE_IDS
+        }
+    return plan
+
+
+def build_tasks(incremental: bool, fixed_range: dict, streaming: bool, account_ids: list = None, jobs: tuple = JOBS) -> list:
+    """Monta o DAG do fluxo: cada tabela de jobs é um ramo independente (extração → carga).
+
+    Cada ramo cobre todas as contas do portfólio; o watermark é por (tabela, conta).
+    """
+    plan = build_plan(incremental, fixed_range, account_ids, jobs)
+
+    def fact_jobs(table_ranges: dict) -> dict:
+        return {account_id: dict(total_days=TOTAL_DAYS_HISTORIC, **time_range) for account_id, time_range in table_ranges.items()}
+
+    tasks = []
+    if 'dim' in plan:
+        tasks += [
+            ('dimensao.extract', lambda: _extract_accounts(run_etl_pipeline_dim, plan['dim']), []),
+            ('dimensao.load', lambda extracted: _load_dim(extracted, incremental), ['dimensao.extract']),
+        ]
+
+    if 'performance' in plan:
+        perf_ranges = plan['performance']
+        if streaming:
+            tasks.append(('performance.stream', lambda: _stream_fact(stream_etl_pipeline_campaigns, CAMPAIGN_TABLE, perf_ranges, incremental), []))
+        else:
+            tasks += [
+                ('performance.extract', lambda: _extract_accounts(run_etl_pipeline_campaigns, fact_jobs(perf_ranges)), []),
+                ('performance.load', lambda extracted: _load_fact(extracted, CAMPAIGN_TABLE, perf_ranges, incremental), ['performance.extract']),
+            ]
+
+    if 'leads' in plan:
+        leads_ranges = plan['leads']
+        if streaming:
+            tasks.append(('leads.stream', lambda: _stream_fact(stream_etl_pipeline_leads, LEAD_TABLE, leads_ranges, incremental), []))
+        else:
+            tasks += [
+                # As quebras demográfica e geográfica são extraídas em paralelo dentro do pipeline
+                ('leads.extract', lambda: _extract_accounts(run_etl_pipeline_leads, fact_jobs(leads_ranges)), []),
+                ('leads.load', lambda extracted: _load_fact(extracted, LEAD_TABLE, leads_ranges, incremental), ['leads.extract']),
+            ]
+
+    if 'raw_leads' in plan:
+        # Sempre em streaming: o volume de leads brutos acompanha os picos de campanha. Com a dimensão
+        # no plano, espera o cache de nomes dela para saber a conta dos anúncios novos
+        raw_leads_ranges = plan['raw_leads']
+        tasks.append(('raw_leads.stream',
+                      lambda *_: _stream_fact(stream_etl_pipeline_raw_leads, RAW_LEADS_TABLE, raw_leads_ranges, incremental,
+                                              key_arg='page_id'),
+                      ['dimensao.load'] if 'dim' in plan else []))
+    return tasks
+
+
+BACKFILL_PIPELINES = {'performance': run_etl_pipeline_campaigns, 'leads': run_etl_pipeline_leads}
+
+
+def build_backfill_plan(since: str, until: str, account_ids: list = None, jobs: tuple = tuple(BACKFILL_PIPELINES),
+                        resume: bool = False) -> dict:
+    """Unidades do backfill por job e conta: {job: {conta: [(janela, status anterior)]}}.
+
+    O período vira janelas de BACKFILL_UNIT_DAYS dias; com resume, as unidades já concluídas
+    ('done') ficam fora da lista.
+    """
+    account_ids = account_ids or get_account_ids()
+    windows = get_time_windows(0, since=since, until=until, window_days=BACKFILL_UNIT_DAYS)
+    plan = {}
+    for job in jobs:
+        if job not in BACKFILL_PIPELINES:
+            continue
+        plan[job] = {}
+        for account_id in account_ids:
+            done = get_units(JOB_TABLES[job], account_id) if resume else {}
+            plan[job][account_id] = [
+                (window, done.get((window['since'], window['until']), {}).get('status'))
+                for window in windows
+                if done.get((window['since'], window['until']), {}).get('status') != 'done'
+            ]
+    return plan
+
+
+def _backfill_fact(pipeline_fn, table_name: str, units: dict, since: str, until: str, incremental: bool) -> int:
+    """Roda as unidades do backfill janela a janela (todas as contas da janela em paralelo).
+
+    Cada unidade (conta × janela) é extraída, carregada e marcada como concluída de forma
+    independente; uma unidade com erro fica 'failed' e o backfill segue para as próximas. No
+    fim, a tarefa falha se sobrou alguma unidade pendente (rode de novo com --resume).
+    O watermark só avança se o backfill emenda com ele (since até o dia seguinte ao watermark).
+    """
+    windows = {}
+    for account_id, account_units in units.items():
+        for window, _ in account_units:
+            windows.setdefault((window['since'], window['until']), []).append(account_id)
+
+    total_rows, failed = 0, set()
+    for n, ((since_window, until_window), account_ids) in enumerate(sorted(windows.items()), start=1):
+        window = {'since': since_window, 'until': until_window}
+        print(f"[BACKFILL: {table_name}] Unidade {n}/{len(windows)}: {since_window} a {until_window} ({len(account_ids)} contas).")
+        for account_id in account_ids:
+            set_unit_status(table_name, account_id, window, 'running')
+
+        results, errors = run_per_account(pipeline_fn, {
+            account_id: dict(total_days=TOTAL_DAYS_HISTORIC, **window) for account_id in account_ids
+        })
+        frames = [df for df in results.values() if not df.empty]
+        try:
+            if frames:
+                df = pd.concat(frames, ignore_index=True)
+                _load_or_fail(df, table_name)
+                _refresh_rollups(table_name, rollup.touched_ranges(df))
+        except Exception as e:
+            errors.update({account_id: e for account_id in results})
+            results = {}
+
+        for account_id, e in errors.items():
+            set_unit_status(table_name, account_id, window, 'failed', error=str(e))
+            failed.add(account_id)
+        for account_id, df in results.items():
+            set_unit_status(table_name, account_id, window, 'done', rows=len(df))
+            total_rows += len(df)
+
+    if incremental:
+        first_day = datetime.date.fromisoformat(since)
+        for account_id in units:
+            if account_id in failed:
+                continue
+            current = get_watermark(table_name, account_id)
+            if current is not None and first_day > current + datetime.timedelta(days=1):
+                # Os dias entre o watermark e o início do backfill não foram carregados
+                print(f"[BACKFILL: {table_name}] {account_id}: watermark mantido em {current}; "
+                      f"faltam os dias entre ele e o início do backfill ({since}).")
+                continue
+            commit_watermark(table_name, account_id, {'since': since, 'until': until})
+    if failed:
+        raise RuntimeError(f"{table_name}: unidades com falha nas contas {', '.join(sorted(failed))}; "
+                           f"rode novamente com --resume para refazer só as pendentes.")
+    return total_rows
+
+
+def build_backfill_tasks(since: str, until: str, jobs: tuple = tuple(BACKFILL_PIPELINES), resume: bool = False,
+                         incremental: bool = True, account_ids: list = None) -> list:
+    """Um ramo do DAG por tabela fato; as unidades de cada tabela rodam em sequência."""
+    plan = build_backfill_plan(since, until, account_ids, jobs, resume)
+    return [
+        (f'{job}.backfill',
+         lambda job=job: _backfill_fact(BACKFILL_PIPELINES[job], JOB_TABLES[job], plan[job], since, until,
+                                       incremental), [])
+        for job in plan
+    ]
+
+
+def print_backfill_plan(plan: dict):
+    print(f"\n=== PLANO DO BACKFILL (unidades de {BACKFILL_UNIT_DAYS} dias, destino: {parquet_sink.ETL_SINK}) ===")
+    for job, accounts in plan.items():
+        print(f"  {job} → {JOB_TABLES[job]}")
+        for account_id, account_units in accounts.items():
+            retries = sum(1 for _, status in account_units if status is not None)
+            print(f"    {account_id}: {len(account_units)} unidades a processar ({retries} com tentativa anterior)")
+
+
+def print_plan(plan: dict, streaming: bool):
+    """Mostra o que uma execução faria (--dry-run): tabelas, contas e janelas, sem chamar a API nem gravar."""
+    print(f"\n=== PLANO (destino: {parquet_sink.ETL_SINK}, streaming: {'sim' if streaming else 'não'}) ===")
+    for job, accounts in plan.items():
+        print(f"  {job} → {JOB_TABLES[job]}")
+        for account_id, params in accounts.items():
+            if job == 'dim':
+                window = f"alterados desde {params['updated_since']}" if params['updated_since'] else 'sincronização completa'
+            elif params.get('since'):
+                window = f"{params['since']} até {params.get('until') or 'hoje'}"
+            else:
+                window = f"últimos {TOTAL_DAYS_HISTORIC} dias"
+            print(f"    {'Página ' if job == 'raw_leads' else ''}{account_id}: {window}")
+
+
+def run(jobs: tuple = JOBS, since: str = None, until: str = None, replay: bool = False, dry_run: bool = False) -> int:
+    """Executa os jobs pedidos (dim, performance, leads) como um DAG; devolve o código de saída do processo."""
+    if replay:
+        cache.set_replay(True)
+
+    incremental = INCREMENTAL and not cache.REPLAY and not since
+    fixed_range = {'since': since, 'until': until}
+
+    if dry_run:
+        print_plan(build_plan(incremental, fixed_range, jobs=jobs), STREAMING)
+        return 0
 
     print('=== INICIANDO FLUXO ===')
-    
+
     try:
-        
-        print("\n 1. ETL: DIMENSÃO (NOMES E IDs) ")
-        df_dim = run_etl_pipeline_dim(total_days=TOTAL_DAYS_DIM) 
-        load_data_to_db(df_dim, table_name=DIM_TABLE)
-
-        
-        print("\n 2. ETL: PERFORMANCE (AGREGADA) ")
-        df_campaign_final = run_etl_pipeline_campaigns(total_days=TOTAL_DAYS_HISTORIC)
-        load_data_to_db(df_campaign_final, table_name=CAMPAIGN_TABLE) 
-        
-        
-        print("\n 3. ETL: LEADS (ALTA GRANULARIDADE) ")
-        df_leads_final = run_etl_pipeline_leads(total_days=TOTAL_DAYS_HISTORIC)
-        load_data_to_db(df_leads_final, table_name=LEAD_TABLE) 
-        
+        tasks = build_tasks(incremental, fixed_range, STREAMING, jobs=jobs)
     except Exception as e:
         print(f'ERRO CRÍTICO NO FLUXO DE ORQUESTRAÇÃO ETL: {e}')
+        return 1
+    return _execute(tasks)
+
 
-    print('\n FLUXO DE ORQUESTRAÇÃO ETL CONCLUÍDO \n')
\ No newline at end of file
+def run_backfill(since: str, until: str = None, jobs: tuple = tuple(BACKFILL_PIPELINES), resume: bool = False,
+                 replay: bool = False, dry_run: bool = False) -> int:
+    """Backfill em unidades com checkpoint; com resume, só refaz as unidades não concluídas."""
+    if replay:
+        cache.set_replay(True)
+    until = until or datetime.date.today().isoformat()
+
+    if dry_run:
+        print_backfill_plan(build_backfill_plan(since, until, jobs=jobs, resume=resume))
+        return 0
+
+    print(f"=== INICIANDO BACKFILL {since} a {until}{' (retomada)' if resume else ''} ===")
+
+    try:
+        tasks = build_backfill_tasks(since, until, jobs, resume, incremental=INCREMENTAL and not cache.REPLAY)
+    except Exception as e:
+        print(f'ERRO CRÍTICO NO FLUXO DE ORQUESTRAÇÃO ETL: {e}')
+        return 1
+    return _execute(tasks)
+
+
+def _execute(tasks: list) -> int:
+    """Roda o DAG, grava o relatório de métricas e devolve o código de saída."""
+    try:
+        report = run_tasks(tasks)
+    finally:
+        shutdown_accounts()
+    print_report(report)
+
+    try:
+        metrics.write_reports(success=not has_failures(report), tasks=report)
+    except OSError as e:
+        print(f'[MÉTRICAS] Não foi possível gravar os relatórios: {e}')
+
+    if has_failures(report):
+        print('\n FLUXO DE ORQUESTRAÇÃO ETL CONCLUÍDO COM FALHAS \n')
+        return 1
+
+    print('\n FLUXO DE ORQUESTRAÇÃO ETL CONCLUÍDO \n')
+    return 0
+
+
+def main(argv: list = None) -> int:
+    """Fluxo completo (equivale a `python -m src run all`)."""
+    parser = argparse.ArgumentParser(description='Fluxo ETL Meta Ads → banco.')
+    parser.add_argument('--replay', action='store_true',
+                        help='Roda transformações e cargas apenas a partir do cache de respostas (sem rede).')
+    parser.add_argument('--since', help='Data inicial (YYYY-MM-DD); desliga o modo incremental.')
+    parser.add_argument('--until', help='Data final (YYYY-MM-DD).')
+    args = parser.parse_args(argv)
+    return run(since=args.since, until=args.until, replay=args.replay)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
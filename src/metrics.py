@@ -0,0 +1,298 @@
+import os
+import json
+import time
+import threading
+import datetime
+import functools
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+import psutil
+
+load_dotenv()
+
+# Relatórios da execução: JSON detalhado e textfile do Prometheus (node exporter)
+METRICS_JSON_PATH = os.getenv("METRICS_JSON_PATH", os.path.join("logs", "run_report.json"))
+METRICS_PROM_PATH = os.getenv("METRICS_PROM_PATH")
+METRICS_SAMPLE_SECONDS = float(os.getenv("METRICS_SAMPLE_SECONDS", "0.05"))
+
+PROM_PREFIX = 'meta_etl'
+
+_lock = threading.Lock()
+_run_started = time.time()
+_stages = {}
+_api = {}
+_db = {}
+_loads = {}
+_throttle = {'events': 0, 'wait_seconds': 0.0}
+_active = {}
+_peak_rss = 0
+_sampler = None
+
+
+def _sample_loop():
+    global _peak_rss
+    process = psutil.Process()
+    while True:
+        rss = process.memory_info().rss
+        with _lock:
+            _peak_rss = max(_peak_rss, rss)
+            for stage in _active.values():
+                stage['peak_rss_bytes'] = max(stage['peak_rss_bytes'], rss)
+        time.sleep(METRICS_SAMPLE_SECONDS)
+
+
+def _ensure_sampler():
+    global _sampler
+    with _lock:
+        if _sampler is None:
+            _sampler = threading.Thread(target=_sample_loop, name='metrics-rss', daemon=True)
+            _sampler.start()
+
+
+class _StageHandle:
+    """Devolvido por stage(): permite informar as linhas de entrada/saída ao longo da etapa."""
+
+    def __init__(self, rows_in=None):
+        self.rows_in = rows_in
+        self.rows_out = None
+
+
+@contextmanager
+def stage(name: str, rows_in: int = None):
+    """Mede uma etapa (tempo, linhas, pico de memória). Repetições da mesma etapa são somadas."""
+    _ensure_sampler()
+    handle = _StageHandle(rows_in)
+    token = object()
+    rss = psutil.Process().memory_info().rss
+    with _lock:
+        _active[token] = {'peak_rss_bytes': rss}
+    started = time.perf_counter()
+    status = 'success'
+    try:
+        yield handle
+    except BaseException:
+        status = 'failed'
+        raise
+    finally:
+        with _lock:
+            peak = _active.pop(token)['peak_rss_bytes']
+        record_stage(name, time.perf_counter() - started, handle.rows_in, handle.rows_out, peak, status == 'failed')
+
+
+def record_stage(name: str, seconds: float, rows_in: int = None, rows_out: int = None,
+                 peak_rss_bytes: int = 0, failed: bool = False):
+    """Soma uma medição à etapa; útil para geradores, que não cabem em um bloco with."""
+    with _lock:
+        entry = _stages.setdefault(name, {'calls': 0, 'seconds': 0.0, 'rows_in': 0, 'rows_out': 0,
+                                          'peak_rss_bytes': 0, 'failures': 0})
+        entry['calls'] += 1
+        entry['seconds'] += seconds
+        entry['rows_in'] += rows_in or 0
+        entry['rows_out'] += rows_out or 0
+        entry['peak_rss_bytes'] = max(entry['peak_rss_bytes'], peak_rss_bytes)
+        entry['failures'] += failed
+
+
+def timed(name: str):
+    """Decorador de etapa: linhas de entrada = DataFrames posicionais, linhas de saída = len(resultado)."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            rows_in = sum(len(arg) for arg in args if hasattr(arg, 'columns')) or None
+            with stage(name, rows_in=rows_in) as handle:
+                result = fn(*args, **kwargs)
+                handle.rows_out = len(result) if hasattr(result, '__len__') else None
+            return result
+        return wrapper
+    return decorator
+
+
+def record_api_call(endpoint: str, seconds: float, response_bytes: int, is_page: bool):
+    """Registra uma chamada à Graph API (uma página de cursor conta também em 'pages')."""
+    with _lock:
+        entry = _api.setdefault(endpoint, {'calls': 0, 'pages': 0, 'bytes': 0, 'seconds': 0.0, 'errors': 0})
+        entry['calls'] += 1
+        entry['pages'] += is_page
+        entry['bytes'] += response_bytes
+        entry['seconds'] += seconds
+
+
+def record_api_error(endpoint: str):
+    with _lock:
+        entry = _api.setdefault(endpoint, {'calls': 0, 'pages': 0, 'bytes': 0, 'seconds': 0.0, 'errors': 0})
+        entry['errors'] += 1
+
+
+def record_throttle(wait_seconds: float):
+    with _lock:
+        _throttle['events'] += 1
+        _throttle['wait_seconds'] += wait_seconds
+
+
+def record_load(table_name: str, inserted: int, updated: int, unchanged: int):
+    """Soma o resultado de um UPSERT: linhas inseridas, atualizadas e inalteradas."""
+    with _lock:
+        entry = _loads.setdefault(table_name, {'inserted': 0, 'updated': 0, 'unchanged': 0})
+        entry['inserted'] += inserted
+        entry['updated'] += updated
+        entry['unchanged'] += unchanged
+
+
+@contextmanager
+def db_statement(table_name: str, statement: str):
+    """Mede um comando no banco (ex.: COPY, UPSERT) de uma tabela."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        with _lock:
+            entry = _db.setdefault((table_name, statement), {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+            entry['calls'] += 1
+            entry['seconds'] += seconds
+            entry['max_seconds'] = max(entry['max_seconds'], seconds)
+
+
+def build_report(success: bool = True, tasks: dict = None) -> dict:
+    """Consolida as métricas da execução em um dicionário serializável.
+
+    tasks é o relatório do orquestrador ({nome: {'status', 'seconds', ...}}), se houver.
+    """
+    task_summary = {name: {'status': info['status'], 'seconds': round(info['seconds'], 3),
+                           'error': str(info['error']) if info['error'] else None}
+                    for name, info in (tasks or {}).items()}
+    with _lock:
+        return {
+            'started_at': datetime.datetime.fromtimestamp(_run_started).isoformat(timespec='seconds'),
+            'finished_at': datetime.datetime.now().isoformat(timespec='seconds'),
+            'duration_seconds': round(time.time() - _run_started, 3),
+            'success': success,
+            'tasks': task_summary,
+            'peak_rss_bytes': max(_peak_rss, psutil.Process().memory_info().rss),
+            'stages': {name: dict(entry) for name, entry in _stages.items()},
+            'api': {endpoint: dict(entry) for endpoint, entry in _api.items()},
+            'throttle': dict(_throttle),
+            'loads': {table: dict(entry) for table, entry in _loads.items()},
+            'db': [dict(table=table, statement=statement, **entry) for (table, statement), entry in _db.items()],
+        }
+
+
+def snapshot() -> dict:
+    """Cópia das métricas acumuladas no processo (ex.: para devolver de um worker ao processo pai)."""
+    with _lock:
+        return {
+            'stages': {name: dict(entry) for name, entry in _stages.items()},
+            'api': {endpoint: dict(entry) for endpoint, entry in _api.items()},
+            'db': {key: dict(entry) for key, entry in _db.items()},
+            'loads': {table: dict(entry) for table, entry in _loads.items()},
+            'throttle': dict(_throttle),
+            'peak_rss_bytes': _peak_rss,
+        }
+
+
+def reset():
+    """Zera as métricas do processo (workers reaproveitados entre tarefas)."""
+    global _peak_rss
+    with _lock:
+        for registry in (_stages, _api, _db, _loads):
+            registry.clear()
+        _throttle.update(events=0, wait_seconds=0.0)
+        _peak_rss = 0
+
+
+def _merge_entries(target: dict, source: dict):
+    for key, entry in source.items():
+        current = target.setdefault(key, dict.fromkeys(entry, 0))
+        for field, value in entry.items():
+            if field in ('peak_rss_bytes', 'max_seconds'):
+                current[field] = max(current[field], value)
+            else:
+                current[field] += value
+
+
+def merge(other: dict):
+    """Soma ao processo atual um snapshot() vindo de outro processo."""
+    global _peak_rss
+    with _lock:
+        _merge_entries(_stages, other['stages'])
+        _merge_entries(_api, other['api'])
+        _merge_entries(_db, other['db'])
+        _merge_entries(_loads, other['loads'])
+        _throttle['events'] += other['throttle']['events']
+        _throttle['wait_seconds'] += other['throttle']['wait_seconds']
+        _peak_rss = max(_peak_rss, other['peak_rss_bytes'])
+
+
+def _prom_label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+
+def _prometheus_lines(report: dict) -> list:
+    p = PROM_PREFIX
+    lines = [
+        f'# TYPE {p}_run_duration_seconds gauge', f"{p}_run_duration_seconds {report['duration_seconds']}",
+        f'# TYPE {p}_run_success gauge', f"{p}_run_success {int(report['success'])}",
+        f'# TYPE {p}_run_timestamp_seconds gauge', f'{p}_run_timestamp_seconds {int(time.time())}',
+        f'# TYPE {p}_peak_rss_bytes gauge', f"{p}_peak_rss_bytes {report['peak_rss_bytes']}",
+        f'# TYPE {p}_api_throttle_events gauge', f"{p}_api_throttle_events {report['throttle']['events']}",
+        f'# TYPE {p}_api_throttle_wait_seconds gauge', f"{p}_api_throttle_wait_seconds {report['throttle']['wait_seconds']:.3f}",
+    ]
+
+    lines.append(f'# TYPE {p}_task_duration_seconds gauge')
+    lines += [f'{p}_task_duration_seconds{{task="{_prom_label(name)}"}} {info["seconds"]}'
+              for name, info in report['tasks'].items()]
+    lines.append(f'# TYPE {p}_task_success gauge')
+    lines += [f'{p}_task_success{{task="{_prom_label(name)}"}} {int(info["status"] == "success")}'
+              for name, info in report['tasks'].items()]
+
+    stage_metrics = [('seconds', 'stage_duration_seconds'), ('rows_in', 'stage_rows_in'),
+                     ('rows_out', 'stage_rows_out'), ('peak_rss_bytes', 'stage_peak_rss_bytes'),
+                     ('failures', 'stage_failures')]
+    for key, metric in stage_metrics:
+        lines.append(f'# TYPE {p}_{metric} gauge')
+        for name, entry in report['stages'].items():
+            lines.append(f'{p}_{metric}{{stage="{_prom_label(name)}"}} {entry[key]}')
+
+    api_metrics = [('calls', 'api_requests'), ('pages', 'api_pages'), ('bytes', 'api_response_bytes'),
+                   ('seconds', 'api_request_seconds'), ('errors', 'api_errors')]
+    for key, metric in api_metrics:
+        lines.append(f'# TYPE {p}_{metric} gauge')
+        for endpoint, entry in report['api'].items():
+            lines.append(f'{p}_{metric}{{endpoint="{_prom_label(endpoint)}"}} {entry[key]}')
+
+    lines.append(f'# TYPE {p}_load_rows gauge')
+    for table, entry in report['loads'].items():
+        for result, rows in entry.items():
+            lines.append(f'{p}_load_rows{{table="{_prom_label(table)}",result="{result}"}} {rows}')
+
+    for key, metric in [('calls', 'db_statements'), ('seconds', 'db_statement_seconds'), ('max_seconds', 'db_statement_max_seconds')]:
+        lines.append(f'# TYPE {p}_{metric} gauge')
+        for entry in report['db']:
+            labels = f'table="{_prom_label(entry["table"])}",statement="{_prom_label(entry["statement"])}"'
+            lines.append(f'{p}_{metric}{{{labels}}} {entry[key]}')
+
+    return lines
+
+
+def _atomic_write(path: str, content: str):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def write_reports(success: bool = True, tasks: dict = None, json_path: str = None, prom_path: str = None) -> dict:
+    """Grava o relatório JSON e, se configurado, o textfile do Prometheus (escrita atômica)."""
+    report = build_report(success, tasks)
+    json_path = json_path or METRICS_JSON_PATH
+    prom_path = prom_path or METRICS_PROM_PATH
+
+    if json_path:
+        _atomic_write(json_path, json.dumps(report, indent=2, ensure_ascii=False))
+        print(f"[MÉTRICAS] Relatório da execução gravado em {json_path}.")
+    if prom_path:
+        _atomic_write(prom_path, '\n'.join(_prometheus_lines(report)) + '\n')
+        print(f"[MÉTRICAS] Métricas Prometheus gravadas em {prom_path}.")
+    return report
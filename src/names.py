@@ -0,0 +1,67 @@
+import os
+import json
+import threading
+import pandas as pd
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Cache local ID → nome (um arquivo por conta), alimentado pela sincronização da dimensão
+DIM_NAME_CACHE_DIR = os.getenv("DIM_NAME_CACHE_DIR", os.path.join(".etl_state", "dim_names"))
+
+LEVELS = ['ad', 'adset', 'campaign']
+
+_lock = threading.Lock()
+_memory = {}
+
+
+def _path(account_id: str) -> str:
+    return os.path.join(DIM_NAME_CACHE_DIR, f"{str(account_id).replace('act_', '')}.json")
+
+
+def load_names(account_id: str) -> dict:
+    """Cache de nomes da conta: {'ad': {id: {'name', 'adset_id', 'campaign_id'}}, 'adset': {...}, 'campaign': {...}}."""
+    key = str(account_id).replace('act_', '')
+    with _lock:
+        if key not in _memory:
+            path = _path(account_id)
+            if os.path.exists(path):
+                with open(path, encoding='utf-8') as f:
+                    _memory[key] = json.load(f)
+            else:
+                _memory[key] = {level: {} for level in LEVELS}
+        return _memory[key]
+
+
+def save_names(account_id: str, names: dict):
+    """Grava o cache de nomes da conta (escrita atômica)."""
+    key = str(account_id).replace('act_', '')
+    path = _path(account_id)
+    with _lock:
+        _memory[key] = names
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(names, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+
+def has_names(account_id: str) -> bool:
+    return bool(load_names(account_id)['ad'])
+
+
+def lookup(account_id: str, level: str, ids) -> pd.Series:
+    """Nomes para uma série de IDs de um nível ('ad', 'adset' ou 'campaign'); None se desconhecido."""
+    entities = load_names(account_id)[level]
+    ids = pd.Series(ids)
+    return ids.map(lambda entity_id: entities.get(str(entity_id), {}).get('name'))
+
+
+def attach_names(df: pd.DataFrame, account_id: str) -> pd.DataFrame:
+    """Adiciona ad_name/adset_name/campaign_name a um DataFrame fato a partir do cache, sem chamar a API."""
+    df = df.copy()
+    for level in LEVELS:
+        id_col, name_col = f'{level}_id', f'{level}_name'
+        if id_col in df.columns:
+            df[name_col] = lookup(account_id, level, df[id_col]).values
+    return df
@@ -0,0 +1,75 @@
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+def run_tasks(tasks: list, max_workers: int = None) -> dict:
+    """Executa um DAG de tarefas, rodando em paralelo as que não dependem umas das outras.
+
+    Cada tarefa é (nome, função, [dependências]); a função recebe, na ordem, os resultados das
+    dependências. Uma tarefa começa assim que todas as suas dependências terminam com sucesso;
+    se alguma falhar, as dependentes são marcadas como 'skipped'.
+
+    Devolve {nome: {'status', 'seconds', 'error', 'result'}} na ordem de declaração.
+    """
+    names = [name for name, _, _ in tasks]
+    specs = {name: (fn, list(deps)) for name, fn, deps in tasks}
+    for name, (_, deps) in specs.items():
+        unknown = [dep for dep in deps if dep not in specs]
+        if unknown:
+            raise ValueError(f"Tarefa '{name}' depende de tarefas inexistentes: {unknown}")
+
+    report = {name: {'status': 'pending', 'seconds': 0.0, 'error': None, 'result': None} for name in names}
+    running = {}
+
+    def execute(name):
+        fn, deps = specs[name]
+        started = time.monotonic()
+        try:
+            return fn(*[report[dep]['result'] for dep in deps]), None, time.monotonic() - started
+        except Exception as e:
+            traceback.print_exc()
+            return None, e, time.monotonic() - started
+
+    with ThreadPoolExecutor(max_workers=max_workers or max(1, len(tasks))) as executor:
+        while True:
+            for name in names:
+                if report[name]['status'] != 'pending':
+                    continue
+                dep_status = [report[dep]['status'] for dep in specs[name][1]]
+                if any(status in ('failed', 'skipped') for status in dep_status):
+                    report[name]['status'] = 'skipped'
+                    print(f"[ORQUESTRAÇÃO] {name}: ignorada (dependência falhou).")
+                elif all(status == 'success' for status in dep_status):
+                    report[name]['status'] = 'running'
+                    running[executor.submit(execute, name)] = name
+                    print(f"[ORQUESTRAÇÃO] {name}: iniciada.")
+
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                result, error, seconds = future.result()
+                report[name].update(result=result, error=error, seconds=seconds,
+                                    status='failed' if error else 'success')
+                print(f"[ORQUESTRAÇÃO] {name}: {report[name]['status']} em {seconds:.1f}s.")
+
+    for name in names:
+        if report[name]['status'] == 'pending':
+            report[name].update(status='failed', error=ValueError('dependência circular'))
+
+    return report
+
+
+def print_report(report: dict):
+    """Imprime o status de cada tarefa ao fim da execução."""
+    print('\n=== RESUMO DA ORQUESTRAÇÃO ===')
+    for name, info in report.items():
+        error = f" — {info['error']}" if info['error'] else ''
+        print(f"  {name:<32} {info['status']:<8} {info['seconds']:>8.1f}s{error}")
+
+
+def has_failures(report: dict) -> bool:
+    return any(info['status'] != 'success' for info in report.values())
@@ -0,0 +1,117 @@
+import os
+import glob
+import uuid
+import pandas as pd
+from dotenv import load_dotenv
+
+from . import metrics
+from .load import _get_key_cols
+
+load_dotenv()
+
+# Destino das cargas: 'db' (padrão), 'parquet' ou 'both'
+ETL_SINK = os.getenv("ETL_SINK", "db").lower()
+# Raiz do dataset Parquet (uma pasta por tabela, partições no formato hive chave=valor)
+PARQUET_DIR = os.getenv("PARQUET_DIR", os.path.join("data", "parquet"))
+
+
+# Coluna de data que define a partição diária de cada tabela (padrão: date_start) e o nome da partição
+_DATE_PARTITIONS = {'ads_raw_leads': ('created_time', 'created_date')}
+
+
+def writes_db() -> bool:
+    return ETL_SINK in ('db', 'both')
+
+
+def writes_parquet() -> bool:
+    return ETL_SINK in ('parquet', 'both')
+
+
+def _partition_dir(table_name: str, account_id, day: str = None) -> str:
+    parts = [PARQUET_DIR, table_name, f'account_id={account_id}']
+    if day is not None:
+        parts.append(f"{_DATE_PARTITIONS.get(table_name, ('date_start', 'date_start'))[1]}={day}")
+    return os.path.join(*parts)
+
+
+def _write_file(df: pd.DataFrame, partition_dir: str) -> str:
+    """Grava um arquivo novo na partição (nome temporário + rename, leitores nunca veem arquivo pela metade)."""
+    os.makedirs(partition_dir, exist_ok=True)
+    path = os.path.join(partition_dir, f'part-{uuid.uuid4().hex}.parquet')
+    tmp_path = f'{path}.tmp'
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    return path
+
+
+def _replace_partition(df: pd.DataFrame, partition_dir: str, keep_existing: bool = False):
+    """Grava df na partição e, a menos que keep_existing, remove os arquivos anteriores dela."""
+    previous = glob.glob(os.path.join(partition_dir, '*.parquet'))
+    _write_file(df, partition_dir)
+    if not keep_existing:
+        for path in previous:
+            os.remove(path)
+
+
+def _write_dimension(df: pd.DataFrame, table_name: str) -> int:
+    """Dimensão: uma partição por conta, com UPSERT pela chave (a sincronização incremental só traz os afetados).
+
+    Devolve o número de partições gravadas.
+    """
+    key_cols = _get_key_cols(table_name)
+    for account_id, df_account in df.groupby('account_id', sort=False):
+        partition_dir = _partition_dir(table_name, account_id)
+        files = glob.glob(os.path.join(partition_dir, '*.parquet'))
+        df_new = df_account.drop(columns='account_id')
+        if files:
+            df_old = pd.concat([pd.read_parquet(path) for path in files], ignore_index=True)
+            keys = [col for col in key_cols if col != 'account_id']
+            df_new = pd.concat([df_old, df_new], ignore_index=True).drop_duplicates(subset=keys, keep='last')
+        _replace_partition(df_new, partition_dir)
+    return df['account_id'].nunique()
+
+
+def write_parquet(df: pd.DataFrame, table_name: str, written: set = None) -> int:
+    """Grava o DataFrame no dataset Parquet da tabela, particionado por conta e dia (date_start; leads brutos: created_time).
+
+    Idempotente por partição: cada dia de cada conta presente em df substitui por inteiro a
+    partição anterior desse dia (dias que não vieram no lote ficam como estão). Em streaming, um
+    dia pode chegar em mais de um bloco: passe o mesmo conjunto written em todos os blocos para
+    que só o primeiro bloco de cada dia descarte os arquivos antigos. Tabelas sem date_start
+    (dimensão) são particionadas só por conta. Devolve o número de linhas gravadas.
+    """
+    if df.empty:
+        return 0
+
+    with metrics.stage(f'parquet.{table_name}', rows_in=len(df)) as stage:
+        date_col, partition_col = _DATE_PARTITIONS.get(table_name, ('date_start', 'date_start'))
+        if date_col not in df.columns:
+            partitions = _write_dimension(df, table_name)
+        else:
+            written = set() if written is None else written
+            days = pd.to_datetime(df[date_col], errors='coerce').dt.strftime('%Y-%m-%d')
+            # A coluna vira o valor da partição; um timestamp (created_time) continua no arquivo
+            partition_cols = ['account_id'] + ([date_col] if date_col == partition_col else [])
+            partitions = 0
+            for (account_id, day), df_day in df.groupby([df['account_id'], days], sort=False):
+                key = (account_id, day)
+                _replace_partition(df_day.drop(columns=partition_cols),
+                                   _partition_dir(table_name, account_id, day), keep_existing=key in written)
+                written.add(key)
+                partitions += 1
+        stage.rows_out = len(df)
+
+    print(f"[PARQUET: {table_name}] {len(df)} linhas gravadas em {partitions} partições de '{PARQUET_DIR}'.")
+    return len(df)
+
+
+def write_through(frames, table_name: str, written: set = None):
+    """Grava cada bloco de um pipeline em streaming no Parquet e o repassa adiante (ex.: para a carga no banco).
+
+    Quando vários streams gravam as mesmas partições (leads brutos de várias Páginas na mesma
+    conta e dia), passe o mesmo conjunto written para todos.
+    """
+    written = set() if written is None else written
+    for df in frames:
+        write_parquet(df, table_name, written)
+        yield df
@@ -1,19 +1,7 @@
-from ..transform import run_etl_pipeline_campaigns
-from ..load import load_data_to_db 
+import sys
 
-# Constantes para a tabela de Performance
-CAMPAIGN_TABLE = 'ads_campaign_performance'
-TOTAL_DAYS_HISTORIC = 1
+from ..cli import main
 
-
-print(f'=== INICIANDO ETL: {CAMPAIGN_TABLE} (Performance) ===')
-
-
-try:
-    df_campaign_final = run_etl_pipeline_campaigns(total_days=TOTAL_DAYS_HISTORIC)
-    load_data_to_db(df_campaign_final, table_name=CAMPAIGN_TABLE) 
-    print(f'=== ETL {CAMPAIGN_TABLE} CONCLUÍDO COM SUCESSO ===')
-
-except Exception as e:
-    print(f'ERRO CRÍTICO NO FLUXO ETL {CAMPAIGN_TABLE}: {e}')
-    exit(1)
\ No newline at end of file
+# Atalho para `python -m src run performance` (importar este módulo não executa nada)
+if __name__ == '__main__':
+    sys.exit(main(['run', 'performance', *sys.argv[1:]]))
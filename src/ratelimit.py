@@ -0,0 +1,233 @@
+import os
+import re
+import json
+import time
+import random
+import threading
+from urllib.parse import urlparse
+from dotenv import load_dotenv
+
+from facebook_business.api import FacebookAdsApi
+from facebook_business.session import FacebookSession
+from facebook_business.exceptions import FacebookRequestError
+
+from . import metrics
+
+load_dotenv()
+
+# Concorrência de chamadas à Graph API compartilhada por todos os extratores do processo
+API_MAX_CONCURRENCY = int(os.getenv("API_MAX_CONCURRENCY", "8"))
+API_MIN_CONCURRENCY = int(os.getenv("API_MIN_CONCURRENCY", "1"))
+
+# Uso (%) informado pelos headers do Meta: acima do alto reduz, abaixo do baixo volta a subir
+API_USAGE_HIGH_PCT = float(os.getenv("API_USAGE_HIGH_PCT", "75"))
+API_USAGE_LOW_PCT = float(os.getenv("API_USAGE_LOW_PCT", "50"))
+
+API_THROTTLE_MAX_RETRIES = int(os.getenv("API_THROTTLE_MAX_RETRIES", "6"))
+API_BACKOFF_BASE_SECONDS = float(os.getenv("API_BACKOFF_BASE_SECONDS", "5"))
+API_BACKOFF_MAX_SECONDS = float(os.getenv("API_BACKOFF_MAX_SECONDS", "300"))
+
+# Códigos de erro de limite da Graph API (app, usuário, página, conta de anúncios e Business Use Case)
+THROTTLE_ERROR_CODES = {4, 17, 32, 613} | set(range(80000, 80015))
+
+USAGE_HEADERS = ['x-business-use-case-usage', 'x-ad-account-usage', 'x-app-usage', 'x-fb-ads-insights-throttle']
+
+
+class RateLimitExhausted(RuntimeError):
+    """Limite de chamadas do Meta persistiu após todas as novas tentativas."""
+
+
+def is_throttle_error(error: Exception) -> bool:
+    return isinstance(error, FacebookRequestError) and error.api_error_code() in THROTTLE_ERROR_CODES
+
+
+def parse_usage_headers(headers) -> tuple:
+    """Lê os headers de uso do Meta e devolve (maior % de uso, segundos até recuperar o acesso)."""
+    usage_pct = 0.0
+    wait_seconds = 0.0
+    if not headers:
+        return usage_pct, wait_seconds
+
+    for name in USAGE_HEADERS:
+        raw = headers.get(name)
+        if not raw:
+            continue
+        try:
+            payload = json.loads(raw)
+        except (TypeError, ValueError):
+            continue
+
+        if name == 'x-business-use-case-usage':
+            # {"<business_id>": [{"type": ..., "call_count": %, "total_cputime": %, "total_time": %,
+            #                     "estimated_time_to_regain_access": minutos}]}
+            for entries in payload.values():
+                for entry in entries:
+                    usage_pct = max(usage_pct, entry.get('call_count', 0), entry.get('total_cputime', 0),
+                                    entry.get('total_time', 0))
+                    wait_seconds = max(wait_seconds, 60 * entry.get('estimated_time_to_regain_access', 0))
+        elif name == 'x-ad-account-usage':
+            usage_pct = max(usage_pct, payload.get('acc_id_util_pct', 0))
+            if payload.get('acc_id_util_pct', 0) >= 100:
+                wait_seconds = max(wait_seconds, payload.get('reset_time_duration', 0))
+        elif name == 'x-app-usage':
+            usage_pct = max(usage_pct, payload.get('call_count', 0), payload.get('total_cputime', 0),
+                            payload.get('total_time', 0))
+        else:
+            usage_pct = max(usage_pct, payload.get('app_id_util_pct', 0), payload.get('acc_id_util_pct', 0))
+
+    return float(usage_pct), float(wait_seconds)
+
+
+class RequestScheduler:
+    """Agenda as chamadas à Graph API conforme o uso reportado pelo Meta.
+
+    Mantém um limite de chamadas simultâneas ajustado em AIMD (reduz pela metade acima de
+    API_USAGE_HIGH_PCT, soma 1 abaixo de API_USAGE_LOW_PCT), espaça as chamadas quando o uso
+    se aproxima de 100% e pausa todo o processo quando o Meta informa tempo de bloqueio.
+    """
+
+    def __init__(self, max_concurrency: int = API_MAX_CONCURRENCY, min_concurrency: int = API_MIN_CONCURRENCY):
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self.limit = self.max_concurrency
+        self.usage_pct = 0.0
+        self.throttle_events = 0
+        self.throttle_wait_seconds = 0.0
+        self._in_flight = 0
+        # Semáforo compartilhado entre processos que usam a mesma conta (ver accounts.py)
+        self.shared_slots = None
+        self._pause_until = 0.0
+        self._next_slot = 0.0
+        self._cond = threading.Condition()
+
+    def _pacing_interval(self) -> float:
+        """Intervalo mínimo entre chamadas: zero até o limite alto, crescendo até 2s perto de 100%."""
+        if self.usage_pct <= API_USAGE_HIGH_PCT:
+            return 0.0
+        excess = (self.usage_pct - API_USAGE_HIGH_PCT) / max(1.0, 100 - API_USAGE_HIGH_PCT)
+        return min(2.0, 2.0 * excess)
+
+    def acquire(self):
+        if self.shared_slots is not None:
+            self.shared_slots.acquire()
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                wait = max(self._pause_until, self._next_slot) - now
+                if self._in_flight < self.limit and wait <= 0:
+                    self._in_flight += 1
+                    self._next_slot = now + self._pacing_interval()
+                    return
+                self._cond.wait(timeout=wait if wait > 0 else None)
+
+    def release(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+        if self.shared_slots is not None:
+            self.shared_slots.release()
+
+    def observe(self, headers):
+        """Atualiza limite e ritmo a partir dos headers de uso de uma resposta."""
+        usage_pct, wait_seconds = parse_usage_headers(headers)
+        with self._cond:
+            self.usage_pct = usage_pct
+            if usage_pct >= API_USAGE_HIGH_PCT:
+                self.limit = max(self.min_concurrency, self.limit // 2)
+            elif usage_pct < API_USAGE_LOW_PCT:
+                self.limit = min(self.max_concurrency, self.limit + 1)
+            if wait_seconds > 0:
+                self._pause(wait_seconds)
+            self._cond.notify_all()
+        if wait_seconds > 0:
+            metrics.record_throttle(wait_seconds)
+
+    def _pause(self, seconds: float):
+        self._pause_until = max(self._pause_until, time.monotonic() + seconds)
+
+    def backoff(self, attempt: int, headers=None) -> float:
+        """Pausa global após um erro de limite: espera informada pelo Meta ou exponencial com jitter."""
+        _, wait_seconds = parse_usage_headers(headers)
+        if wait_seconds <= 0:
+            wait_seconds = min(API_BACKOFF_MAX_SECONDS, API_BACKOFF_BASE_SECONDS * 2 ** attempt)
+        wait_seconds *= random.uniform(0.5, 1.5)
+
+        with self._cond:
+            self.limit = self.min_concurrency
+            self.throttle_events += 1
+            self.throttle_wait_seconds += wait_seconds
+            self._pause(wait_seconds)
+            self._cond.notify_all()
+        metrics.record_throttle(wait_seconds)
+        return wait_seconds
+
+    def call(self, fn, *args, **kwargs):
+        """Executa fn respeitando o limite; erros de limite são repetidos com backoff."""
+        for attempt in range(API_THROTTLE_MAX_RETRIES + 1):
+            self.acquire()
+            try:
+                response = fn(*args, **kwargs)
+            except FacebookRequestError as e:
+                if not is_throttle_error(e):
+                    raise
+                if attempt == API_THROTTLE_MAX_RETRIES:
+                    raise RateLimitExhausted(
+                        f"Limite da API do Meta (código {e.api_error_code()}) após {attempt} novas tentativas."
+                    ) from e
+                wait_seconds = self.backoff(attempt, e.http_headers())
+                print(f"[API] Limite atingido (código {e.api_error_code()}). Nova tentativa em {wait_seconds:.0f}s.")
+                continue
+            finally:
+                self.release()
+
+            self.observe(response.headers())
+            return response
+
+
+scheduler = RequestScheduler()
+
+
+def _endpoint_label(path) -> str:
+    """Nome curto do endpoint para as métricas: a edge ('insights', 'ads', 'leads') ou 'node'."""
+    if isinstance(path, str):
+        path = [part for part in urlparse(path).path.split('/') if part]
+    tokens = [str(token) for token in path if token and not re.fullmatch(r'v\d+(\.\d+)?', str(token))]
+    if len(tokens) >= 2:
+        return tokens[-1]
+    return 'node' if tokens else 'batch'
+
+
+class ScheduledFacebookAdsApi(FacebookAdsApi):
+    """FacebookAdsApi cujas chamadas (inclusive paginação, batch e polling) passam pelo scheduler.
+
+    Cada chamada é contada nas métricas da execução: tempo, bytes recebidos e páginas de cursor.
+    """
+
+    def call(self, method, path, *args, **kwargs):
+        endpoint = _endpoint_label(path)
+        started = time.perf_counter()
+        try:
+            response = scheduler.call(super().call, method, path, *args, **kwargs)
+        except Exception:
+            metrics.record_api_error(endpoint)
+            raise
+
+        body = response.body() or ''
+        metrics.record_api_call(endpoint, time.perf_counter() - started, len(body.encode('utf-8')),
+                                is_page=method == 'GET' and endpoint not in ('node', 'batch'))
+        return response
+
+
+_api_lock = threading.Lock()
+_apis = {}
+
+
+def init_api(app_id: str, app_secret: str, access_token: str) -> FacebookAdsApi:
+    """Devolve a API com agendamento de chamadas (uma sessão por processo e credenciais) e a registra como padrão do SDK."""
+    key = (app_id, app_secret, access_token)
+    with _api_lock:
+        api = _apis.get(key)
+        if api is None:
+            api = _apis[key] = ScheduledFacebookAdsApi(FacebookSession(app_id, app_secret, access_token))
+        FacebookAdsApi.set_default_api(api)
+        return api
@@ -0,0 +1,132 @@
+import os
+import pandas as pd
+from dotenv import load_dotenv
+from sqlalchemy import text
+
+from . import metrics, ddl
+
+load_dotenv()
+
+# Mantém as tabelas agregadas para BI após cada carga das tabelas fato (0 = desliga)
+ROLLUP_ENABLED = os.getenv("ROLLUP_ENABLED", "1") == "1"
+
+# Razões recalculadas a partir das somas (nunca média das razões por linha); 0 quando o denominador é 0,
+# como em _recalculate_metrics
+_CAMPAIGN_SUMS = {
+    'total_impressions': 'SUM(total_impressions)',
+    'total_clicks': 'SUM(total_clicks)',
+    'total_spend': 'SUM(total_spend)',
+    'total_leads': 'SUM(total_leads)',
+    'total_successes': 'SUM(total_successes)',
+    'cpc': 'COALESCE(SUM(total_spend)::DOUBLE PRECISION / NULLIF(SUM(total_clicks), 0), 0)',
+    'ctr': 'COALESCE(SUM(total_clicks)::DOUBLE PRECISION / NULLIF(SUM(total_impressions), 0), 0)',
+    'cpl': 'COALESCE(SUM(total_spend)::DOUBLE PRECISION / NULLIF(SUM(total_leads), 0), 0)',
+}
+
+_BREAKDOWN_SUMS = {
+    'total_spend': 'SUM(total_spend)',
+    'total_leads': 'SUM(total_leads)',
+    'cpl': 'COALESCE(SUM(total_spend)::DOUBLE PRECISION / NULLIF(SUM(total_leads), 0), 0)',
+}
+
+# Agregados mantidos por tabela fato: granularidade do período (date_trunc), colunas de agrupamento
+# além de account_id/campaign_id e as expressões das métricas. As tabelas estão em ddl.TABLES.
+ROLLUPS = {
+    'ads_campaign_performance': {
+        'ads_campaign_daily': {'grain': 'day', 'group_by': [], 'metrics': _CAMPAIGN_SUMS},
+        'ads_campaign_weekly': {'grain': 'week', 'group_by': [], 'metrics': _CAMPAIGN_SUMS},
+        'ads_campaign_monthly': {'grain': 'month', 'group_by': [], 'metrics': _CAMPAIGN_SUMS},
+    },
+    'ads_lead_insights': {
+        'ads_lead_breakdown_monthly': {'grain': 'month', 'group_by': ['breakdown_type', 'age', 'gender', 'region'],
+                                       'metrics': _BREAKDOWN_SUMS},
+    },
+}
+
+
+def touched_ranges(df: pd.DataFrame, ranges: dict = None) -> dict:
+    """Período (primeira, última data) de cada conta presente no lote, somado a ranges se informado."""
+    ranges = dict(ranges or {})
+    if df.empty or 'account_id' not in df.columns or 'date_start' not in df.columns:
+        return ranges
+    dates = pd.to_datetime(df['date_start'], errors='coerce')
+    bounds = dates.groupby(df['account_id'].values).agg(['min', 'max']).dropna()
+    for account_id, row in bounds.iterrows():
+        first, last = row['min'].date(), row['max'].date()
+        if account_id in ranges:
+            first, last = min(first, ranges[account_id][0]), max(last, ranges[account_id][1])
+        ranges[int(account_id)] = (first, last)
+    return ranges
+
+
+def track_ranges(frames, ranges: dict):
+    """Repassa os blocos de um pipeline em streaming acumulando em ranges o período de cada conta."""
+    for df in frames:
+        ranges.update(touched_ranges(df, ranges))
+        yield df
+
+
+def _refresh_query(source_table: str, rollup_table: str, spec: dict) -> tuple:
+    """DELETE + INSERT ... SELECT dos períodos inteiros (dia/semana/mês) que cobrem as datas tocadas."""
+    grain = spec['grain']
+    group_cols = ['account_id', 'campaign_id'] + spec['group_by']
+    first_period = f"date_trunc('{grain}', CAST(:first AS DATE))::DATE"
+    last_period = f"date_trunc('{grain}', CAST(:last AS DATE))::DATE"
+
+    delete = text(f"""
+        DELETE FROM {rollup_table}
+        WHERE account_id = :account_id AND period_start BETWEEN {first_period} AND {last_period}
+    """)
+
+    insert_cols = ', '.join(f'"{col}"' for col in group_cols + ['period_start'] + list(spec['metrics']))
+    select_cols = ', '.join(
+        # campaign_id é parte da chave do agregado: anúncios sem campanha ficam em 0
+        ['account_id', 'COALESCE(campaign_id, 0)'] + [f'"{col}"' for col in spec['group_by']]
+        + [f"date_trunc('{grain}', date_start)::DATE"] + list(spec['metrics'].values())
+    )
+    group_sql = ', '.join(str(i) for i in range(1, len(group_cols) + 2))
+    insert = text(f"""
+        INSERT INTO {rollup_table} ({insert_cols})
+        SELECT {select_cols}
+        FROM {source_table}
+        WHERE account_id = :account_id
+          AND date_start >= {first_period}
+          AND date_start < {last_period} + INTERVAL '1 {grain}'
+        GROUP BY {group_sql}
+    """)
+    return delete, insert
+
+
+def refresh_rollups(engine, source_table: str, ranges: dict) -> int:
+    """Recalcula os agregados de source_table apenas nos períodos tocados pela carga.
+
+    ranges = {account_id: (primeira_data, última_data)}, como devolvido por touched_ranges. Cada
+    período afetado (dia, semana ou mês inteiro) é apagado e refeito a partir da tabela fato na
+    mesma transação, então reprocessar é idempotente. Só PostgreSQL (date_trunc). Devolve o total
+    de linhas gravadas nos agregados.
+    """
+    rollups = ROLLUPS.get(source_table)
+    if not ROLLUP_ENABLED or not rollups or not ranges or engine is None:
+        return 0
+    if engine.dialect.name != 'postgresql':
+        print(f"[AGREGADOS: {source_table}] Dialeto {engine.dialect.name} não suportado; agregados não atualizados.")
+        return 0
+
+    total_rows = 0
+    for rollup_table, spec in rollups.items():
+        if ddl.DB_MANAGE_DDL:
+            ddl.ensure_table(engine, rollup_table, pd.DataFrame())
+
+        delete, insert = _refresh_query(source_table, rollup_table, spec)
+        with metrics.stage(f'rollup.{rollup_table}', rows_in=len(ranges)) as stage:
+            rows = 0
+            with metrics.db_statement(rollup_table, 'refresh'), engine.begin() as connection:
+                for account_id, (first, last) in ranges.items():
+                    params = {'account_id': int(account_id), 'first': first, 'last': last}
+                    connection.execute(delete, params)
+                    rows += connection.execute(insert, params).rowcount
+            stage.rows_out = rows
+
+        total_rows += rows
+        print(f"[AGREGADOS: {rollup_table}] {rows} linhas recalculadas ({len(ranges)} contas).")
+    return total_rows
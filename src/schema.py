@@ -0,0 +1,130 @@
+import numpy as np
+import pandas as pd
+
+
+# Colunas de chave e de quebra comuns às tabelas fato
+ID_COLS = ['account_id', 'ad_id', 'adset_id', 'campaign_id']
+BREAKDOWN_COLS = ['age', 'gender', 'region']
+DATE_COLS = ['date_start', 'date_stop']
+
+# Contagens (impressões, cliques, ações) por anúncio/dia cabem em int32; se não couberem, sobem para int64
+COUNT_DTYPE = 'int32'
+MONEY_DTYPE = 'float64'
+RATIO_DTYPE = 'float32'
+
+# action_types pedidos à API de Insights por pipeline (nomes da API). Ações fora da lista são
+# descartadas ainda na extração.
+CAMPAIGN_ACTION_TYPES = ['lead']
+LEAD_ACTION_TYPES = [
+    'lead', 'purchase', 'link_click', 'page_engagement', 'post_engagement', 'video_view', 'comment',
+    'offsite_complete_registration_add_meta_leads', 'onsite_conversion.lead_grouped',
+    'offsite_search_add_meta_leads', 'offsite_content_view_add_meta_leads',
+    'onsite_conversion.messaging_first_reply', 'onsite_conversion.messaging_conversation_started_7d',
+    'onsite_conversion.total_messaging_connection', 'onsite_conversion.messaging_conversation_replied_7d',
+    'offsite_conversion.fb_pixel_lead', 'offsite_conversion.fb_pixel_purchase',
+    'onsite_conversion.messaging_block',
+]
+
+
+def action_column(action_type: str) -> str:
+    """Nome da coluna de um action_type da API (ex.: 'onsite_conversion.lead_grouped' → 'onsite_conversion_lead_grouped')."""
+    return action_type.replace('.', '_')
+
+
+# Colunas de ações de cada pipeline
+CAMPAIGN_ACTION_COLUMNS = [action_column(t) for t in CAMPAIGN_ACTION_TYPES]
+ALLOWED_ACTION_COLUMNS = [action_column(t) for t in LEAD_ACTION_TYPES]
+
+# Schema declarado das tabelas fato. Colunas de ações (ALLOWED_ACTION_COLUMNS) não listadas aqui
+# seguem COUNT_DTYPE.
+TABLE_SCHEMAS = {
+    'ads_campaign_performance': {
+        'date_start': 'datetime64[ns]',
+        'account_id': 'int64', 'ad_id': 'int64', 'adset_id': 'int64', 'campaign_id': 'int64',
+        'total_impressions': COUNT_DTYPE, 'total_clicks': COUNT_DTYPE,
+        'total_spend': MONEY_DTYPE,
+        'total_leads': COUNT_DTYPE, 'total_successes': COUNT_DTYPE,
+        'cpc': RATIO_DTYPE, 'ctr': RATIO_DTYPE, 'cpl': RATIO_DTYPE,
+    },
+    'ads_lead_insights': {
+        'date_start': 'datetime64[ns]',
+        'account_id': 'int64', 'ad_id': 'int64', 'adset_id': 'int64', 'campaign_id': 'int64',
+        'breakdown_type': 'category',
+        'age': 'category', 'gender': 'category', 'region': 'category',
+        'total_spend': MONEY_DTYPE,
+        'total_leads': COUNT_DTYPE,
+    },
+}
+
+
+def to_id(series: pd.Series) -> pd.Series:
+    """IDs do Meta (strings numéricas de até 19 dígitos) como int64; Int64 se houver vazios."""
+    # Conversão direta para Int64: passar por float64 (o que acontece com nulos) arredonda IDs acima de 2^53
+    values = pd.to_numeric(series, errors='coerce', dtype_backend='numpy_nullable')
+    if values.isna().any():
+        return values.astype('Int64')
+    return values.astype('int64')
+
+
+def to_count(series: pd.Series, dtype: str = COUNT_DTYPE) -> pd.Series:
+    """Contagem sem nulos no menor inteiro declarado que comporte os valores."""
+    values = pd.to_numeric(series, errors='coerce').fillna(0)
+    info = np.iinfo(dtype)
+    if len(values) and (values.max() > info.max or values.min() < info.min):
+        return values.astype('int64')
+    return values.astype(dtype)
+
+
+def _to_dtype(series: pd.Series, dtype: str) -> pd.Series:
+    if str(series.dtype) == dtype:
+        return series
+    if dtype == 'int64' and series.name in ID_COLS:
+        return to_id(series)
+    if dtype.startswith('int'):
+        return to_count(series, dtype)
+    if dtype.startswith('float'):
+        return pd.to_numeric(series, errors='coerce').fillna(0).astype(dtype)
+    if dtype.startswith('datetime'):
+        return pd.to_datetime(series, errors='coerce')
+    return series.astype(dtype)
+
+
+def coerce_keys(df: pd.DataFrame) -> pd.DataFrame:
+    """Tipa chaves e quebras logo após a extração (antes de groupby/merge): IDs int64, quebras categóricas."""
+    for col in ID_COLS:
+        if col in df.columns:
+            df[col] = to_id(df[col])
+    for col in BREAKDOWN_COLS:
+        if col in df.columns:
+            df[col] = df[col].astype('category')
+    for col in DATE_COLS:
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], errors='coerce')
+    return df
+
+
+def fill_missing(df: pd.DataFrame, value=0) -> pd.DataFrame:
+    """fillna que também aceita colunas categóricas (o valor vira uma categoria nova)."""
+    for col in df.columns[df.isna().any()]:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            if value not in df[col].cat.categories:
+                df[col] = df[col].cat.add_categories([value])
+            df[col] = df[col].fillna(value)
+        else:
+            df[col] = df[col].fillna(value)
+    return df
+
+
+def enforce_schema(df: pd.DataFrame, table_name: str, count_cols: list = None) -> pd.DataFrame:
+    """Aplica o schema declarado da tabela; count_cols (ex.: ações) recebem COUNT_DTYPE."""
+    if df.empty:
+        return df
+    declared = dict(TABLE_SCHEMAS[table_name])
+    for col in count_cols or []:
+        declared.setdefault(col, COUNT_DTYPE)
+
+    df = df.copy()
+    for col, dtype in declared.items():
+        if col in df.columns:
+            df[col] = _to_dtype(df[col], dtype)
+    return df
@@ -0,0 +1,220 @@
+import os
+import json
+import datetime
+import threading
+from dotenv import load_dotenv
+from sqlalchemy import text
+
+load_dotenv()
+
+# Onde ficam os watermarks: 'file' (JSON local) ou 'db' (tabela no banco de destino)
+WATERMARK_BACKEND = os.getenv("WATERMARK_BACKEND", "file")
+WATERMARK_FILE = os.getenv("WATERMARK_FILE", os.path.join(".etl_state", "watermarks.json"))
+WATERMARK_TABLE = 'etl_watermarks'
+
+# Checkpoints dos backfills (unidades conta × tabela × janela), no mesmo backend dos watermarks
+CHECKPOINT_FILE = os.getenv("CHECKPOINT_FILE", os.path.join(".etl_state", "backfill_units.json"))
+CHECKPOINT_TABLE = 'etl_backfill_units'
+
+# Dias reprocessados antes do watermark para capturar reatribuições tardias do Meta
+LOOKBACK_DAYS = int(os.getenv("LOOKBACK_DAYS", "7"))
+
+# Dimensão: dias de sobreposição do filtro updated_time em relação ao watermark
+DIM_SYNC_OVERLAP_DAYS = int(os.getenv("DIM_SYNC_OVERLAP_DAYS", "1"))
+
+
+# As cargas das tarefas rodam em paralelo: leitura + escrita do arquivo de watermarks é serializada
+_watermark_lock = threading.Lock()
+
+
+def _read_file_state() -> dict:
+    if not os.path.exists(WATERMARK_FILE):
+        return {}
+    with open(WATERMARK_FILE, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _write_file_state(state: dict):
+    os.makedirs(os.path.dirname(WATERMARK_FILE) or '.', exist_ok=True)
+    tmp_path = f'{WATERMARK_FILE}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, WATERMARK_FILE)
+
+
+def _get_engine():
+    from .load import get_engine
+    engine = get_engine()
+    if engine is None:
+        raise RuntimeError("Conexão com o banco indisponível para o WATERMARK_BACKEND='db'.")
+    return engine
+
+
+def _ensure_watermark_table(connection):
+    connection.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {WATERMARK_TABLE} (
+            table_name TEXT NOT NULL,
+            account_id TEXT NOT NULL,
+            last_loaded_date DATE NOT NULL,
+            updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (table_name, account_id)
+        )
+    """))
+
+
+def get_watermark(table_name: str, account_id: str) -> datetime.date:
+    """Último dia completo já carregado para (tabela, conta), ou None se nunca carregado."""
+    if WATERMARK_BACKEND == 'db':
+        with _get_engine().begin() as connection:
+            _ensure_watermark_table(connection)
+            value = connection.execute(
+                text(f"SELECT last_loaded_date FROM {WATERMARK_TABLE} WHERE table_name = :t AND account_id = :a"),
+                {'t': table_name, 'a': account_id}
+            ).scalar()
+        return value
+
+    with _watermark_lock:
+        value = _read_file_state().get(table_name, {}).get(account_id)
+    return datetime.date.fromisoformat(value) if value else None
+
+
+def set_watermark(table_name: str, account_id: str, last_loaded_date: datetime.date):
+    """Registra o último dia completo carregado para (tabela, conta)."""
+    if WATERMARK_BACKEND == 'db':
+        with _get_engine().begin() as connection:
+            _ensure_watermark_table(connection)
+            connection.execute(text(f"""
+                INSERT INTO {WATERMARK_TABLE} (table_name, account_id, last_loaded_date, updated_at)
+                VALUES (:t, :a, :d, CURRENT_TIMESTAMP)
+                ON CONFLICT (table_name, account_id)
+                DO UPDATE SET last_loaded_date = EXCLUDED.last_loaded_date, updated_at = EXCLUDED.updated_at
+            """), {'t': table_name, 'a': account_id, 'd': last_loaded_date})
+        return
+
+    with _watermark_lock:
+        state = _read_file_state()
+        state.setdefault(table_name, {})[account_id] = last_loaded_date.isoformat()
+        _write_file_state(state)
+
+
+def get_incremental_range(table_name: str, account_id: str, total_days: int, lookback_days: int = None) -> dict:
+    """Calcula o período da próxima extração incremental.
+
+    Com watermark, extrai de (watermark + 1 - lookback_days) até hoje; sem watermark, faz a
+    carga inicial dos últimos total_days dias.
+    """
+    lookback_days = LOOKBACK_DAYS if lookback_days is None else lookback_days
+    today = datetime.date.today()
+    watermark = get_watermark(table_name, account_id)
+
+    if watermark is None:
+        since = today - datetime.timedelta(days=max(0, total_days))
+        print(f"[ESTADO: {table_name}] Sem watermark para {account_id}. Carga inicial de {total_days} dias.")
+    else:
+        since = min(watermark + datetime.timedelta(days=1 - lookback_days), today)
+        print(f"[ESTADO: {table_name}] Watermark {watermark} para {account_id}. Reprocessando {lookback_days} dias de atribuição.")
+
+    return {'since': since.strftime('%Y-%m-%d'), 'until': today.strftime('%Y-%m-%d')}
+
+
+def get_updated_since(table_name: str, account_id: str, overlap_days: int = None) -> datetime.date:
+    """Data para o filtro updated_time da sincronização incremental (None = sincronização completa)."""
+    overlap_days = DIM_SYNC_OVERLAP_DAYS if overlap_days is None else overlap_days
+    watermark = get_watermark(table_name, account_id)
+    if watermark is None:
+        print(f"[ESTADO: {table_name}] Sem watermark para {account_id}. Sincronização completa.")
+        return None
+    since = watermark - datetime.timedelta(days=overlap_days)
+    print(f"[ESTADO: {table_name}] Watermark {watermark} para {account_id}. Entidades alteradas desde {since}.")
+    return since
+
+
+def commit_watermark(table_name: str, account_id: str, time_range: dict):
+    """Avança o watermark após uma carga bem-sucedida (o dia corrente ainda não está completo)."""
+    until = datetime.date.fromisoformat(time_range['until'])
+    last_complete = min(until, datetime.date.today() - datetime.timedelta(days=1))
+
+    current = get_watermark(table_name, account_id)
+    if current is not None and current >= last_complete:
+        return
+    set_watermark(table_name, account_id, last_complete)
+    print(f"[ESTADO: {table_name}] Watermark de {account_id} atualizado para {last_complete}.")
+
+
+_checkpoint_lock = threading.Lock()
+
+
+def _ensure_checkpoint_table(connection):
+    connection.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {CHECKPOINT_TABLE} (
+            table_name TEXT NOT NULL,
+            account_id TEXT NOT NULL,
+            since DATE NOT NULL,
+            until DATE NOT NULL,
+            status TEXT NOT NULL,
+            rows BIGINT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (table_name, account_id, since, until)
+        )
+    """))
+
+
+def _read_checkpoints() -> dict:
+    if not os.path.exists(CHECKPOINT_FILE):
+        return {}
+    with open(CHECKPOINT_FILE, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _write_checkpoints(checkpoints: dict):
+    os.makedirs(os.path.dirname(CHECKPOINT_FILE) or '.', exist_ok=True)
+    tmp_path = f'{CHECKPOINT_FILE}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(checkpoints, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, CHECKPOINT_FILE)
+
+
+def get_units(table_name: str, account_id: str) -> dict:
+    """Unidades de backfill já registradas para (tabela, conta): {(since, until): {'status', 'rows', 'attempts', 'error'}}."""
+    if WATERMARK_BACKEND == 'db':
+        with _get_engine().begin() as connection:
+            _ensure_checkpoint_table(connection)
+            rows = connection.execute(
+                text(f"SELECT since, until, status, rows, attempts, error FROM {CHECKPOINT_TABLE} "
+                     f"WHERE table_name = :t AND account_id = :a"),
+                {'t': table_name, 'a': account_id}
+            ).mappings().all()
+        return {(row['since'].isoformat(), row['until'].isoformat()):
+                {key: row[key] for key in ('status', 'rows', 'attempts', 'error')} for row in rows}
+
+    with _checkpoint_lock:
+        units = _read_checkpoints().get(table_name, {}).get(account_id, {})
+    return {tuple(key.split('/')): unit for key, unit in units.items()}
+
+
+def set_unit_status(table_name: str, account_id: str, time_range: dict, status: str, rows: int = None, error: str = None):
+    """Registra o status ('running', 'done' ou 'failed') de uma unidade; 'running' conta uma tentativa."""
+    attempt = 1 if status == 'running' else 0
+    if WATERMARK_BACKEND == 'db':
+        with _get_engine().begin() as connection:
+            _ensure_checkpoint_table(connection)
+            connection.execute(text(f"""
+                INSERT INTO {CHECKPOINT_TABLE} (table_name, account_id, since, until, status, rows, attempts, error, updated_at)
+                VALUES (:t, :a, :since, :until, :status, :rows, :attempt, :error, CURRENT_TIMESTAMP)
+                ON CONFLICT (table_name, account_id, since, until)
+                DO UPDATE SET status = EXCLUDED.status, rows = EXCLUDED.rows, error = EXCLUDED.error,
+                              attempts = {CHECKPOINT_TABLE}.attempts + EXCLUDED.attempts, updated_at = EXCLUDED.updated_at
+            """), {'t': table_name, 'a': account_id, 'since': time_range['since'], 'until': time_range['until'],
+                   'status': status, 'rows': rows, 'attempt': attempt, 'error': error})
+        return
+
+    with _checkpoint_lock:
+        checkpoints = _read_checkpoints()
+        units = checkpoints.setdefault(table_name, {}).setdefault(account_id, {})
+        key = f"{time_range['since']}/{time_range['until']}"
+        previous = units.get(key, {})
+        units[key] = {'status': status, 'rows': rows, 'error': error,
+                      'attempts': previous.get('attempts', 0) + attempt}
+        _write_checkpoints(checkpoints)
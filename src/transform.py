@@ -1,64 +1,128 @@
+import os
+import json
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
 
 from .extract import get_campaign_data_raw, get_lead_demographic_raw, get_lead_geographic_raw, get_name_dim_raw 
+from .extract import iter_campaign_data_raw, iter_raw_leads_data, get_time_windows
 import numpy as np 
 
+from . import metrics, schema
+from .schema import CAMPAIGN_ACTION_COLUMNS, ALLOWED_ACTION_COLUMNS
 
-ALLOWED_ACTION_COLUMNS = [
-    
-    'lead', 'purchase', 'link_click', 'page_engagement', 'post_engagement', 'video_view', 'comment',
-    
-    
-    'offsite_complete_registration_add_meta_leads', 'onsite_conversion_lead_grouped',
-    'offsite_search_add_meta_leads', 'offsite_content_view_add_meta_leads',
-    'onsite_conversion_messaging_first_reply', 'onsite_conversion_messaging_conversation_started_7d',
-    'onsite_conversion_total_messaging_connection', 'onsite_conversion_messaging_conversation_replied_7d',
-    'offsite_conversion_fb_pixel_lead', 'offsite_conversion_fb_pixel_purchase',
-    'onsite_conversion_messaging_block',
-]
+load_dotenv()
+
+# Leads brutos: chaves de field_data que também viram colunas próprias (field_<nome>), ex.: "email,phone_number"
+RAW_LEADS_FLATTEN_FIELDS = [f.strip() for f in os.getenv("RAW_LEADS_FLATTEN_FIELDS", "").split(",") if f.strip()]
+# Colunas aninhadas gravadas como JSONB em ads_raw_leads
+RAW_LEADS_JSON_COLS = ['field_data', 'ad_platform_data']
+
+
+def _explode_action_list(series: pd.Series, suffix: str = '', columns: list = None) -> tuple:
+    """Explode uma coluna de listas [{'action_type', 'value'}] em colunas (uma por action_type).
+
+    Devolve o DataFrame largo (valores numéricos, NaN onde a ação não aparece) e, para cada coluna,
+    a posição da primeira linha em que ela aparece. Com columns, só essas colunas são montadas
+    (todas elas, na ordem declarada, mesmo as que não aparecem em nenhuma linha).
+    """
+    exploded = series[series.map(lambda v: isinstance(v, list))].explode().dropna()
+    long = pd.DataFrame.from_records(exploded.tolist(), columns=['action_type', 'value'])
+    long['row'] = exploded.index
+    long['col'] = long['action_type'].str.replace('.', '_', regex=False) + suffix
+    if columns is not None:
+        long = long[long['col'].isin(columns)]
+    long['value'] = pd.to_numeric(long['value'], errors='coerce')
+
+    first_seen = long.drop_duplicates(subset='col').set_index('col')['row']
+    if columns is not None:
+        # Colunas declaradas que não aparecem ficam depois de todas as linhas
+        first_seen = first_seen.reindex(columns, fill_value=len(series))
+    if first_seen.empty:
+        return pd.DataFrame(index=series.index), pd.Series(dtype='int64')
+
+    # Mesma ação repetida na linha: prevalece o último valor (como na atribuição em dict)
+    long = long.drop_duplicates(subset=['row', 'col'], keep='last')
+    wide = long.pivot(index='row', columns='col', values='value')
+    wide = wide.reindex(index=series.index, columns=first_seen.index)
+    wide.columns.name = None
+    return wide, first_seen
 
 
+def _merge_action_columns(df: pd.DataFrame, df_wide: pd.DataFrame, first_seen: pd.Series = None) -> pd.DataFrame:
+    """Anexa as colunas explodidas ao DataFrame base, preservando a ordem de colunas do formato linha a linha.
 
-def _normalize_actions(df: pd.DataFrame) -> pd.DataFrame:
-    """Normaliza a coluna 'actions' e converte tipos."""
+    Com first_seen, a coluna de origem ('actions') só é mantida se alguma linha não trouxer lista,
+    posicionada onde o formato linha a linha a colocaria.
+    """
+    source_col = 'actions' if first_seen is not None else None
+
+    overlap = [col for col in df_wide.columns if col in df.columns]
+    for col in overlap:
+        df[col] = df_wide[col].where(df_wide[col].notna(), df[col])
+    new_cols = [col for col in df_wide.columns if col not in df.columns]
+
+    if source_col is None:
+        return pd.concat([df, df_wide[new_cols]], axis=1)
+
+    not_list = ~df[source_col].map(lambda v: isinstance(v, list))
+    if not not_list.any():
+        return pd.concat([df.drop(columns=[source_col]), df_wide[new_cols]], axis=1)
+
+    first_not_list = not_list.idxmax()
+    df[source_col] = df[source_col].where(not_list, np.nan)
+    if first_not_list == 0:
+        return pd.concat([df, df_wide[new_cols]], axis=1)
+
+    before = [col for col in new_cols if first_seen[col] < first_not_list]
+    after = [col for col in new_cols if first_seen[col] >= first_not_list]
+    return pd.concat([df.drop(columns=[source_col]), df_wide[before], df[[source_col]], df_wide[after]], axis=1)
+
+
+def _normalize_actions(df: pd.DataFrame, action_columns: list = None) -> pd.DataFrame:
+    """Normaliza as colunas 'actions' e 'action_values' e converte tipos.
+
+    Cada action_type vira uma coluna de contagem (schema.COUNT_DTYPE) e cada entrada de
+    'action_values' vira uma coluna monetária '<action_type>_value'; com action_columns, só as
+    ações declaradas pelo pipeline viram colunas. IDs viram int64 e as quebras (idade, gênero,
+    região) viram categóricas.
+    """
     if df.empty: return df
+
+    df_transformed = schema.coerce_keys(df.reset_index(drop=True))
+    action_cols, value_cols = [], []
+
+    if 'action_values' in df_transformed.columns:
+        value_columns = None if action_columns is None else [f'{col}_value' for col in action_columns]
+        df_values, _ = _explode_action_list(df_transformed['action_values'], suffix='_value', columns=value_columns)
+        df_transformed = df_transformed.drop(columns=['action_values'])
+        value_cols = [col for col in df_values.columns if col not in df_transformed.columns]
+        df_transformed = _merge_action_columns(df_transformed, df_values, first_seen=None)
+
+    if 'actions' in df_transformed.columns:
+        df_actions, first_seen = _explode_action_list(df_transformed['actions'], columns=action_columns)
+        action_cols = [col for col in df_actions.columns if col not in df_transformed.columns]
+        df_transformed = _merge_action_columns(df_transformed, df_actions, first_seen=first_seen)
+
+    non_count_cols = ['date_start', 'date_stop', 'account_id', 'ad_id', 'adset_id', 'campaign_id', 'age', 'gender', 'region', 'spend']
     
-    data = []
-    for _, insight in df.iterrows(): 
-        row = insight.to_dict()
-        if 'actions' in row and isinstance(row['actions'], list):
-            actions_list = row.pop('actions')
-            for action in actions_list:
-                action_type = action['action_type']
-                value = action['value']
-                
-                safe_col_name = action_type.replace('.', '_')
-                row[safe_col_name] = value 
-        data.append(row)
-
-    df_transformed = pd.DataFrame(data)
-    
-    
-    non_count_cols = ['date_start', 'date_stop', 'ad_id', 'adset_id', 'campaign_id', 'age', 'gender', 'region', 'spend']
-    
-    
-    required_metrics = ['spend', 'clicks', 'impressions', 'lead', 'purchase'] 
+    required_metrics = ['spend', 'clicks', 'impressions'] + (['lead', 'purchase'] if action_columns is None else action_columns)
     
     for col in required_metrics:
         if col not in df_transformed.columns:
             df_transformed[col] = 0
-            
-    monetary_cols = ['spend']
+
+    monetary_cols = ['spend'] + value_cols
     for col in monetary_cols:
         if col in df_transformed.columns:
             df_transformed[col] = pd.to_numeric(df_transformed[col], errors='coerce').fillna(0) 
 
-    count_cols = [col for col in df_transformed.columns if col not in non_count_cols and col not in monetary_cols]
+    count_cols = [col for col in df_transformed.columns
+                  if col not in non_count_cols and col not in monetary_cols]
     
+    # Contagens (inclusive ações) no menor inteiro seguro do schema, em vez de Int64
     for col in count_cols:
-        if col in df_transformed.columns:
-            df_transformed[col] = pd.to_numeric(df_transformed[col], errors='coerce').fillna(0)
-            df_transformed[col] = df_transformed[col].astype(pd.Int64Dtype())
+        df_transformed[col] = schema.to_count(df_transformed[col])
 
     return df_transformed
 
@@ -84,72 +148,181 @@ def _recalculate_metrics(df: pd.DataFrame) -> pd.DataFrame:
     df['ctr'] = df['total_clicks'] / df['total_impressions']
     
 
-    df = df.replace([float('inf'), -float('inf')], 0).fillna(0)
+    num_cols = df.select_dtypes('number').columns
+    df[num_cols] = df[num_cols].replace([float('inf'), -float('inf')], 0).fillna(0)
     
     return df
 
 
-def run_etl_pipeline_dim(total_days=1) -> pd.DataFrame:
+def run_etl_pipeline_dim(total_days=1, account_id=None, updated_since=None) -> pd.DataFrame:
     
-    df_raw = get_name_dim_raw(total_days=total_days) 
+    df_raw = get_name_dim_raw(total_days=total_days, account_id=account_id, updated_since=updated_since) 
     if df_raw.empty: return pd.DataFrame()
     
-    df_final = df_raw.drop_duplicates(subset=['ad_id'], keep='last')
-    return df_final[['ad_id', 'ad_name', 'adset_id', 'adset_name', 'campaign_id', 'campaign_name']]
+    df_final = df_raw.drop_duplicates(subset=['account_id', 'ad_id'], keep='last')
+    return df_final[['account_id', 'ad_id', 'ad_name', 'adset_id', 'adset_name', 'campaign_id', 'campaign_name']]
 
 
-def run_etl_pipeline_campaigns(total_days=182) -> pd.DataFrame:
-    df_raw = get_campaign_data_raw(total_days=total_days)
-    df_norm = _normalize_actions(df_raw)
+@metrics.timed('transform.campaigns')
+def _transform_campaigns(df_raw: pd.DataFrame) -> pd.DataFrame:
+    """Normaliza, agrega e recalcula métricas da extração de performance (ou de um bloco dela)."""
+    if df_raw.empty: return pd.DataFrame()
+
+    df_norm = _normalize_actions(df_raw, CAMPAIGN_ACTION_COLUMNS)
     
-    group_keys = ['date_start', 'ad_id', 'adset_id', 'campaign_id']
+    group_keys = ['account_id', 'date_start', 'ad_id', 'adset_id', 'campaign_id']
     df_agg = df_norm.groupby(group_keys, as_index=False).first()
 
     df_final = _recalculate_metrics(df_agg)
     
     
-    final_cols = ['date_start', 'ad_id', 'adset_id', 'campaign_id', 'total_impressions', 'total_clicks', 
+    final_cols = ['account_id', 'date_start', 'ad_id', 'adset_id', 'campaign_id', 'total_impressions', 'total_clicks', 
                   'total_spend', 'total_leads', 'total_successes', 'cpc', 'ctr', 'cpl'] 
     
     
     final_cols_safe = [col for col in final_cols if col in df_final.columns]
     
-    return df_final[final_cols_safe]
+    return schema.enforce_schema(df_final[final_cols_safe], 'ads_campaign_performance')
 
 
-def run_etl_pipeline_leads(total_days=182) -> pd.DataFrame:
-    """Processa a tabela de Leads unindo as extrações Demográfica e Geográfica (2-Way Merge)."""
-    df_demo_raw = get_lead_demographic_raw(total_days=total_days)
-    df_geo_raw = get_lead_geographic_raw(total_days=total_days)
-    
+def run_etl_pipeline_campaigns(total_days=182, since=None, until=None, account_id=None) -> pd.DataFrame:
+    df_raw = get_campaign_data_raw(total_days=total_days, since=since, until=until, account_id=account_id)
+    return _transform_campaigns(df_raw)
+
+
+def stream_etl_pipeline_campaigns(total_days=182, since=None, until=None, chunk_rows=None, account_id=None):
+    """Versão em streaming de run_etl_pipeline_campaigns: gera blocos transformados de até chunk_rows linhas."""
+    for df_raw in iter_campaign_data_raw(total_days=total_days, since=since, until=until, chunk_rows=chunk_rows,
+                                         account_id=account_id):
+        df_final = _transform_campaigns(df_raw)
+        if not df_final.empty:
+            yield df_final
+
+
+# Cada quebra é gravada na sua própria granularidade (formato longo, chave breakdown_type);
+# as dimensões que não pertencem à quebra ficam com LEAD_BREAKDOWN_ALL.
+LEAD_BREAKDOWNS = {'demographic': ['age', 'gender'], 'geographic': ['region']}
+LEAD_BREAKDOWN_ALL = 'all'
+
+
+def _transform_lead_breakdown(df_raw: pd.DataFrame, breakdown_type: str) -> pd.DataFrame:
+    """Normaliza e recalcula as métricas de uma quebra (uma linha por anúncio/dia/combinação da quebra)."""
+    if df_raw.empty: return pd.DataFrame()
+
+    df_norm = _normalize_actions(df_raw, ALLOWED_ACTION_COLUMNS)
+    df_norm['breakdown_type'] = breakdown_type
+    for col in schema.BREAKDOWN_COLS:
+        if col not in LEAD_BREAKDOWNS[breakdown_type] or col not in df_norm.columns:
+            df_norm[col] = LEAD_BREAKDOWN_ALL
+
+    return _recalculate_metrics(df_norm)
+
+
+@metrics.timed('transform.leads')
+def _transform_leads(df_demo_raw: pd.DataFrame, df_geo_raw: pd.DataFrame) -> pd.DataFrame:
+    """Empilha as quebras Demográfica e Geográfica, cada uma na sua granularidade.
 
-    if df_demo_raw.empty and df_geo_raw.empty:
+    Não há cruzamento idade × gênero × região: somar as métricas dentro de um mesmo
+    breakdown_type dá o total do anúncio no dia, sem dupla contagem.
+    """
+    frames = [
+        _transform_lead_breakdown(df_demo_raw, 'demographic'),
+        _transform_lead_breakdown(df_geo_raw, 'geographic'),
+    ]
+    frames = [df for df in frames if not df.empty]
+    if not frames:
         return pd.DataFrame()
-        
-    df_demo = _normalize_actions(df_demo_raw)
-    df_geo = _normalize_actions(df_geo_raw)
 
-    base_merge_keys = ['date_start', 'ad_id', 'adset_id', 'campaign_id', 'impressions', 'clicks', 'spend']
-    merge_keys_base = [k for k in base_merge_keys if k not in ['spend', 'impressions', 'clicks']] 
-    
-    df_base = df_demo
-    
-    df_geo_subset = df_geo[['region'] + merge_keys_base].drop_duplicates()
-    
-    df_final = pd.merge(df_base, df_geo_subset, 
-                        on=merge_keys_base,
-                        how='outer',
-                        suffixes=('_demo', '_geo')) 
-    
-    
-    df_final = df_final.loc[:,~df_final.columns.duplicated()].copy()
-    df_final = df_final.fillna(0)
-    
-    df_recalc = _recalculate_metrics(df_final)
-    
-    group_keys = ['date_start', 'ad_id', 'adset_id', 'campaign_id', 'age', 'gender', 'region']
-    
-    final_cols = group_keys + ['total_spend', 'total_leads'] + [col for col in ALLOWED_ACTION_COLUMNS if col in df_recalc.columns]
+    df_final = schema.fill_missing(pd.concat(frames, ignore_index=True))
+
+    key_cols = ['account_id', 'date_start', 'ad_id', 'adset_id', 'campaign_id', 'breakdown_type', 'age', 'gender', 'region']
+    final_cols = key_cols + ['total_spend', 'total_leads'] + [col for col in ALLOWED_ACTION_COLUMNS if col in df_final.columns]
     final_cols = list(dict.fromkeys(final_cols))
 
-    return df_recalc[[col for col in final_cols if col in df_recalc.columns]]
\ No newline at end of file
+    df_out = df_final[[col for col in final_cols if col in df_final.columns]]
+    return schema.enforce_schema(df_out, 'ads_lead_insights', count_cols=ALLOWED_ACTION_COLUMNS)
+
+
+def _extract_leads_breakdowns(total_days=182, since=None, until=None, account_id=None) -> tuple:
+    """Extrai as quebras Demográfica e Geográfica em paralelo (são independentes)."""
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        demo = executor.submit(get_lead_demographic_raw, total_days=total_days, since=since, until=until, account_id=account_id)
+        geo = executor.submit(get_lead_geographic_raw, total_days=total_days, since=since, until=until, account_id=account_id)
+        return demo.result(), geo.result()
+
+
+def run_etl_pipeline_leads(total_days=182, since=None, until=None, account_id=None) -> pd.DataFrame:
+    """Processa a tabela de Leads com as extrações Demográfica e Geográfica, cada uma na sua granularidade."""
+    df_demo_raw, df_geo_raw = _extract_leads_breakdowns(total_days=total_days, since=since, until=until,
+                                                        account_id=account_id)
+    return _transform_leads(df_demo_raw, df_geo_raw)
+
+
+def stream_etl_pipeline_leads(total_days=182, since=None, until=None, window_days=None, account_id=None):
+    """Versão em streaming de run_etl_pipeline_leads: extrai, transforma e gera um bloco por janela de datas."""
+    for window in get_time_windows(total_days, since=since, until=until, window_days=window_days):
+        df_demo_raw, df_geo_raw = _extract_leads_breakdowns(since=window['since'], until=window['until'],
+                                                            account_id=account_id)
+        df_final = _transform_leads(df_demo_raw, df_geo_raw)
+        if not df_final.empty:
+            yield df_final
+
+
+def _flatten_field_data(field_data: pd.Series, names: list) -> pd.DataFrame:
+    """Colunas field_<nome> com os valores das chaves pedidas de field_data ([{'name', 'values'}]); vários valores unidos por ', '."""
+    def pick(entries):
+        return {
+            entry['name']: ', '.join(str(value) for value in entry.get('values') or [])
+            for entry in (entries if isinstance(entries, list) else [])
+            if entry.get('name') in names
+        }
+
+    flat = pd.DataFrame(field_data.map(pick).tolist(), index=field_data.index)
+    return flat.reindex(columns=names).add_prefix('field_')
+
+
+@metrics.timed('transform.raw_leads')
+def _transform_raw_leads(df_raw: pd.DataFrame, flatten_fields: list = None) -> pd.DataFrame:
+    """Prepara os leads brutos para ads_raw_leads.
+
+    IDs viram inteiros, created_time vira timestamp UTC e field_data/ad_platform_data são
+    serializados em JSON uma única vez (o cast para JSONB acontece no banco). Com flatten_fields
+    (padrão: RAW_LEADS_FLATTEN_FIELDS), as chaves comuns de field_data também viram colunas.
+    """
+    if df_raw.empty: return pd.DataFrame()
+    flatten_fields = RAW_LEADS_FLATTEN_FIELDS if flatten_fields is None else flatten_fields
+
+    df = schema.coerce_keys(df_raw.copy())
+    for col in ['lead_id', 'form_id']:
+        if col in df.columns:
+            df[col] = schema.to_id(df[col])
+    df['created_time'] = pd.to_datetime(df['created_time'], utc=True, errors='coerce')
+
+    flat_cols = []
+    if flatten_fields and 'field_data' in df.columns:
+        df_flat = _flatten_field_data(df['field_data'], flatten_fields)
+        flat_cols = list(df_flat.columns)
+        df = pd.concat([df, df_flat], axis=1)
+
+    for col in RAW_LEADS_JSON_COLS:
+        if col in df.columns:
+            df[col] = df[col].map(lambda v: json.dumps(v, ensure_ascii=False) if isinstance(v, (list, dict)) else None)
+
+    final_cols = ['account_id', 'lead_id', 'created_time', 'ad_id', 'adset_id', 'campaign_id', 'form_id'] + RAW_LEADS_JSON_COLS + flat_cols
+    df = df[[col for col in final_cols if col in df.columns]]
+    return df.drop_duplicates(subset='lead_id', keep='last')
+
+
+def run_etl_pipeline_raw_leads(total_days=182, since=None, until=None, page_id=None) -> pd.DataFrame:
+    """Leads brutos criados no período (de uma Página ou de todas), prontos para ads_raw_leads."""
+    frames = [_transform_raw_leads(df_raw) for df_raw in
+              iter_raw_leads_data(total_days, since=since, until=until, chunk_rows=float('inf'), page_id=page_id)]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+def stream_etl_pipeline_raw_leads(total_days=182, since=None, until=None, chunk_rows=None, page_id=None):
+    """Versão em streaming de run_etl_pipeline_raw_leads: um bloco transformado a cada chunk_rows leads."""
+    for df_raw in iter_raw_leads_data(total_days, since=since, until=until, chunk_rows=chunk_rows, page_id=page_id):
+        df_final = _transform_raw_leads(df_raw)
+        if not df_final.empty:
+            yield df_final
@@ -0,0 +1,94 @@
+import datetime
+
+import pytest
+
+from src import cache, extract, main, state
+
+
+ACCOUNT = 'act_1000'
+FAILING_DAY = '2026-01-09'
+
+
+def _insight(day: str) -> dict:
+    return {'ad_id': '120000000000', 'adset_id': '230000000000', 'campaign_id': '340000000000',
+            'impressions': '100', 'clicks': '5', 'spend': '12.50',
+            'actions': [{'action_type': 'lead', 'value': '2'}], 'date_start': day, 'date_stop': day}
+
+
+@pytest.fixture
+def backfill_env(tmp_path, monkeypatch):
+    """Backfill de ads_campaign_performance sem rede nem banco; a janela de FAILING_DAY falha enquanto failing['on']."""
+    monkeypatch.setattr(state, 'WATERMARK_BACKEND', 'file')
+    monkeypatch.setattr(state, 'WATERMARK_FILE', str(tmp_path / 'watermarks.json'))
+    monkeypatch.setattr(state, 'CHECKPOINT_FILE', str(tmp_path / 'backfill_units.json'))
+    monkeypatch.setattr(cache, 'RAW_CACHE_ENABLED', False)
+    monkeypatch.setattr(cache, 'REPLAY', False)
+    for name in ('APP_ID', 'APP_SECRET', 'ACCESS_TOKEN'):
+        monkeypatch.setattr(extract, name, 'test')
+    monkeypatch.setattr(extract, 'INSIGHTS_ASYNC', False)
+    monkeypatch.setattr(extract, 'INSIGHTS_SHARD_DAYS', 1)
+    monkeypatch.setattr(main, 'BACKFILL_UNIT_DAYS', 7)
+    monkeypatch.setattr(main, '_load_or_fail', lambda df, table_name: len(df))
+    monkeypatch.setattr(main, '_refresh_rollups', lambda table_name, ranges: None)
+
+    failing = {'on': True}
+
+    def fetch_window(account, params, time_range, spec):
+        if failing['on'] and time_range['since'] == FAILING_DAY:
+            raise ConnectionError('conexão perdida')
+        return [_insight(time_range['since'])]
+
+    monkeypatch.setattr(extract, '_fetch_insights_window', fetch_window)
+    return failing
+
+
+def _backfill(resume: bool = False) -> int:
+    plan = main.build_backfill_plan('2026-01-01', '2026-01-20', account_ids=[ACCOUNT], jobs=('performance',),
+                                    resume=resume)
+    return main._backfill_fact(main.run_etl_pipeline_campaigns, main.CAMPAIGN_TABLE, plan['performance'],
+                               '2026-01-01', '2026-01-20', incremental=True)
+
+
+def test_failed_extraction_marks_unit_failed_and_holds_watermark(backfill_env):
+    with pytest.raises(RuntimeError, match='--resume'):
+        _backfill()
+
+    units = state.get_units(main.CAMPAIGN_TABLE, ACCOUNT)
+    assert units[('2026-01-08', '2026-01-14')]['status'] == 'failed'
+    assert units[('2026-01-08', '2026-01-14')]['error'] == 'conexão perdida'
+    assert units[('2026-01-01', '2026-01-07')] == {'status': 'done', 'rows': 7, 'error': None, 'attempts': 1}
+    assert units[('2026-01-15', '2026-01-20')]['status'] == 'done'
+    assert state.get_watermark(main.CAMPAIGN_TABLE, ACCOUNT) is None
+
+
+def test_resume_retries_only_the_failed_unit(backfill_env):
+    with pytest.raises(RuntimeError):
+        _backfill()
+
+    backfill_env['on'] = False
+    assert _backfill(resume=True) == 7
+
+    units = state.get_units(main.CAMPAIGN_TABLE, ACCOUNT)
+    assert {unit['status'] for unit in units.values()} == {'done'}
+    assert units[('2026-01-08', '2026-01-14')]['attempts'] == 2
+    assert units[('2026-01-01', '2026-01-07')]['attempts'] == 1
+    assert state.get_watermark(main.CAMPAIGN_TABLE, ACCOUNT) == datetime.date(2026, 1, 20)
+
+
+def test_backfill_after_a_gap_holds_watermark(backfill_env):
+    backfill_env['on'] = False
+    state.set_watermark(main.CAMPAIGN_TABLE, ACCOUNT, datetime.date(2025, 12, 20))
+
+    _backfill()
+
+    # 21 a 31/12 não foram carregados: avançar para 20/01 esconderia esses dias do incremental
+    assert state.get_watermark(main.CAMPAIGN_TABLE, ACCOUNT) == datetime.date(2025, 12, 20)
+
+
+def test_backfill_contiguous_with_watermark_advances_it(backfill_env):
+    backfill_env['on'] = False
+    state.set_watermark(main.CAMPAIGN_TABLE, ACCOUNT, datetime.date(2025, 12, 31))
+
+    _backfill()
+
+    assert state.get_watermark(main.CAMPAIGN_TABLE, ACCOUNT) == datetime.date(2026, 1, 20)
@@ -0,0 +1,140 @@
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src import schema, transform
+
+
+ACTION_TYPES = [
+    'lead', 'purchase', 'link_click', 'comment', 'video_view',
+    'offsite_conversion.fb_pixel_lead', 'onsite_conversion.lead_grouped',
+]
+NON_COUNT_COLS = ['date_start', 'date_stop', 'account_id', 'ad_id', 'adset_id', 'campaign_id', 'age', 'gender', 'region', 'spend']
+
+
+def _normalize_actions_reference(df: pd.DataFrame, action_columns: list = None) -> pd.DataFrame:
+    """Implementação linha a linha (iterrows) anterior à vetorização, com a tipagem atual do schema."""
+    if df.empty: return df
+    wanted = None if action_columns is None else set(action_columns)
+
+    data, value_cols = [], []
+    for _, insight in df.iterrows():
+        row = insight.to_dict()
+        values_list = row.pop('action_values', None)
+        if isinstance(values_list, list):
+            for action in values_list:
+                col = action['action_type'].replace('.', '_')
+                if wanted is None or col in wanted:
+                    row[f'{col}_value'] = action['value']
+                    value_cols.append(f'{col}_value')
+        if 'actions' in row and isinstance(row['actions'], list):
+            for action in row.pop('actions'):
+                col = action['action_type'].replace('.', '_')
+                if wanted is None or col in wanted:
+                    row[col] = action['value']
+        data.append(row)
+
+    df_transformed = schema.coerce_keys(pd.DataFrame(data))
+    if action_columns is not None:
+        declared = []
+        if 'action_values' in df.columns:
+            declared += [f'{col}_value' for col in action_columns]
+            value_cols += [f'{col}_value' for col in action_columns]
+        if 'actions' in df.columns:
+            declared += action_columns
+        for col in declared:
+            if col not in df_transformed.columns:
+                df_transformed[col] = np.nan
+
+    required_metrics = ['spend', 'clicks', 'impressions'] + (['lead', 'purchase'] if action_columns is None else action_columns)
+    for col in required_metrics:
+        if col not in df_transformed.columns:
+            df_transformed[col] = 0
+
+    monetary_cols = ['spend'] + list(dict.fromkeys(value_cols))
+    for col in monetary_cols:
+        if col in df_transformed.columns:
+            df_transformed[col] = pd.to_numeric(df_transformed[col], errors='coerce').fillna(0)
+
+    for col in df_transformed.columns:
+        if col not in NON_COUNT_COLS and col not in monetary_cols:
+            df_transformed[col] = schema.to_count(df_transformed[col])
+    return df_transformed
+
+
+def _random_actions(rnd: random.Random, suffix_values: bool = False):
+    """Lista de ações (com tipos repetidos às vezes) ou ausência de lista (NaN/None)."""
+    roll = rnd.random()
+    if roll < 0.15:
+        return np.nan
+    if roll < 0.2:
+        return None
+    types = rnd.choices(ACTION_TYPES, k=rnd.randint(0, 6))
+    if suffix_values:
+        return [{'action_type': t, 'value': f'{rnd.uniform(1, 500):.2f}'} for t in types]
+    return [{'action_type': t, 'value': str(rnd.randint(0, 40))} for t in types]
+
+
+def _random_frame(seed: int) -> pd.DataFrame:
+    rnd = random.Random(seed)
+    n_rows = rnd.randint(1, 40)
+    with_values = rnd.random() < 0.5
+    with_breakdown = rnd.random() < 0.5
+
+    rows = []
+    for _ in range(n_rows):
+        row = {
+            'ad_id': str(120212345678900000 + rnd.randint(0, 5)),
+            'adset_id': str(230212345678900000 + rnd.randint(0, 2)),
+            'campaign_id': str(340212345678900000 + rnd.randint(0, 1)),
+            'impressions': str(rnd.randint(0, 5000)),
+            'clicks': str(rnd.randint(0, 200)),
+            'spend': f'{rnd.uniform(0, 300):.2f}',
+            'actions': _random_actions(rnd),
+        }
+        if with_values:
+            row['action_values'] = _random_actions(rnd, suffix_values=True)
+        if with_breakdown:
+            row['age'] = rnd.choice(['18-24', '25-34', '35-44'])
+        row['date_start'] = row['date_stop'] = f'2026-01-{rnd.randint(1, 28):02d}'
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+@pytest.mark.parametrize('seed', range(150))
+def test_matches_row_by_row_reference(seed):
+    df_raw = _random_frame(seed)
+
+    expected = _normalize_actions_reference(df_raw.copy())
+    result = transform._normalize_actions(df_raw.copy())
+
+    # As colunas '<ação>_value' são montadas antes das ações; a ordem só é garantida sem action_values
+    pd.testing.assert_frame_equal(result, expected, check_like='action_values' in df_raw.columns)
+
+
+@pytest.mark.parametrize('seed', range(150, 200))
+def test_declared_action_columns_match_reference(seed):
+    df_raw = _random_frame(seed)
+
+    expected = _normalize_actions_reference(df_raw.copy(), transform.CAMPAIGN_ACTION_COLUMNS)
+    result = transform._normalize_actions(df_raw.copy(), transform.CAMPAIGN_ACTION_COLUMNS)
+
+    pd.testing.assert_frame_equal(result, expected, check_like=True)
+
+
+def test_repeated_and_missing_actions():
+    df_raw = pd.DataFrame({
+        'ad_id': ['1', '2', '3'], 'adset_id': ['1', '1', '1'], 'campaign_id': ['1', '1', '1'],
+        'impressions': ['10', '20', '30'], 'clicks': ['1', '2', '3'], 'spend': ['1.0', '2.0', '3.0'],
+        'actions': [[{'action_type': 'lead', 'value': '2'}, {'action_type': 'lead', 'value': '5'}], np.nan,
+                    [{'action_type': 'onsite_conversion.lead_grouped', 'value': '1'}]],
+        'date_start': ['2026-01-01'] * 3, 'date_stop': ['2026-01-01'] * 3,
+    })
+
+    result = transform._normalize_actions(df_raw.copy())
+
+    pd.testing.assert_frame_equal(result, _normalize_actions_reference(df_raw.copy()))
+    assert result['lead'].tolist() == [5, 0, 0]
+    assert result['onsite_conversion_lead_grouped'].tolist() == [0, 0, 1]
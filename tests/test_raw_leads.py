@@ -0,0 +1,63 @@
+import pandas as pd
+
+from src import extract, main, orchestrator, parquet_sink
+
+
+def test_leads_are_tagged_with_the_account_of_their_ad():
+    df = pd.DataFrame({
+        'lead_id': ['1', '2', '3', '4'],
+        'ad_id': ['120000000001', '120000000002', None, '120000000099'],
+    })
+    ad_accounts = {'120000000001': 1000, '120000000002': 2000}
+
+    result = extract._tag_leads_accounts(df, ad_accounts, fallback_account=1000)
+
+    # Orgânico (sem anúncio) e anúncio fora do cache de nomes ficam com a conta padrão
+    assert result.columns[0] == 'account_id'
+    assert result['account_id'].tolist() == [1000, 2000, 1000, 1000]
+    assert result['account_id'].dtype == 'int64'
+
+
+def test_leads_without_ad_column_use_fallback_account():
+    result = extract._tag_leads_accounts(pd.DataFrame({'lead_id': ['1', '2']}), {}, fallback_account=3000)
+
+    assert result['account_id'].tolist() == [3000, 3000]
+
+
+def test_leads_of_two_pages_share_the_account_day_partition(tmp_path, monkeypatch):
+    monkeypatch.setattr(parquet_sink, 'ETL_SINK', 'parquet')
+    monkeypatch.setattr(parquet_sink, 'PARQUET_DIR', str(tmp_path))
+    monkeypatch.setattr(main, '_refresh_rollups', lambda table_name, ranges: None)
+    page_leads = {'111': ['1', '2'], '222': ['3']}
+
+    def stream_fn(total_days, page_id, since, until):
+        yield pd.DataFrame({
+            'account_id': [1000] * len(page_leads[page_id]),
+            'lead_id': page_leads[page_id],
+            'created_time': pd.to_datetime(['2026-01-05T12:00:00+0000'] * len(page_leads[page_id])),
+        })
+
+    window = {'since': '2026-01-05', 'until': '2026-01-05'}
+    main._stream_fact(stream_fn, main.RAW_LEADS_TABLE, {'111': window, '222': window}, incremental=False,
+                      key_arg='page_id')
+
+    # A segunda Página não pode descartar o que a primeira gravou na mesma partição (conta, dia)
+    df = pd.read_parquet(tmp_path / main.RAW_LEADS_TABLE / 'account_id=1000' / 'created_date=2026-01-05')
+    assert sorted(df['lead_id']) == ['1', '2', '3']
+
+
+def test_raw_leads_wait_for_the_dimension_load(monkeypatch):
+    monkeypatch.setattr(main, 'LEADS_PAGE_IDS', ['111'])
+    calls = []
+    monkeypatch.setattr(main, '_extract_accounts', lambda pipeline_fn, jobs: calls.append('dimensao.extract'))
+    monkeypatch.setattr(main, '_load_dim', lambda extracted, incremental: calls.append('dimensao.load'))
+    monkeypatch.setattr(main, '_stream_fact', lambda *args, **kwargs: calls.append('raw_leads.stream'))
+
+    tasks = main.build_tasks(False, {'since': '2026-01-05', 'until': '2026-01-05'}, streaming=True,
+                             account_ids=['act_1000'], jobs=('dim', 'raw_leads'))
+    report = orchestrator.run_tasks(tasks)
+
+    # Os leads de anúncios novos só ganham a conta certa depois que a dimensão atualiza o cache de nomes
+    assert {name: task['status'] for name, task in report.items()} == {
+        'dimensao.extract': 'success', 'dimensao.load': 'success', 'raw_leads.stream': 'success'}
+    assert calls == ['dimensao.extract', 'dimensao.load', 'raw_leads.stream']
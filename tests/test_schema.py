@@ -0,0 +1,38 @@
+import pandas as pd
+
+from src import schema, transform
+
+
+def test_to_id_keeps_exact_values_with_nulls():
+    ids = pd.Series(['120212345678901234', None, '120212345678901237'])
+
+    result = schema.to_id(ids)
+
+    assert str(result.dtype) == 'Int64'
+    assert result.tolist() == [120212345678901234, pd.NA, 120212345678901237]
+
+
+def test_to_id_without_nulls_is_int64():
+    result = schema.to_id(pd.Series(['120212345678901234', '120212345678901237']))
+
+    assert result.dtype == 'int64'
+    assert result.tolist() == [120212345678901234, 120212345678901237]
+
+
+def test_raw_leads_keep_ids_when_organic_leads_have_no_ad():
+    df_raw = pd.DataFrame({
+        'account_id': [1000, 1000],
+        'lead_id': ['990012345678901234', '990012345678901237'],
+        'created_time': ['2026-01-05T12:00:00+0000', '2026-01-05T13:00:00+0000'],
+        'ad_id': ['120212345678901234', None],
+        'adset_id': ['230212345678901234', None],
+        'campaign_id': ['340212345678901234', None],
+        'form_id': ['450212345678901234', '450212345678901234'],
+        'field_data': [[], []],
+    })
+
+    df = transform._transform_raw_leads(df_raw, flatten_fields=[])
+
+    assert df['lead_id'].tolist() == [990012345678901234, 990012345678901237]
+    assert df['ad_id'].tolist() == [120212345678901234, pd.NA]
+    assert df['campaign_id'].tolist() == [340212345678901234, pd.NA]